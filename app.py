@@ -1,10 +1,30 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import os
 import time
 import altair as alt
 from datetime import datetime, timedelta, timezone
 
+from chart_specs import compare_spec, trend_spec
+from compare import align_samples, coarsen, grid_means, peer_summary, sensor_totals
+from downsample import bucket_width_ns, minmax_downsample
+from event_engine import CHANNEL_NAMES, KIND_ONSET, KIND_RECOVERY, EventEngine, EventLog
+from export import EVENT_COLUMNS, FORMATS, HISTORY_COLUMNS, ExportService, event_chunks, history_chunks
+from history_store import HistoryStore
+from ingest import IngestService
+from mail_dispatcher import MailDispatcher
+from metrics import Metrics, MetricsServer
+from rollup import Rollup, rollup_frame
+from snapshot import SnapshotPublisher
+from spectrum import band_rms, sample_rate, vibration_severity, welch_psd
+from simulator import FleetSimulator
+from status_engine import FleetStatusEngine
+from table_style import Z_COLUMN, style_compare
+from threshold_registry import ThresholdRegistry
+from timeseries_store import NS_PER_SEC, SampleStore, to_frame
+from topology import Topology, TopologyRegistry, even_topology
+
 # ページ設定
 st.set_page_config(page_title="振動センサー監視システム", layout="wide")
 
@@ -45,8 +65,108 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 設定：エリアとセンサーの構成 ---
-AREAS = [f"エリア {chr(65+i)}" for i in range(13)]
-TOTAL_SENSORS = 110
+# 構成ファイル（CSV: sensor_id,area[,number]）。ファイルがない場合は既定の構成
+# （13エリアに110センサーを均等配置）で動かす。ファイルを書き換えると再起動なしで反映される
+TOPOLOGY_FILE = os.environ.get(
+    "SENSOR_TOPOLOGY_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "topology.csv")
+)
+DEFAULT_AREAS = [f"エリア {chr(65+i)}" for i in range(13)]
+DEFAULT_TOTAL_SENSORS = 110
+
+# 時系列ストアの保持期間（1Hz サンプリング想定）
+SAMPLE_PERIOD_SEC = 1
+HISTORY_SECONDS = 3600
+
+# デモ用の模擬データ（simulator.FleetSimulator）。同じ乱数の種なら同じ波形・故障が再現される。
+# 単発スパイクの確率（1サンプルあたり）と、センサー1台・1日あたりの故障（軸受け・アンバランス・電池）の件数
+SIM_SEED = int(os.environ.get("SENSOR_SIM_SEED", "0"))
+SIM_SPIKE_PROB = 0.05
+SIM_FAULTS_PER_SENSOR_DAY = 2
+SIM_FAULT_DAYS = 7
+
+# ディスク上の履歴データの保存先
+HISTORY_DIR = os.environ.get(
+    "SENSOR_HISTORY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "history")
+)
+
+# 閾値設定の保存先（全セッション共通）
+THRESHOLD_DB = os.environ.get(
+    "SENSOR_THRESHOLD_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "thresholds.db")
+)
+
+# 異常イベントログの保存先と、異常履歴画面の1ページあたりの件数
+EVENT_DB = os.environ.get(
+    "SENSOR_EVENT_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "events.db")
+)
+HISTORY_PAGE_SIZE = 50
+
+# 警報メールの設定の保存先と SMTP サーバー。SENSOR_SMTP_HOST 未設定の場合は送信せず画面で内容を確認する
+MAIL_DB = os.environ.get(
+    "SENSOR_MAIL_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "mail.db")
+)
+SMTP_HOST = os.environ.get("SENSOR_SMTP_HOST")
+SMTP_PORT = int(os.environ.get("SENSOR_SMTP_PORT", "25"))
+SMTP_SENDER = os.environ.get("SENSOR_SMTP_FROM", "sensor-monitor@localhost")
+SMTP_USER = os.environ.get("SENSOR_SMTP_USER")
+SMTP_PASSWORD = os.environ.get("SENSOR_SMTP_PASSWORD")
+SMTP_STARTTLS = os.environ.get("SENSOR_SMTP_STARTTLS") == "1"
+# 同じ宛先へのダイジェストメールの最短間隔（秒）
+MAIL_DIGEST_SEC = 60
+
+# 実センサーからの受信ポート（UDP）。未設定の場合はデモ用の模擬データで動かす
+INGEST_PORT = os.environ.get("SENSOR_INGEST_PORT")
+
+# エクスポートファイルの保存先。画面からダウンロードできるのは EXPORT_DOWNLOAD_LIMIT バイトまで
+# （それより大きいファイルはサーバー上のパスを表示する）
+EXPORT_DIR = os.environ.get(
+    "SENSOR_EXPORT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "exports")
+)
+EXPORT_DOWNLOAD_LIMIT = 200 * 1024 * 1024
+
+# 画面処理の計測（段階ごとの所要時間・送信データ量・キャッシュのヒット率）。SENSOR_METRICS=0 で無効。
+# SENSOR_METRICS_PORT を設定すると、そのポートの /metrics で Prometheus 形式のテキストを返す（ローカルからのみ）
+METRICS_ENABLED = os.environ.get("SENSOR_METRICS", "1") != "0"
+METRICS_PORT = os.environ.get("SENSOR_METRICS_PORT")
+# 診断画面を表示できるユーザー（カンマ区切り）。既定では誰も表示できない
+ADMIN_USERS = {u.strip() for u in os.environ.get("SENSOR_ADMIN_USERS", "").split(",") if u.strip()}
+
+# 全セッション共有スナップショットの更新周期（秒）
+SNAPSHOT_INTERVAL_SEC = 1
+
+# リアルタイム監視の表の自動更新間隔（秒）。None は手動更新
+LIVE_INTERVALS = {"停止": None, "1秒": 1, "2秒": 2, "5秒": 5}
+
+# リアルタイム監視の表: 1ページの行数と、絞り込み・並べ替えの選択肢（軸は status_engine.AXES の位置）
+TABLE_PAGE_SIZE = 50
+ALL_AREAS = "全エリア"
+TABLE_AXES = {"全軸": None, "X軸": 0, "Y軸": 1, "Z軸": 2, "電圧": 3}
+TABLE_SORTS = ["センサー順", "閾値比の高い順"]
+
+# ロールアップの段階（バケット幅秒: (保持バケット数, 合計・二乗和の型)）。
+# 1分幅は件数が少ないので float32 で持つ（10,000センサーで 1分幅 約1.1GB + 1時間幅 約180MB。rollup.py 参照）
+ROLLUP_LEVELS = {60: (24 * 60, np.float32), 3600: (24 * 7, np.float64)}
+
+# グラフ分析の表示期間: (秒, 参照するロールアップ幅秒。None は生データ)
+# 生データの場合の1系列あたり最大描画点数はグラフ幅のピクセル数程度とする
+PERIODS = {"1時間": (3600, None), "24時間": (86400, 60), "1週間": (604800, 3600)}
+MAX_CHART_POINTS = 800
+
+# 複数センサー比較: 重ねて表示できる最大センサー数と、共通時間グリッドの点数（目安）
+MAX_COMPARE_SENSORS = 50
+COMPARE_POINTS = 240
+COMPARE_AXES = {"X軸 (G)": 0, "Y軸 (G)": 1, "Z軸 (G)": 2, "電圧 (V)": 3}
+
+# 周波数解析（Welch 法）: 解析に使う直近のサンプル数と、FFT 1区間のサンプル数
+SPECTRUM_SAMPLES = 256
+SPECTRUM_NPERSEG = 64
+# バンド RMS の帯域（ナイキスト周波数に対する割合。サンプリング周波数によらず同じ区切りになる）
+SPECTRUM_BANDS = {"低域": (0.0, 0.2), "中域": (0.2, 0.6), "高域": (0.6, 1.0)}
 
 DEFAULT_THRESHOLDS = {
     "x": 0.5,
@@ -55,15 +175,40 @@ DEFAULT_THRESHOLDS = {
     "v": 2.8
 }
 
+@st.cache_resource
+def get_metrics():
+    # 計測値はプロセス全体で1つ（全セッション共通）
+    return Metrics(enabled=METRICS_ENABLED)
+
+@st.cache_resource
+def get_metrics_server():
+    if not METRICS_PORT:
+        return None
+    return MetricsServer(get_metrics(), port=int(METRICS_PORT)).start()
+
+METRICS = get_metrics()
+METRICS.begin_run()
+get_metrics_server()
+
+@st.cache_resource
+def get_topology_registry():
+    return TopologyRegistry(TOPOLOGY_FILE, lambda version: even_topology(DEFAULT_AREAS, DEFAULT_TOTAL_SENSORS, version))
+
+# この実行で使うセンサー構成。配列で持つデータはすべてこの並び（エリアごとに連続）に従う
+topology = get_topology_registry().current
+AREAS = topology.area_names
+SENSOR_IDS = topology.sensor_ids
+TOTAL_SENSORS = len(topology)
+AREA_SLICES = topology.area_slices
+SENSOR_AREA_INDEX = topology.sensor_area
+
 def get_sensors_by_area(area_name):
-    area_index = AREAS.index(area_name)
-    avg = TOTAL_SENSORS // len(AREAS)
-    start_id = area_index * avg + 1
-    if area_index == len(AREAS) - 1:
-        end_id = TOTAL_SENSORS
-    else:
-        end_id = start_id + avg - 1
-    return [f"Sensor-{str(i).zfill(3)}" for i in range(start_id, end_id + 1)]
+    return topology.sensors_in(area_name)
+
+def ensure_current_topology():
+    # 一定間隔で再実行される部分（st.fragment）は、構成が変わっていたらアプリ全体を再実行して取り直す
+    if get_topology_registry().current is not topology:
+        st.rerun()
 
 # --- セッション状態 ---
 if "auth" in st.query_params and st.query_params["auth"] == "true":
@@ -74,140 +219,478 @@ elif 'logged_in' not in st.session_state:
 if 'table_key' not in st.session_state:
     st.session_state['table_key'] = 0
 
-if 'sensor_configs' not in st.session_state:
-    st.session_state['sensor_configs'] = {} 
+# センサー構成が変わったら、前の構成のエリア・センサーを指している選択状態を破棄する
+if st.session_state.get('topology_version') != topology.version:
+    st.session_state['topology_version'] = topology.version
+    for key in ('snapshot', 'dialog_target', 'monitor_area', 'h_area', 'th_area', 'th_target',
+                'compare_areas', 'compare_sensors', 'table_page', 'x_area', 'x_sensors'):
+        st.session_state.pop(key, None)
 
-if 'email_config' not in st.session_state:
-    st.session_state['email_config'] = {
-        "address": "admin@example.com",
-        "enable_alert": True,
-        "enable_recovery": False
-    }
+# --- ヘルパー関数 ---
+# センサー構成ごとに作るリソース。構成が変わると作り直され、古い方は破棄される
+TOPOLOGY_HASH = {Topology: lambda t: t.version}
 
-if 'reset_counts' not in st.session_state:
-    st.session_state['reset_counts'] = {}
+def topology_resource(func=None, **kwargs):
+    return st.cache_resource(func, max_entries=1, hash_funcs=TOPOLOGY_HASH, **kwargs)
+
+@topology_resource
+def get_threshold_registry(topology):
+    return ThresholdRegistry(THRESHOLD_DB, topology.sensor_ids, topology.area_slices, DEFAULT_THRESHOLDS)
 
-# --- ヘルパー関数 ---
 def get_sensor_thresholds(sensor_id):
-    if sensor_id in st.session_state['sensor_configs']:
-        return st.session_state['sensor_configs'][sensor_id]
-    else:
-        return DEFAULT_THRESHOLDS
+    return get_threshold_registry(topology).get(sensor_id)
 
 # --- データ生成関数 ---
-def generate_area_data(sensors):
-    data = []
-    for s in sensors:
-        limits = get_sensor_thresholds(s)
-        rand_val = np.random.random()
-        x = np.random.normal(0.02, 0.05)
-        y = np.random.normal(0.02, 0.05)
-        z = np.random.normal(1.0, 0.05)
-        v = np.random.normal(3.3, 0.02)
-        status_list = []
-
-        if rand_val > 0.90:
-            if np.random.random() > 0.5:
-                x = limits['x'] + np.random.uniform(0.1, 0.5)
-                status_list.append("X軸")
-            if np.random.random() > 0.8:
-                y = limits['y'] + np.random.uniform(0.1, 0.5)
-                status_list.append("Y軸")
-            if np.random.random() > 0.9:
-                v = limits['v'] - np.random.uniform(0.1, 0.5)
-                status_list.append("電圧")
-
-        if len(status_list) > 0:
-            status_str = "⚠️ 異常 (" + ",".join(status_list) + ")"
-        else:
-            status_str = "正常"
-
-        data.append({
-            "センサーID": s,
-            "状態": status_str,
-            "X軸 (G)": x,
-            "Y軸 (G)": y,
-            "Z軸 (G)": z,
-            "電圧 (V)": v
-        })
-    return pd.DataFrame(data)
-
-def generate_timeseries_data(points=60, freq='min', latest_values=None):
-    now = datetime.now(JST)
-    dates = []
-    for i in range(points):
-        if freq == 'sec':
-            d = now - timedelta(seconds=i)
+@topology_resource
+def get_status_engine(topology):
+    return FleetStatusEngine(topology.sensor_ids, topology.area_slices)
+
+@topology_resource
+def get_rollups(topology):
+    return {w: Rollup(len(topology), w, c, dtype) for w, (c, dtype) in ROLLUP_LEVELS.items()}
+
+@st.cache_resource(max_entries=1, hash_funcs=TOPOLOGY_HASH, on_release=lambda history: history.close())
+def get_history_store(topology):
+    # ディスクへの書き出しは専用スレッドで行う（受信・画面の処理は待たない）
+    return HistoryStore(HISTORY_DIR, topology.sensor_ids).start()
+
+@topology_resource
+def get_sample_store(topology):
+    store = SampleStore(topology.sensor_ids, capacity=HISTORY_SECONDS // SAMPLE_PERIOD_SEC)
+    store.sinks = list(get_rollups(topology).values())
+    # 再起動時（構成の変更時も）は直近の保持期間分をディスクから読み戻してから永続化を有効にする
+    history = get_history_store(topology)
+    now_ns = time.time_ns()
+    for i in range(len(topology)):
+        ts, vals = history.read(i, now_ns - HISTORY_SECONDS * NS_PER_SEC, now_ns)
+        store.append_many(i, ts, vals)
+    store.sinks.append(history)
+    store.sinks.append(get_event_engine(topology))
+    ingest = get_ingest_service()
+    if ingest is not None:
+        ingest.attach(store, topology.numbers)
+    return store
+
+@st.cache_resource
+def get_event_log():
+    return EventLog(EVENT_DB)
+
+@topology_resource
+def get_event_engine(topology):
+    registry = get_threshold_registry(topology)
+    engine = EventEngine(
+        get_event_log(), topology.sensor_ids, topology.area_names, topology.sensor_area, lambda: registry.limits
+    )
+    engine.listeners.append(get_mail_dispatcher().notify)
+    return engine
+
+@st.cache_resource
+def get_mail_dispatcher():
+    # メール設定は全セッション共通。送信は専用スレッドで行い、画面の処理は待たない
+    return MailDispatcher(
+        MAIL_DB, get_event_log(), JST,
+        host=SMTP_HOST, port=SMTP_PORT, sender=SMTP_SENDER,
+        username=SMTP_USER, password=SMTP_PASSWORD, starttls=SMTP_STARTTLS,
+        window=MAIL_DIGEST_SEC
+    ).start()
+
+def flash(message, icon="✅"):
+    # 次の再実行の冒頭で表示するメッセージ（表示のために待たずにすぐ st.rerun() できる）
+    st.session_state['flash'] = (message, icon)
+
+def show_flash():
+    if 'flash' in st.session_state:
+        message, icon = st.session_state.pop('flash')
+        st.toast(message, icon=icon)
+
+@st.cache_resource
+def get_export_service():
+    return ExportService(EXPORT_DIR)
+
+def start_export(label, chunks, fmt, file_stem):
+    job = get_export_service().submit(label, chunks, fmt, file_stem)
+    st.session_state.setdefault('export_jobs', []).append(job.id)
+
+def read_export(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def export_jobs_panel(live):
+    # このセッションで開始したエクスポートの一覧。実行中のものがある間だけ1秒ごとに更新し、
+    # すべて終わったらアプリ全体を1回だけ再実行して自動更新を止める
+    service = get_export_service()
+    jobs = [service.jobs[i] for i in st.session_state.get('export_jobs', []) if i in service.jobs]
+    running = any(job.state == "running" for job in jobs)
+    if live and not running:
+        st.rerun()
+    for job in reversed(jobs):
+        if job.state == "running":
+            col_j1, col_j2 = st.columns([5, 1])
+            with col_j1:
+                st.progress(job.progress, text=f"⏳ {job.label}：{job.rows:,} 行")
+            with col_j2:
+                st.button("中止", key=f"export_cancel_{job.id}", on_click=job.cancel)
+        elif job.state == "done":
+            name = os.path.basename(job.path)
+            size_mb = job.size / 1024 / 1024
+            st.caption(f"✅ {job.label}：{job.rows:,} 行 / {size_mb:.1f} MB（{job.finished_at - job.started_at:.1f} 秒）")
+            if job.size <= EXPORT_DOWNLOAD_LIMIT:
+                # ファイルはボタンを押したときに読む（押さない限りメモリに載せない）
+                st.download_button(
+                    f"📥 {name}", data=lambda path=job.path: read_export(path), file_name=name,
+                    on_click="ignore", key=f"export_download_{job.id}"
+                )
+            else:
+                st.info(f"ファイルが大きいため、サーバー上のファイルを参照してください：{job.path}")
+        elif job.state == "failed":
+            st.error(f"❌ {job.label}：エクスポートに失敗しました（{job.error}）")
         else:
-            d = now - timedelta(minutes=i)
-        dates.append(d)
-    dates.reverse()
-    
-    df = pd.DataFrame({
-        'timestamp': dates,
-        'X軸 (G)': np.random.normal(0, 0.1, points),
-        'Y軸 (G)': np.random.normal(0, 0.1, points),
-        'Z軸 (G)': np.random.normal(1.0, 0.05, points),
-        '電圧 (V)': np.random.normal(3.3, 0.01, points)
-    })
-    
-    if latest_values is not None:
-        df.iloc[-1, df.columns.get_loc('X軸 (G)')] = latest_values['x']
-        df.iloc[-1, df.columns.get_loc('Y軸 (G)')] = latest_values['y']
-        df.iloc[-1, df.columns.get_loc('Z軸 (G)')] = latest_values['z']
-        df.iloc[-1, df.columns.get_loc('電圧 (V)')] = latest_values['v']
-        
-    return df.set_index('timestamp')
+            st.caption(f"⏹ {job.label}：中止しました")
+
+def show_export_jobs():
+    jobs = get_export_service().jobs
+    live = any(jobs[i].state == "running" for i in st.session_state.get('export_jobs', []) if i in jobs)
+    st.fragment(export_jobs_panel, run_every=1 if live else None)(live)
+
+@st.cache_resource
+def get_ingest_service():
+    # 受信サービスはセンサー構成によらず1つ。書き込み先のストアは get_sample_store で差し替える
+    if not INGEST_PORT:
+        return None
+    return IngestService(port=int(INGEST_PORT)).start()
+
+@topology_resource
+def get_simulator(topology):
+    # 故障のスケジュールは起動した日（UTC）の 0 時から SIM_FAULT_DAYS 日分。同じ日の再起動なら同じになる
+    start_ns = time.time_ns() // (86_400 * NS_PER_SEC) * (86_400 * NS_PER_SEC)
+    simulator = FleetSimulator(
+        len(topology), 1 / SAMPLE_PERIOD_SEC, seed=SIM_SEED, start_ns=start_ns, spike_prob=SIM_SPIKE_PROB
+    )
+    count = len(topology) * SIM_FAULTS_PER_SENSOR_DAY * SIM_FAULT_DAYS
+    return simulator.random_faults(count, start_ns, start_ns + SIM_FAULT_DAYS * 86_400 * NS_PER_SEC)
+
+@METRICS.timed("data", "sample_store")
+def sync_sample_store(topology):
+    # 受信サービスが動いている場合はそちらがストアへ書き込む
+    if get_ingest_service() is not None:
+        return get_sample_store(topology)
+
+    # デモ用：前回の取得時刻から現在までの模擬データをストアへ補充する
+    simulator = get_simulator(topology)
+    store = get_sample_store(topology)
+    store.extend_to(
+        time.time_ns(), SAMPLE_PERIOD_SEC * NS_PER_SEC,
+        lambda times: simulator.batch(times[0] // simulator.period_ns, len(times))[1]
+    )
+    return store
+
+@METRICS.timed("data", "fleet_status")
+def generate_fleet_status(topology):
+    # 全センサー分の読み取り値と閾値を配列で持ち、一括で状態判定する
+    registry = get_threshold_registry(topology)
+    limits = registry.limits
+    store = sync_sample_store(topology)
+    return get_status_engine(topology).evaluate(store.latest(), limits, time_ns=store.last_ns, threshold_version=registry.version)
 
-def generate_mock_history():
+def vibration_columns(topology, idx, fleet):
+    # 表示中のページのセンサー（idx）の直近 SPECTRUM_SAMPLES 件を1回の FFT で解析し、表に追加する振動評価の列を作る
+    ts, vals, full = get_sample_store(topology).recent(idx, SPECTRUM_SAMPLES)
+    limits = np.stack([fleet.limits[a][idx] for a in ('x', 'y', 'z')], axis=1)
+    acc, vel, zones = vibration_severity(ts, vals[..., :3], limits, SPECTRUM_NPERSEG)
+    # 解析窓に満たないセンサーは空欄
+    acc[~full] = np.nan
+    vel[~full] = np.nan
+    zones[~full] = ""
+    columns = {"振動RMS (G)": acc, "振動速度 (mm/s)": vel, "振動区分": zones}
+    if np.isnan(vel).all():
+        # サンプリング周波数が ISO の評価帯域に届かない場合は振動速度を出さない
+        del columns["振動速度 (mm/s)"]
+    return pd.DataFrame(columns)
+
+@topology_resource
+def get_snapshot_publisher(topology):
+    return SnapshotPublisher(
+        lambda: generate_fleet_status(topology), SNAPSHOT_INTERVAL_SEC,
+        extras=lambda idx, fleet: vibration_columns(topology, idx, fleet), metrics=METRICS
+    )
+
+def latest_snapshot():
+    # 全セッション共通のスナップショット（周期ごとに1回だけ作られる）
+    return get_snapshot_publisher(topology).latest(get_threshold_registry(topology).version)
+
+def current_snapshot():
+    # セッションは表示中のスナップショットへの参照だけを持つ。閾値（構成）が変わった場合のみ取り直す
+    snap = st.session_state.get('snapshot')
+    if snap is None or snap.fleet.threshold_version != get_threshold_registry(topology).version:
+        snap = latest_snapshot()
+        st.session_state['snapshot'] = snap
+    return snap
+
+def load_timeseries(sensor_id, seconds, end_ns=None):
+    # ストアのビューをそのまま DataFrame 化する（再生成はしない）
+    store = get_sample_store(topology)
+    ts, vals = store.window(store.index[sensor_id], seconds, end_ns=end_ns)
+    return to_frame(ts, vals, JST)
+
+@METRICS.cached("downsampled", st.cache_data(max_entries=256))
+def load_downsampled(sensor_id, seconds, width_ns, end_bucket, topology_version):
+    # センサー・期間・バケット幅ごとにキャッシュする。
+    # end_bucket（最新時刻のバケット番号）が変わるまでは同じ結果を返す。
+    # topology_version は、構成が変わって同じセンサーIDが別の系列を指す場合に古い結果を返さないためのキー
+    store = get_sample_store(topology)
+    end_ns = (end_bucket + 1) * width_ns - 1
+    ts, vals = store.window(store.index[sensor_id], seconds, end_ns=end_ns)
+    ts, vals = minmax_downsample(ts, vals, width_ns)
+    return to_frame(ts, vals, JST)
+
+@METRICS.cached("history_downsampled", st.cache_data(max_entries=256))
+def load_history_downsampled(sensor_id, seconds, width_ns, end_bucket, topology_version):
+    # ロールアップが期間をカバーしていない場合（再起動直後など）はディスクから読む
+    end_ns = (end_bucket + 1) * width_ns - 1
+    ts, vals = get_history_store(topology).read_downsampled(
+        get_sample_store(topology).index[sensor_id], end_ns - seconds * NS_PER_SEC, end_ns, width_ns
+    )
+    return to_frame(ts, vals, JST)
+
+def rollup_covers(rollup, start_ns):
+    # ロールアップが start_ns 以降を持っているか（ディスクの履歴がない場合はロールアップを使うしかない）
+    first_disk_ns = get_history_store(topology).first_day_ns()
+    if first_disk_ns is None:
+        return True
+    return rollup.first_ns is not None and rollup.first_ns <= max(start_ns, first_disk_ns)
+
+@METRICS.timed("data", "chart_series")
+def load_chart_series(sensor_id, period):
+    seconds, rollup_sec = PERIODS[period]
+    store = get_sample_store(topology)
+    width_ns = bucket_width_ns(seconds, MAX_CHART_POINTS, SAMPLE_PERIOD_SEC * NS_PER_SEC)
+    end_bucket = store.last_ns // width_ns
+    if rollup_sec is not None:
+        # 長期間はロールアップのバケットだけを読む
+        rollup = get_rollups(topology)[rollup_sec]
+        end_ns = store.last_ns
+        start_ns = end_ns - seconds * NS_PER_SEC
+        if rollup_covers(rollup, start_ns):
+            result = rollup.query(store.index[sensor_id], start_ns, end_ns)
+            return rollup_frame(result, JST)
+        return load_history_downsampled(sensor_id, seconds, width_ns, end_bucket, topology.version)
+    return load_downsampled(sensor_id, seconds, width_ns, end_bucket, topology.version)
+
+@METRICS.cached("spectrum", st.cache_data(max_entries=256))
+@METRICS.timed("data", "spectrum")
+def sensor_spectrum(sensor_id, samples, end_ns):
+    # センサー・解析窓ごとにキャッシュする（end_ns はストアの最新時刻。進むまでは同じ結果を返す）
+    store = get_sample_store(topology)
+    i = store.index[sensor_id]
+    ts, vals, full = store.recent([i], samples)
+    if not full[0]:
+        return None
+    limits = get_threshold_registry(topology).limits
+    fs = sample_rate(ts)
+    freqs, psd = welch_psd(np.swapaxes(vals[..., :3], 1, 2), fs[:, None], SPECTRUM_NPERSEG)
+    freqs, psd = freqs[0, 0], psd[0]
+
+    psd_df = pd.DataFrame({'周波数 (Hz)': freqs[1:]})
+    for j, col in enumerate(['X軸 (G)', 'Y軸 (G)', 'Z軸 (G)']):
+        psd_df[col] = psd[j, 1:]
+
+    nyquist = fs[0] / 2
+    bands = {}
+    for name, (lo, hi) in SPECTRUM_BANDS.items():
+        # 直流成分は含めない。最上位の帯域はナイキスト周波数まで含める
+        rms = band_rms(freqs, psd, max(lo * nyquist, freqs[1]), np.inf if hi >= 1.0 else hi * nyquist)
+        bands[f"{name} ({lo * nyquist:.2f}–{hi * nyquist:.2f} Hz)"] = rms
+    band_df = pd.DataFrame(bands, index=['X軸', 'Y軸', 'Z軸'])
+
+    acc, vel, zone = vibration_severity(
+        ts, vals[..., :3], np.array([[limits[a][i] for a in ('x', 'y', 'z')]]), SPECTRUM_NPERSEG
+    )
+    return psd_df, band_df, float(acc[0]), float(vel[0]), str(zone[0]), float(fs[0])
+
+def create_spectrum_chart(psd_df):
+    df_melted = psd_df.melt('周波数 (Hz)', var_name='Metric', value_name='PSD')
+    return alt.Chart(df_melted).mark_line().encode(
+        x=alt.X('周波数 (Hz)', title='周波数 (Hz)'),
+        y=alt.Y('PSD', title='PSD (G²/Hz)', scale=alt.Scale(type='log')),
+        color=alt.Color('Metric', title='凡例', scale=alt.Scale(scheme='category10')),
+        tooltip=[
+            alt.Tooltip('周波数 (Hz)', format='.3f'),
+            alt.Tooltip('Metric', title='項目'),
+            alt.Tooltip('PSD', format='.2e')
+        ]
+    ).properties(title="振動スペクトル (Welch PSD)", height=300)
+
+def events_frame(rows):
+    # 1ページ分のイベント行を表示用に整形する（センサー・エリアはログ上のキーから名前を引く）
+    event_log = get_event_log()
     data = []
-    now = datetime.now(JST)
-    for i in range(10):
-        t = now - timedelta(hours=i*2)
+    for _, ts, sensor, area, kind, channel, value, peak, onset_ts in rows:
         data.append([
-            t.strftime('%Y-%m-%d %H:%M:%S'),
-            f"Sensor-{str(np.random.randint(1,110)).zfill(3)}",
-            np.random.choice(AREAS),
-            "X軸異常",
-            f"{np.random.uniform(0.6, 1.2):.2f}"
+            datetime.fromtimestamp(ts / NS_PER_SEC, JST).strftime('%Y-%m-%d %H:%M:%S'),
+            event_log.sensor_names[sensor],
+            event_log.area_names[area],
+            CHANNEL_NAMES[channel] + ("低下" if channel == 3 else "異常"),
+            "発生" if kind == KIND_ONSET else "復帰",
+            f"{value:.2f}",
+            f"{peak:.2f}",
+            f"{(ts - onset_ts) / NS_PER_SEC:.0f} 秒" if kind == KIND_RECOVERY else ""
         ])
-    return pd.DataFrame(data, columns=["発生日時", "センサーID", "設置エリア", "異常種別", "検測値"])
+    return pd.DataFrame(data, columns=["発生日時", "センサーID", "設置エリア", "異常種別", "区分", "検測値", "ピーク値", "継続時間"])
 
-# --- ★Altairグラフ描画関数（Y軸範囲固定） ---
-def create_chart(df, y_columns, title, color_scheme='category10', is_voltage=False, interactive=False):
-    df_reset = df.reset_index()
-    df_melted = df_reset.melt('timestamp', value_vars=y_columns, var_name='Metric', value_name='Value')
-    
-    if is_voltage:
-        # 電圧設定: 2.0V 〜 4.0V
-        line_layer = alt.Chart(df_melted).mark_line(color='#ffaa00').encode(
-            x=alt.X('timestamp', title='時間', axis=alt.Axis(format='%H:%M:%S')),
-            y=alt.Y('Value', title='値 (V)', scale=alt.Scale(domain=[2.0, 4.0])), 
-        )
+# --- トレンドグラフ（振動・電圧を1つの仕様にまとめ、データセットを共有する） ---
+def chart_data_version(period):
+    # グラフ分析の元データの版（表示バケットの番号）。同じ版の間はグラフ仕様を作り直さない
+    seconds, _ = PERIODS[period]
+    width_ns = bucket_width_ns(seconds, MAX_CHART_POINTS, SAMPLE_PERIOD_SEC * NS_PER_SEC)
+    return get_sample_store(topology).last_ns // width_ns
+
+@METRICS.cached("trend_spec", st.cache_data(max_entries=128))
+def period_trend_spec(sensor_id, period, version, interactive, topology_version):
+    # (センサー, 表示期間, データの版, 操作モード) ごとにキャッシュする
+    df = load_chart_series(sensor_id, period)
+    time_format = '%H:%M:%S' if period == "1時間" else '%m/%d %H:%M'
+    return trend_spec(df, f"{sensor_id} - 振動データ(XYZ)", f"{sensor_id} - 電圧データ", interactive, time_format)
+
+@METRICS.cached("recent_trend_spec", st.cache_data(max_entries=128))
+def recent_trend_spec(sensor_id, end_ns, interactive, topology_version):
+    # 詳細ダイアログ用（直近1分）。end_ns は表示中のスナップショットの時刻
+    df = load_timeseries(sensor_id, 60, end_ns=end_ns)
+    return trend_spec(df, "3軸加速度推移 (X, Y, Z)", "バッテリー電圧推移", interactive)
+
+# --- 複数センサー比較 ---
+def compare_grid(period):
+    # 表示期間の共通時間グリッドの (バケット幅, バケット数, データの版)。
+    # ロールアップを使う期間はその幅の倍数にして、ロールアップのバケットをそのまま束ねられるようにする
+    seconds, rollup_sec = PERIODS[period]
+    base_ns = (rollup_sec or SAMPLE_PERIOD_SEC) * NS_PER_SEC
+    width_ns = -(-seconds * NS_PER_SEC // COMPARE_POINTS)
+    width_ns = -(-width_ns // base_ns) * base_ns
+    n_buckets = -(-seconds * NS_PER_SEC // width_ns)
+    return width_ns, n_buckets, get_sample_store(topology).last_ns // width_ns
+
+@METRICS.cached("compare_matrix", st.cache_data(max_entries=16))
+@METRICS.timed("data", "compare_matrix")
+def aligned_matrix(areas, period, version, topology_version):
+    # 選んだエリアの全センサーを共通の時間グリッドに揃えた平均値の行列 (センサー数, バケット数, 4) と、
+    # 集計表用のセンサーごとの件数・合計・二乗和・最小・最大（compare.sensor_totals）。
+    # 全軸分をまとめて持つので、軸や表示するセンサーを変えても作り直さない（z スコアのピアにも使う）
+    seconds, rollup_sec = PERIODS[period]
+    width_ns, n_buckets, _ = compare_grid(period)
+    start_ns = (version + 1 - n_buckets) * width_ns
+    end_ns = start_ns + n_buckets * width_ns - 1
+    rows = np.concatenate([np.arange(AREA_SLICES[a].start, AREA_SLICES[a].stop) for a in areas])
+
+    rollup = get_rollups(topology)[rollup_sec] if rollup_sec is not None else None
+    if rollup is not None and rollup_covers(rollup, start_ns):
+        factor = width_ns // rollup.width_ns
+        grid = coarsen(rollup.grid(rows, start_ns // rollup.width_ns, n_buckets * factor), factor)
     else:
-        # 加速度設定: -2.0G 〜 +2.0G
-        line_layer = alt.Chart(df_melted).mark_line().encode(
-            x=alt.X('timestamp', title='時間', axis=alt.Axis(format='%H:%M:%S')),
-            y=alt.Y('Value', title='値 (G)', scale=alt.Scale(domain=[-2.0, 2.0])),
-            color=alt.Color('Metric', title='凡例', scale=alt.Scale(scheme=color_scheme)),
-        )
+        if rollup is None:
+            store = get_sample_store(topology)
+            series = [store.window(i, seconds, end_ns=end_ns) for i in rows]
+        else:
+            history = get_history_store(topology)
+            series = [history.read(i, start_ns, end_ns + 1) for i in rows]
+        grid = align_samples([ts for ts, _ in series], [v for _, v in series], start_ns, width_ns, n_buckets)
 
-    point_layer = line_layer.mark_circle(size=100).encode(
-        opacity=alt.value(0),
-        tooltip=[
-            alt.Tooltip('timestamp', title='時間', format='%H:%M:%S'),
-            alt.Tooltip('Metric', title='項目'),
-            alt.Tooltip('Value', title='値', format='.3f')
-        ]
+    grid_ts = start_ns + width_ns * np.arange(n_buckets, dtype=np.int64)
+    return grid_ts, grid_means(grid).astype(np.float32), rows, sensor_totals(grid)
+
+def compare_summary(totals, rows, axis, selected):
+    # 選択センサーの集計。z スコアは同じエリアの全センサー（行列の全行）に対する RMS の偏り
+    stats = peer_summary(totals, axis, SENSOR_AREA_INDEX[rows])
+    pick = np.array([topology.index[s] for s in selected])
+    pos = np.searchsorted(rows, pick)
+    df = pd.DataFrame({
+        "センサーID": selected,
+        "エリア": [AREAS[a] for a in SENSOR_AREA_INDEX[pick]],
+        "平均": stats["mean"][pos],
+        "RMS": stats["rms"][pos],
+        "最大": stats["max"][pos],
+        "最小": stats["min"][pos],
+        Z_COLUMN: stats["z"][pos],
+    })
+    order = np.argsort(-np.nan_to_num(np.abs(df[Z_COLUMN].to_numpy()), nan=-1.0), kind="stable")
+    return df.iloc[order].reset_index(drop=True), pos
+
+# --- 全体概要のヒートマップ ---
+# 各項目の色は閾値比（1 以上で異常）。異常数はエリア内の異常センサーの割合で色を付ける
+OVERVIEW_METRICS = [
+    ("異常数", "異常数", "{:.0f}"),
+    ("x", "X軸 最大 (G)", "{:.2f}"),
+    ("y", "Y軸 最大 (G)", "{:.2f}"),
+    ("z", "Z軸 最大 (G)", "{:.2f}"),
+    ("v", "電圧 最小 (V)", "{:.2f}"),
+]
+
+def create_overview_heatmap(summary):
+    anomaly_share = summary["異常数"] / summary["センサー数"]
+    severity = {
+        "異常数": np.where(summary["異常数"] > 0, 1 + anomaly_share, 0),
+        "x": summary["x_ratio"], "y": summary["y_ratio"], "z": summary["z_ratio"], "v": summary["v_ratio"],
+    }
+    data = pd.concat([
+        pd.DataFrame({
+            "エリア": summary["エリア"],
+            "項目": label,
+            "値": [fmt.format(v) for v in summary[col]],
+            "閾値比": np.round(np.nan_to_num(severity[col]), 2),
+        })
+        for col, label, fmt in OVERVIEW_METRICS
+    ], ignore_index=True)
+
+    select_area = alt.selection_point(name="area", fields=["エリア"], on="click")
+    base = alt.Chart(data).encode(
+        x=alt.X("項目", title=None, sort=[label for _, label, _ in OVERVIEW_METRICS], axis=alt.Axis(orient="top", labelAngle=0)),
+        y=alt.Y("エリア", title=None, sort=list(summary["エリア"])),
     )
-    
-    chart = (line_layer + point_layer).properties(title=title, height=300)
-    
-    if interactive:
-        # Y軸は固定のまま、時間軸(X)だけ動かせるようにする
-        return chart.interactive(bind_y=False)
-    else:
-        return chart
+    cells = base.mark_rect(stroke="white", strokeWidth=2).encode(
+        color=alt.Color(
+            "閾値比",
+            scale=alt.Scale(domain=[0, 0.8, 1, 1.5], range=["#1b5e20", "#9e9d24", "#ef6c00", "#b71c1c"], clamp=True),
+            legend=alt.Legend(title="閾値比")
+        ),
+        opacity=alt.condition(select_area, alt.value(1), alt.value(0.5)),
+        tooltip=["エリア", "項目", "値", "閾値比"],
+    ).add_params(select_area)
+    text = base.mark_text(color="white", fontWeight="bold").encode(text="値")
+    return (cells + text).properties(height=32 * len(summary))
+
+def open_area_from_overview():
+    # ヒートマップのセルをクリックしたら、そのエリアのリアルタイム監視へ移る
+    selected = st.session_state['overview_chart'].selection.get("area", [])
+    if selected:
+        st.session_state['monitor_area'] = selected[0]["エリア"]
+        st.session_state['menu'] = "リアルタイム監視"
+        st.session_state['overview_jump'] = True
+
+@METRICS.fragment("overview")
+def fleet_overview(live):
+    ensure_current_topology()
+    if st.session_state.pop('overview_jump', False):
+        # 画面の切り替えはアプリ全体の再実行で行う
+        st.rerun()
+
+    snapshot = latest_snapshot() if live else current_snapshot()
+    summary = snapshot.fleet.area_summary()
+    total = int(summary["異常数"].sum())
+    updated = datetime.fromtimestamp(snapshot.fleet.time_ns / NS_PER_SEC, JST).strftime('%H:%M:%S')
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("異常センサー数", f"{total} / {TOTAL_SENSORS}")
+    m2.metric("異常のあるエリア", f"{int((summary['異常数'] > 0).sum())} / {len(AREAS)}")
+    m3.metric("データ時刻", updated)
+
+    with METRICS.stage("chart", "overview"):
+        heatmap = create_overview_heatmap(summary)
+        st.altair_chart(
+            heatmap,
+            use_container_width=True,
+            on_select=open_area_from_overview,
+            selection_mode="area",
+            key="overview_chart"
+        )
+    METRICS.payload("overview", heatmap.data)
 
 # --- ポップアップ定義 ---
 try:
@@ -216,14 +699,16 @@ except AttributeError:
     dialog_decorator = st.experimental_dialog
 
 @dialog_decorator("詳細トレンド分析", width="large")
-def show_sensor_dialog(sensor_id, status, val_x, val_y, val_z, val_v):
+@METRICS.timed("dialog", "sensor_detail")
+def show_sensor_dialog(sensor_id, status, end_ns):
     st.caption(f"選択されたセンサー: {sensor_id}")
     limits = get_sensor_thresholds(sensor_id)
     
     if "異常" in status:
         st.error(f"現在、{status} が発生しています！")
-        if st.session_state['email_config']['enable_alert']:
-            st.warning(f"📩 異常検知のため、管理者 ({st.session_state['email_config']['address']}) へ自動通報が行われます。")
+        mail_config = get_mail_dispatcher().config
+        if mail_config['enable_alert']:
+            st.warning(f"📩 異常検知のため、管理者 ({mail_config['address']}) へ自動通報が行われます。")
     else:
         st.success("現在の状態は正常です。")
     
@@ -236,27 +721,25 @@ def show_sensor_dialog(sensor_id, status, val_x, val_y, val_z, val_v):
     if enable_interactive:
         st.caption("💡 マウスホイールで拡大縮小、ドラッグで左右に移動できます。")
     
-    latest_params = {'x': val_x, 'y': val_y, 'z': val_z, 'v': val_v}
-    ts_data = generate_timeseries_data(points=60, freq='sec', latest_values=latest_params)
-    
-    st.subheader("振動データ (X, Y, Z)")
-    chart_xyz = create_chart(
-        ts_data, 
-        ['X軸 (G)', 'Y軸 (G)', 'Z軸 (G)'], 
-        "3軸加速度推移",
-        interactive=enable_interactive
-    )
-    st.altair_chart(chart_xyz, use_container_width=True)
-    
-    st.subheader("電圧推移")
-    chart_v = create_chart(
-        ts_data,
-        ['電圧 (V)'],
-        "バッテリー電圧推移",
-        is_voltage=True,
-        interactive=enable_interactive
-    )
-    st.altair_chart(chart_v, use_container_width=True)
+    with METRICS.stage("chart", "recent_trend"):
+        spec = recent_trend_spec(sensor_id, end_ns, enable_interactive, topology.version)
+        st.vega_lite_chart(spec, use_container_width=True)
+    METRICS.payload("recent_trend", spec)
+
+    st.subheader("周波数解析")
+    spectrum = sensor_spectrum(sensor_id, SPECTRUM_SAMPLES, get_sample_store(topology).last_ns)
+    if spectrum is None:
+        st.info(f"解析に必要なデータ（直近 {SPECTRUM_SAMPLES} サンプル）がまだ揃っていません。")
+    else:
+        psd_df, band_df, acc_rms, vel_rms, zone, fs = spectrum
+        with METRICS.stage("chart", "spectrum"):
+            st.altair_chart(create_spectrum_chart(psd_df), use_container_width=True)
+        m1, m2, m3 = st.columns(3)
+        m1.metric("振動RMS (G)", f"{acc_rms:.3f}")
+        m2.metric("振動速度 RMS (mm/s)", "-" if np.isnan(vel_rms) else f"{vel_rms:.2f}")
+        m3.metric("振動区分", zone or "-")
+        st.caption(f"バンド RMS (G)　サンプリング周波数 {fs:.2f} Hz / 直近 {SPECTRUM_SAMPLES} サンプル")
+        st.dataframe(band_df.style.format("{:.4f}"), use_container_width=True)
     
     st.divider()
     # 閉じるボタン（右下に配置）
@@ -265,6 +748,136 @@ def show_sensor_dialog(sensor_id, status, val_x, val_y, val_z, val_v):
         if st.button("閉じる", type="secondary", key="close_bottom"):
             st.rerun()
 
+# --- リアルタイム監視の表（この部分だけを一定間隔で再実行する） ---
+def select_sensor_row(key, page_df):
+    # 行選択時のコールバック。選択内容を控えてから key を変えることで、
+    # 次の描画では選択が解除された表が1回だけ描かれる
+    rows = st.session_state[key].selection.rows
+    if rows:
+        snapshot = st.session_state['snapshot']
+        row = page_df.iloc[rows[0]]
+        st.session_state['dialog_target'] = (row["センサーID"], row["状態"], snapshot.fleet.time_ns)
+        st.session_state['table_key'] += 1
+
+def reset_table_page():
+    # 絞り込み・並べ替えを変えたら先頭ページに戻す
+    st.session_state['table_page'] = 0
+    st.session_state['table_key'] += 1
+
+def move_table_page(step):
+    st.session_state['table_page'] = st.session_state.get('table_page', 0) + step
+    st.session_state['table_key'] += 1
+
+@METRICS.fragment("sensor_table")
+def sensor_table(area_name, live, extended):
+    ensure_current_topology()
+    if 'dialog_target' in st.session_state:
+        # ダイアログは表の外で開くので、アプリ全体を再実行する
+        st.rerun()
+
+    col_f1, col_f2, col_f3, col_f4 = st.columns([1, 1, 1, 1])
+    with col_f1:
+        anomalies_only = st.toggle("⚠️ 異常のみ表示", value=False, key="table_anomalies", on_change=reset_table_page)
+    with col_f2:
+        axis = TABLE_AXES[st.selectbox("対象軸", list(TABLE_AXES), key="table_axis", on_change=reset_table_page)]
+    with col_f3:
+        sort = st.selectbox("並び順", TABLE_SORTS, key="table_sort", on_change=reset_table_page)
+    with col_f4:
+        st.write("")
+        refresh = not live and st.button("🔄 最新データ取得")
+
+    if live or refresh:
+        # 共有スナップショットを参照するだけ。版が変わっていなければスタイル済みのページもそのまま使い回す
+        # （手動更新でボタンを押したときはこの表だけを更新する）
+        snapshot = latest_snapshot()
+        st.session_state['snapshot'] = snapshot
+    else:
+        snapshot = current_snapshot()
+
+    # 表示するのは1ページ分だけ。件数が減ってページが範囲外になった場合は最終ページにする
+    area = None if area_name == ALL_AREAS else area_name
+    query = (area, anomalies_only, axis, sort == TABLE_SORTS[1])
+    page = st.session_state.get('table_page', 0)
+    styled, page_df, total = snapshot.table_page(*query, page, TABLE_PAGE_SIZE, extended)
+    last_page = max((total - 1) // TABLE_PAGE_SIZE, 0)
+    if page > last_page:
+        page = last_page
+        st.session_state['table_page'] = page
+        styled, page_df, total = snapshot.table_page(*query, page, TABLE_PAGE_SIZE, extended)
+
+    updated = datetime.fromtimestamp(snapshot.fleet.time_ns / NS_PER_SEC, JST).strftime('%H:%M:%S')
+    first = page * TABLE_PAGE_SIZE
+    if total:
+        st.caption(f"データ時刻: {updated}　/　{first + 1}–{first + len(page_df)} 件目を表示（該当 {total:,} 件）")
+    else:
+        st.caption(f"データ時刻: {updated}　/　条件に該当するセンサーはありません")
+
+    key = f"sensor_table_{st.session_state['table_key']}"
+    # スタイルの適用（Styler の描画）は st.dataframe の中で行われる
+    with METRICS.stage("styling", "sensor_table"):
+        st.dataframe(
+            styled,
+            use_container_width=True,
+            hide_index=True,
+            height=400,
+            on_select=lambda: select_sensor_row(key, page_df),
+            selection_mode="single-row",
+            key=key
+        )
+    METRICS.payload("sensor_table", page_df)
+    if last_page > 0:
+        col_p1, col_p2, col_p3 = st.columns([1, 2, 1])
+        with col_p1:
+            st.button("◀ 前へ", disabled=page == 0, on_click=move_table_page, args=(-1,), key="table_prev")
+        with col_p2:
+            st.caption(f"ページ {page + 1} / {last_page + 1}")
+        with col_p3:
+            st.button("次へ ▶", disabled=page >= last_page, on_click=move_table_page, args=(1,), key="table_next")
+
+# --- 診断画面（画面処理の計測結果） ---
+STAGE_LABELS = {
+    "run": "スクリプト全体", "page": "画面", "data": "データ取得", "styling": "表の描画",
+    "chart": "グラフ", "dialog": "ダイアログ", "fragment": "自動更新部分",
+}
+
+def latency_frame(latency):
+    rows = [
+        {
+            "段階": STAGE_LABELS.get(stage, stage), "名前": name, "回数": h.count,
+            "平均 (ms)": h.sum / h.count * 1000, "p50 (ms)": h.quantile(0.5) * 1000,
+            "p95 (ms)": h.quantile(0.95) * 1000, "p99 (ms)": h.quantile(0.99) * 1000,
+            "最大 (ms)": h.max * 1000, "合計 (秒)": h.sum,
+        }
+        for (stage, name), h in latency.items()
+    ]
+    df = pd.DataFrame(rows, columns=["段階", "名前", "回数", "平均 (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "最大 (ms)", "合計 (秒)"])
+    return df.sort_values("合計 (秒)", ascending=False, ignore_index=True)
+
+def payload_frame(payload):
+    rows = [
+        {"名前": name, "回数": h.count, "平均 (KB)": h.sum / h.count / 1024,
+         "p95 (KB)": h.quantile(0.95) / 1024, "最大 (KB)": h.max / 1024}
+        for name, h in sorted(payload.items())
+    ]
+    return pd.DataFrame(rows, columns=["名前", "回数", "平均 (KB)", "p95 (KB)", "最大 (KB)"])
+
+def cache_frame(cache):
+    rows = [
+        {"キャッシュ": name, "ヒット": hits, "ミス": misses, "ヒット率 (%)": 100 * hits / max(hits + misses, 1)}
+        for name, (hits, misses) in sorted(cache.items())
+    ]
+    return pd.DataFrame(rows, columns=["キャッシュ", "ヒット", "ミス", "ヒット率 (%)"])
+
+def create_histogram_chart(hist):
+    # 所要時間のヒストグラム（バケットの並び順のまま表示する）
+    labels = [f"≤{b * 1000:g} ms" for b in hist.bounds] + [f"> {hist.bounds[-1] * 1000:g} ms"]
+    data = pd.DataFrame({"範囲": labels, "回数": hist.counts})
+    return alt.Chart(data).mark_bar(color="#00BFFF").encode(
+        x=alt.X("範囲", sort=None, title=None, axis=alt.Axis(labelAngle=-45)),
+        y=alt.Y("回数", title="回数"),
+        tooltip=["範囲", "回数"],
+    ).properties(height=260)
+
 # --- ログイン画面 ---
 if not st.session_state['logged_in']:
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -276,6 +889,7 @@ if not st.session_state['logged_in']:
             if st.form_submit_button("ログイン"):
                 if username == "admin" and password == "admin":
                     st.session_state['logged_in'] = True
+                    st.session_state['user'] = username
                     st.query_params["auth"] = "true"
                     st.rerun()
                 else:
@@ -283,145 +897,255 @@ if not st.session_state['logged_in']:
     st.stop()
 
 # --- メイン画面 ---
+show_flash()
 st.sidebar.title("メニュー")
 st.sidebar.info(f"監視対象: {len(AREAS)}エリア / 計{TOTAL_SENSORS}センサー")
-menu = st.sidebar.radio("表示切替", ["リアルタイム監視", "グラフ分析", "異常履歴", "システム設定"])
+if get_topology_registry().error:
+    st.sidebar.error(f"❌ 構成ファイルを読み込めないため、直前の構成で動作しています：{get_topology_registry().error}")
+ingest_service = get_ingest_service()
+if ingest_service is not None:
+    ingest_stats = ingest_service.snapshot()
+    dropped = sum(v for k, v in ingest_stats.items() if k.startswith('dropped_'))
+    st.sidebar.caption(
+        f"📡 受信中 (UDP {INGEST_PORT}): {ingest_stats['samples']:,} サンプル / "
+        f"キュー {ingest_stats['queue_depth']} / 破棄 {dropped:,}"
+    )
+MENU_ITEMS = ["リアルタイム監視", "全体概要", "グラフ分析", "異常履歴", "システム設定"]
+if st.session_state.get('user') in ADMIN_USERS:
+    # 診断画面は管理者のみ（ユーザーはパスワードを確認したログイン時にだけ設定する）
+    MENU_ITEMS.append("診断")
+menu = st.sidebar.radio("表示切替", MENU_ITEMS, key="menu")
 
 if st.sidebar.button("ログアウト"):
     st.session_state['logged_in'] = False
+    st.session_state.pop('user', None)
     st.query_params.clear()
     st.rerun()
 
+# 画面ごとの処理時間の起点
+page_started = time.perf_counter()
+
 # --------------------------
 # 1. リアルタイム監視画面
 # --------------------------
 if menu == "リアルタイム監視":
     st.title("📊 リアルタイム監視モニター")
     
-    col_sel1, col_sel2 = st.columns([1, 3])
+    col_sel1, col_sel2, col_sel3 = st.columns([1, 1, 2])
     with col_sel1:
-        selected_area = st.selectbox("監視エリアを選択", AREAS)
-    
+        selected_area = st.selectbox("監視エリアを選択", AREAS + [ALL_AREAS], key="monitor_area")
+    with col_sel2:
+        live_interval = st.selectbox("自動更新", list(LIVE_INTERVALS), index=2)
+    with col_sel3:
+        st.write("")
+        st.write("")
+        show_severity = st.toggle("📈 振動評価列を表示 (周波数解析)", value=False, key="show_severity")
+
     if 'current_area' not in st.session_state or st.session_state['current_area'] != selected_area:
-        target_sensors = get_sensors_by_area(selected_area)
-        st.session_state['display_df'] = generate_area_data(target_sensors)
         st.session_state['current_area'] = selected_area
+        st.session_state['table_page'] = 0
         st.session_state['table_key'] += 1 
 
-    with col_sel2:
-        st.write("") 
-        st.write("")
-        if st.button("🔄 最新データ取得"):
-            target_sensors = get_sensors_by_area(selected_area)
-            st.session_state['display_df'] = generate_area_data(target_sensors)
-            st.rerun()
+    # 行選択はコールバックで受け取り、ダイアログは表の外（アプリ全体の再実行）で開く。
+    # 表の中で開くと、自動更新のたびにダイアログが閉じてしまうため
+    dialog_target = st.session_state.pop('dialog_target', None)
 
-    df_current = st.session_state['display_df']
     st.markdown(f"**{selected_area}** のセンサー一覧")
     st.caption("行をクリックすると詳細グラフがポップアップします。")
 
-    def highlight_cells(row):
-        styles = ['' for _ in row]
-        s_id = row["センサーID"]
-        limits = get_sensor_thresholds(s_id)
-        idx_status = row.index.get_loc("状態")
-        idx_x = row.index.get_loc("X軸 (G)")
-        idx_y = row.index.get_loc("Y軸 (G)")
-        idx_z = row.index.get_loc("Z軸 (G)")
-        idx_v = row.index.get_loc("電圧 (V)")
-
-        if "異常" in row["状態"]:
-            styles[idx_status] = 'color: red; font-weight: bold;'
-            if row["X軸 (G)"] >= limits['x']:
-                styles[idx_x] = 'background-color: #ffcccc; color: red; font-weight: bold;'
-            if row["Y軸 (G)"] >= limits['y']:
-                styles[idx_y] = 'background-color: #ffcccc; color: red; font-weight: bold;'
-            if row["Z軸 (G)"] >= limits['z']:
-                styles[idx_z] = 'background-color: #ffcccc; color: red; font-weight: bold;'
-            if row["電圧 (V)"] < limits['v']:
-                styles[idx_v] = 'background-color: #ffcccc; color: red; font-weight: bold;'
-        return styles
-
-    table_placeholder = st.empty()
-    current_key = f"sensor_table_{st.session_state['table_key']}"
-    
-    with table_placeholder.container():
-        event = st.dataframe(
-            df_current.style.apply(highlight_cells, axis=1).format({
-                "X軸 (G)": "{:.3f}", "Y軸 (G)": "{:.3f}", "Z軸 (G)": "{:.3f}", "電圧 (V)": "{:.2f}"
-            }),
-            use_container_width=True,
-            hide_index=True,
-            height=400,
-            on_select="rerun",
-            selection_mode="single-row",
-            key=current_key
-        )
+    interval = LIVE_INTERVALS[live_interval]
+    st.fragment(sensor_table, run_every=interval)(selected_area, interval is not None, show_severity)
 
-    if len(event.selection.rows) > 0:
-        selected_index = event.selection.rows[0]
-        sel_row = df_current.iloc[selected_index]
-        sel_id = sel_row["センサーID"]
-        sel_status = sel_row["状態"]
-        sel_x = sel_row["X軸 (G)"]
-        sel_y = sel_row["Y軸 (G)"]
-        sel_z = sel_row["Z軸 (G)"]
-        sel_v = sel_row["電圧 (V)"]
-        
-        st.session_state['table_key'] += 1
-        new_key = f"sensor_table_{st.session_state['table_key']}"
-        
-        with table_placeholder.container():
-            st.dataframe(
-                df_current.style.apply(highlight_cells, axis=1).format({
-                    "X軸 (G)": "{:.3f}", "Y軸 (G)": "{:.3f}", "Z軸 (G)": "{:.3f}", "電圧 (V)": "{:.2f}"
-                }),
-                use_container_width=True,
-                hide_index=True,
-                height=400,
-                on_select="rerun",
-                selection_mode="single-row",
-                key=new_key
-            )
-        show_sensor_dialog(sel_id, sel_status, sel_x, sel_y, sel_z, sel_v)
+    if dialog_target is not None:
+        show_sensor_dialog(*dialog_target)
 
 # --------------------------
-# 2. グラフ分析画面
+# 2. 全体概要画面
+# --------------------------
+elif menu == "全体概要":
+    st.title("🗺️ 全体概要")
+    col_ov1, _ = st.columns([1, 3])
+    with col_ov1:
+        overview_interval = st.selectbox("自動更新", list(LIVE_INTERVALS), index=2, key="overview_interval")
+    st.caption("全エリアの状態を一覧表示します。セルをクリックするとそのエリアのリアルタイム監視に移ります。")
+    interval = LIVE_INTERVALS[overview_interval]
+    st.fragment(fleet_overview, run_every=interval)(interval is not None)
+
+# --------------------------
+# 3. グラフ分析画面
 # --------------------------
 elif menu == "グラフ分析":
     st.title("📈 グラフ分析")
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        target_area_graph = st.selectbox("エリア選択", AREAS)
-        sensors_in_area = get_sensors_by_area(target_area_graph)
-    with col2:
-        target_sensor = st.selectbox("対象センサー", sensors_in_area)
-    with col3:
-        period = st.selectbox("表示期間", ["1時間", "24時間", "1週間"])
+    compare_mode = st.radio("表示モード", ["単一センサー", "複数センサー比較"], horizontal=True, key="analysis_mode")
 
-    st.divider()
-    df = generate_timeseries_data(points=100, freq='min')
-    
-    enable_interactive_main = st.toggle("🔍 グラフ操作モード (拡大・移動)", value=False, key="main_toggle")
+    if compare_mode == "複数センサー比較":
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            compare_areas = st.multiselect("エリア選択", AREAS, default=AREAS[:1], key="compare_areas")
+        with col2:
+            compare_axis = st.selectbox("比較する項目", list(COMPARE_AXES), key="compare_axis")
+        with col3:
+            period = st.selectbox("表示期間", list(PERIODS), key="compare_period")
+        # エリアは構成順に並べる（行列上で各エリアのセンサーが連続するように）
+        compare_areas = sorted(compare_areas, key=topology.area_index.get)
+        candidates = [s for a in compare_areas for s in get_sensors_by_area(a)]
+        compare_sensors = st.multiselect(
+            f"対象センサー（最大{MAX_COMPARE_SENSORS}台）", candidates,
+            default=candidates[:min(len(candidates), 10)],
+            max_selections=MAX_COMPARE_SENSORS, key="compare_sensors"
+        )
 
-    st.subheader(f"{target_sensor} - 振動データ(XYZ)")
-    chart_xyz = create_chart(df, ['X軸 (G)', 'Y軸 (G)', 'Z軸 (G)'], "", interactive=enable_interactive_main)
-    st.altair_chart(chart_xyz, use_container_width=True)
+        st.divider()
+        sync_sample_store(topology)
+        if not compare_sensors:
+            st.info("比較するセンサーを選択してください。")
+        else:
+            _, _, version = compare_grid(period)
+            grid_ts, matrix, rows, totals = aligned_matrix(tuple(compare_areas), period, version, topology.version)
+            summary, pos = compare_summary(totals, rows, COMPARE_AXES[compare_axis], compare_sensors)
+            time_format = '%H:%M:%S' if period == "1時間" else '%m/%d %H:%M'
+            with METRICS.stage("chart", "compare"):
+                spec = compare_spec(
+                    grid_ts, matrix[np.sort(pos), :, COMPARE_AXES[compare_axis]],
+                    [topology.sensor_ids[i] for i in rows[np.sort(pos)]],
+                    f"{compare_axis} の比較（{period}）", compare_axis, time_format
+                )
+                st.vega_lite_chart(spec, use_container_width=True)
+            METRICS.payload("compare", spec)
+            st.subheader("センサー別の集計")
+            st.caption(
+                "グラフはバケットごとの平均値。集計は表示期間の全サンプル（長期間はロールアップ）の二乗和・最小・最大から算出。"
+                "zスコアは同じエリアの全センサーの RMS に対する偏りで、"
+                "|z| が 2 以上を注意、3 以上を警報として強調します。"
+            )
+            with METRICS.stage("styling", "compare_summary"):
+                st.dataframe(style_compare(summary), use_container_width=True, hide_index=True)
 
-    st.subheader(f"{target_sensor} - 電圧データ")
-    chart_v = create_chart(df, ['電圧 (V)'], "", is_voltage=True, interactive=enable_interactive_main)
-    st.altair_chart(chart_v, use_container_width=True)
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            target_area_graph = st.selectbox("エリア選択", AREAS)
+            sensors_in_area = get_sensors_by_area(target_area_graph)
+        with col2:
+            target_sensor = st.selectbox("対象センサー", sensors_in_area)
+        with col3:
+            period = st.selectbox("表示期間", list(PERIODS))
+
+        st.divider()
+        sync_sample_store(topology)
+        enable_interactive_main = st.toggle("🔍 グラフ操作モード (拡大・移動)", value=False, key="main_toggle")
+
+        with METRICS.stage("chart", "trend"):
+            spec = period_trend_spec(target_sensor, period, chart_data_version(period), enable_interactive_main, topology.version)
+            st.vega_lite_chart(spec, use_container_width=True)
+        METRICS.payload("trend", spec)
+
+    with st.expander("📥 期間データのエクスポート（CSV / Parquet）"):
+        st.caption("保存済みの計測データを日付範囲で書き出します。書き出しはバックグラウンドで行われます。")
+        col_x1, col_x2 = st.columns(2)
+        with col_x1:
+            x_area = st.selectbox("エリア", AREAS + [ALL_AREAS], key="x_area")
+            x_candidates = SENSOR_IDS if x_area == ALL_AREAS else get_sensors_by_area(x_area)
+            x_sensors = st.multiselect("センサー（未選択はエリア内の全センサー）", x_candidates, key="x_sensors")
+        with col_x2:
+            today = datetime.now(JST).date()
+            x_dates = st.date_input("期間", value=(today, today), key="x_dates")
+            x_fmt = st.radio("形式", list(FORMATS), horizontal=True, key="x_fmt")
+        x_columns = st.multiselect(
+            "出力する列", list(HISTORY_COLUMNS), default=[c for c in HISTORY_COLUMNS if c != "limits"],
+            format_func=HISTORY_COLUMNS.get, key="x_columns"
+        )
+        if st.button("エクスポート開始", key="x_start", disabled=len(x_dates) != 2 or not x_columns):
+            start_day, end_day = x_dates
+            start_ns = int(datetime.combine(start_day, datetime.min.time(), JST).timestamp()) * NS_PER_SEC
+            end_ns = int(datetime.combine(end_day + timedelta(days=1), datetime.min.time(), JST).timestamp()) * NS_PER_SEC
+            sensors = [(topology.index[s], s, AREAS[SENSOR_AREA_INDEX[topology.index[s]]]) for s in (x_sensors or x_candidates)]
+            # 閾値は開始時点の設定（レジストリは変更のたびに配列を作り直すので、この参照は書き換わらない）
+            chunks = history_chunks(
+                get_history_store(topology), sensors, start_ns - 1, end_ns - 1, set(x_columns),
+                get_threshold_registry(topology).limits, JST
+            )
+            start_export(f"計測データ {x_area} {start_day}〜{end_day}", chunks, x_fmt, "history")
+        show_export_jobs()
 
 # --------------------------
-# 3. 異常履歴画面
+# 4. 異常履歴画面
 # --------------------------
 elif menu == "異常履歴":
     st.title("⚠️ 全エリア異常履歴")
-    history_df = generate_mock_history()
-    st.dataframe(history_df, use_container_width=True, hide_index=True)
+    event_log = get_event_log()
+
+    col_f1, col_f2, col_f3, col_f4 = st.columns(4)
+    with col_f1:
+        h_area = st.selectbox("エリア", ["全エリア"] + AREAS, key="h_area")
+    with col_f2:
+        h_channel = st.selectbox("異常種別", ["全種別"] + CHANNEL_NAMES, key="h_channel")
+    with col_f3:
+        h_kind = st.selectbox("区分", ["すべて", "発生", "復帰"], key="h_kind")
+    with col_f4:
+        today = datetime.now(JST).date()
+        h_dates = st.date_input("期間", value=(today - timedelta(days=6), today), key="h_dates")
+
+    # 画面からはキーを登録しない。まだイベントを記録していないエリアは該当なしとして扱う
+    area_key = None if h_area == "全エリア" else event_log.key_of("area_keys", h_area)
+    unknown_area = h_area != "全エリア" and area_key is None
+    filters = {
+        'area': area_key,
+        'channel': None if h_channel == "全種別" else CHANNEL_NAMES.index(h_channel),
+        'kind': {"すべて": None, "発生": KIND_ONSET, "復帰": KIND_RECOVERY}[h_kind],
+    }
+    if len(h_dates) == 2:
+        start_day, end_day = h_dates
+        filters['start_ns'] = int(datetime.combine(start_day, datetime.min.time(), JST).timestamp()) * NS_PER_SEC
+        filters['end_ns'] = int(datetime.combine(end_day + timedelta(days=1), datetime.min.time(), JST).timestamp()) * NS_PER_SEC
+
+    # 絞り込み条件が変わったら先頭ページに戻す。ページ送りは (時刻, ID) のカーソルで行う
+    if st.session_state.get('history_filters') != filters:
+        st.session_state['history_filters'] = filters
+        st.session_state['history_cursors'] = []
+    cursors = st.session_state['history_cursors']
+
+    with METRICS.stage("data", "events"):
+        if unknown_area:
+            rows, total = [], 0
+        else:
+            rows = event_log.query(limit=HISTORY_PAGE_SIZE, before=cursors[-1] if cursors else None, **filters)
+            total = event_log.count(**filters)
+    page = len(cursors) + 1
+
+    st.caption(f"該当 {total:,} 件（{page} / {max(1, -(-total // HISTORY_PAGE_SIZE))} ページ）")
+    with METRICS.stage("styling", "events"):
+        events_df = events_frame(rows)
+        st.dataframe(events_df, use_container_width=True, hide_index=True)
+    METRICS.payload("events", events_df)
+
+    col_prev, col_next, _ = st.columns([1, 1, 6])
+    with col_prev:
+        if st.button("◀ 前へ", disabled=not cursors):
+            cursors.pop()
+            st.rerun()
+    with col_next:
+        if st.button("次へ ▶", disabled=len(rows) < HISTORY_PAGE_SIZE or page * HISTORY_PAGE_SIZE >= total):
+            cursors.append((rows[-1][1], rows[-1][0]))
+            st.rerun()
+
+    with st.expander("📥 エクスポート（CSV / Parquet）"):
+        st.caption("現在の絞り込み条件に該当するイベントをすべて（古い順に）書き出します。")
+        col_e1, col_e2 = st.columns([3, 1])
+        with col_e1:
+            e_columns = st.multiselect(
+                "出力する列", list(EVENT_COLUMNS), default=list(EVENT_COLUMNS),
+                format_func=EVENT_COLUMNS.get, key="e_columns"
+            )
+        with col_e2:
+            e_fmt = st.radio("形式", list(FORMATS), horizontal=True, key="e_fmt")
+        if st.button("エクスポート開始", key="e_start", disabled=not e_columns or unknown_area):
+            chunks = event_chunks(event_log, dict(filters), set(e_columns), JST)
+            start_export(f"異常履歴 {h_area} {total:,} 件", chunks, e_fmt, "events")
+        show_export_jobs()
 
 # --------------------------
-# 4. システム設定画面
+# 5. システム設定画面
 # --------------------------
 elif menu == "システム設定":
     st.title("⚙️ システム設定")
@@ -430,48 +1154,58 @@ elif menu == "システム設定":
     
     # --- タブ1: メール設定 ---
     with tab_mail:
+        dispatcher = get_mail_dispatcher()
+        mail_config = dispatcher.config
         st.subheader("警報メール通知設定")
         with st.form("email_form"):
-            current_email = st.session_state['email_config']['address']
-            current_enable = st.session_state['email_config']['enable_alert']
-            current_recovery = st.session_state['email_config'].get('enable_recovery', False)
-            
-            new_email = st.text_input("通報先メールアドレス", value=current_email)
-            new_enable = st.checkbox("異常発生時にメールを送信する", value=current_enable)
-            new_recovery = st.checkbox("復帰時にもメールを送信する", value=current_recovery)
+            new_email = st.text_input("通報先メールアドレス（カンマ区切りで複数指定可）", value=mail_config['address'])
+            new_enable = st.checkbox("異常発生時にメールを送信する", value=mail_config['enable_alert'])
+            new_recovery = st.checkbox("復帰時にもメールを送信する", value=mail_config['enable_recovery'])
             
             submitted = st.form_submit_button("設定を保存")
         
-        msg_placeholder_mail = st.empty()
-
         if submitted:
-            if not new_email or "@" not in new_email:
-                 msg_placeholder_mail.error("❌ 失敗：有効なメールアドレスを入力してください。")
+            addresses = [a.strip() for a in new_email.split(",") if a.strip()]
+            if not addresses or not all("@" in a for a in addresses):
+                 st.error("❌ 失敗：有効なメールアドレスを入力してください。")
             else:
-                st.session_state['email_config']['address'] = new_email
-                st.session_state['email_config']['enable_alert'] = new_enable
-                st.session_state['email_config']['enable_recovery'] = new_recovery
-                msg_placeholder_mail.success("✅ 成功：メール設定を保存しました。")
-                time.sleep(2)
-                msg_placeholder_mail.empty()
+                dispatcher.update_config(", ".join(addresses), new_enable, new_recovery)
+                flash("成功：メール設定を保存しました。")
                 st.rerun()
 
+        st.caption(
+            f"同じ宛先への警報は {MAIL_DIGEST_SEC} 秒ごとに1通のダイジェストにまとめて送信します。"
+        )
+
         st.divider()
         st.subheader("送信テスト")
-        st.write("設定したアドレスにテストメールを送信します（シミュレーション）。")
-        st.info("※ このボタンは通信のシミュレーションのみを行います。実際のメールは送信されません。")
+        if SMTP_HOST:
+            st.write(f"設定したアドレスにテストメールを送信します（SMTP サーバー: {SMTP_HOST}:{SMTP_PORT}）。")
+        else:
+            st.write("設定したアドレスにテストメールを送信します。")
+            st.info("※ SMTP サーバーが未設定（SENSOR_SMTP_HOST）のため、実際のメールは送信されません。送信内容は下の「送信済みメール」で確認できます。")
         
         if st.button("テストメール送信実行", type="primary"):
-            msg_placeholder_test = st.empty()
-            if st.session_state['email_config']['enable_alert']:
-                with st.spinner("メールサーバーに接続中..."):
-                    time.sleep(1.0)
-                st.toast(f"[Simulation] 送信成功: {st.session_state['email_config']['address']}", icon="📧")
-                msg_placeholder_test.success(f"✅ [仮想送信成功] 宛先: {st.session_state['email_config']['address']} (※実際には送信されません)")
-                time.sleep(3)
-                msg_placeholder_test.empty()
+            if mail_config['enable_alert']:
+                # 送信はメール送信スレッドが行う。ここでは依頼するだけで待たない
+                dispatcher.send_test()
+                st.toast(f"送信を受け付けました: {mail_config['address']}", icon="📧")
             else:
-                msg_placeholder_test.error("❌ 失敗：メール通知機能が無効になっています。")
+                st.error("❌ 失敗：メール通知機能が無効になっています。")
+
+        mail_stats = dispatcher.snapshot()
+        last_sent = mail_stats['last_sent_at'].strftime('%Y-%m-%d %H:%M:%S') if mail_stats['last_sent_at'] else "-"
+        stored = f"（SMTP 未設定のため保存のみ {mail_stats['stored']:,} 通）" if mail_stats['stored'] else ""
+        st.caption(
+            f"送信済み {mail_stats['sent']:,} 通{stored} / 失敗 {mail_stats['failed']:,} 通 / "
+            f"送信待ちイベント {mail_stats['pending_events'] + mail_stats['queue_depth']:,} 件 / 最終送信 {last_sent}"
+        )
+        if mail_stats['last_error']:
+            st.error(f"❌ 送信エラー：{mail_stats['last_error']}")
+        if mail_stats['outbox']:
+            with st.expander("未送信で保存したメール（SMTP 未設定・直近）"):
+                for msg in reversed(mail_stats['outbox']):
+                    st.text(f"宛先: {msg['To']}\n件名: {msg['Subject']}\n\n{msg.get_content()}")
 
     # --- タブ2: 閾値設定 ---
     with tab_threshold:
@@ -483,19 +1217,18 @@ elif menu == "システム設定":
             th_sensors = get_sensors_by_area(th_area)
             th_target = st.selectbox("設定するセンサーを選択", th_sensors, key="th_target")
         
-        if th_target not in st.session_state['reset_counts']:
-            st.session_state['reset_counts'][th_target] = 0
-            
-        current_limits = get_sensor_thresholds(th_target)
-        is_custom = th_target in st.session_state['sensor_configs']
-        
+        registry = get_threshold_registry(topology)
+        current_limits = registry.get(th_target)
+        target_default = registry.default_for(th_target)
+        is_custom = registry.is_custom(th_target)
+
         st.markdown(f"**{th_target} の設定状況:** " + ("🛠 個別設定中" if is_custom else "📦 デフォルト値"))
 
         with st.form("threshold_form"):
             c1, c2, c3, c4 = st.columns(4)
-            reset_id = st.session_state['reset_counts'][th_target]
-            key_suffix = f"{th_target}_{reset_id}"
-            
+            # 設定が変わるたびに version が進むので、入力欄も最新値で作り直される
+            key_suffix = f"{th_target}_{registry.version}"
+
             with c1:
                 new_x = st.number_input("X軸 閾値 (G)", value=float(current_limits['x']), step=0.1, format="%.2f", key=f"x_{key_suffix}")
             with c2:
@@ -504,52 +1237,161 @@ elif menu == "システム設定":
                 new_z = st.number_input("Z軸 閾値 (G)", value=float(current_limits['z']), step=0.1, format="%.2f", key=f"z_{key_suffix}")
             with c4:
                 new_v = st.number_input("電圧 下限値 (V)", value=float(current_limits['v']), step=0.1, format="%.2f", key=f"v_{key_suffix}")
-            
+
             save_col, _ = st.columns([1, 5])
             with save_col:
                 submitted_th = st.form_submit_button("設定を保存")
-        
-        msg_placeholder_th = st.empty()
 
         if submitted_th:
             if new_x < 0 or new_y < 0 or new_z < 0:
-                 msg_placeholder_th.error("❌ 失敗：振動閾値に負の数は設定できません。")
+                 st.error("❌ 失敗：振動閾値に負の数は設定できません。")
             elif new_v < 0:
-                 msg_placeholder_th.error("❌ 失敗：電圧値に負の数は設定できません。")
+                 st.error("❌ 失敗：電圧値に負の数は設定できません。")
             else:
                 is_default = (
-                    new_x == DEFAULT_THRESHOLDS['x'] and
-                    new_y == DEFAULT_THRESHOLDS['y'] and
-                    new_z == DEFAULT_THRESHOLDS['z'] and
-                    new_v == DEFAULT_THRESHOLDS['v']
+                    new_x == target_default['x'] and
+                    new_y == target_default['y'] and
+                    new_z == target_default['z'] and
+                    new_v == target_default['v']
                 )
 
+                registry.set(th_target, {'x': new_x, 'y': new_y, 'z': new_z, 'v': new_v})
                 if is_default:
-                    if th_target in st.session_state['sensor_configs']:
-                        del st.session_state['sensor_configs'][th_target]
-                    
-                    st.session_state['reset_counts'][th_target] += 1
-                    msg_placeholder_th.success(f"✅ 設定変更：{th_target} の値がデフォルトと同じため、標準設定として扱います。")
+                    flash(f"設定変更：{th_target} の値がデフォルトと同じため、標準設定として扱います。")
                 else:
-                    st.session_state['sensor_configs'][th_target] = {
-                        'x': new_x, 'y': new_y, 'z': new_z, 'v': new_v
-                    }
-                    msg_placeholder_th.success(f"✅ 成功：{th_target} の個別設定を保存しました。")
-                
-                time.sleep(1.5)
-                msg_placeholder_th.empty()
+                    flash(f"成功：{th_target} の個別設定を保存しました。")
                 st.rerun()
 
         if is_custom:
             if st.button("デフォルト設定に戻す"):
-                del st.session_state['sensor_configs'][th_target]
-                st.session_state['reset_counts'][th_target] += 1
-                
-                msg_placeholder_reset = st.empty()
-                msg_placeholder_reset.success(f"✅ 成功：{th_target} をデフォルト設定に戻しました。")
-                time.sleep(1.5)
-                msg_placeholder_reset.empty()
+                registry.reset(th_target)
+                flash(f"成功：{th_target} をデフォルト設定に戻しました。")
                 st.rerun()
 
         st.divider()
-        st.caption(f"現在のデフォルト値: X={DEFAULT_THRESHOLDS['x']}G, Y={DEFAULT_THRESHOLDS['y']}G, Z={DEFAULT_THRESHOLDS['z']}G, 電圧={DEFAULT_THRESHOLDS['v']}V")
\ No newline at end of file
+        st.caption(f"現在のデフォルト値: X={DEFAULT_THRESHOLDS['x']}G, Y={DEFAULT_THRESHOLDS['y']}G, Z={DEFAULT_THRESHOLDS['z']}G, 電圧={DEFAULT_THRESHOLDS['v']}V")
+        if th_area in registry.area_defaults:
+            area_conf = registry.area_defaults[th_area]
+            st.caption(f"{th_area} のエリア別デフォルト値: X={area_conf['x']}G, Y={area_conf['y']}G, Z={area_conf['z']}G, 電圧={area_conf['v']}V")
+
+        st.subheader("エリア別 デフォルト値設定")
+        st.write(f"{th_area} の個別設定がないセンサーに適用する値を設定します。")
+        area_limits = registry.area_defaults.get(th_area, DEFAULT_THRESHOLDS)
+        with st.form("area_threshold_form"):
+            c1, c2, c3, c4 = st.columns(4)
+            area_suffix = f"{th_area}_{registry.version}"
+            with c1:
+                area_x = st.number_input("X軸 閾値 (G)", value=float(area_limits['x']), step=0.1, format="%.2f", key=f"ax_{area_suffix}")
+            with c2:
+                area_y = st.number_input("Y軸 閾値 (G)", value=float(area_limits['y']), step=0.1, format="%.2f", key=f"ay_{area_suffix}")
+            with c3:
+                area_z = st.number_input("Z軸 閾値 (G)", value=float(area_limits['z']), step=0.1, format="%.2f", key=f"az_{area_suffix}")
+            with c4:
+                area_v = st.number_input("電圧 下限値 (V)", value=float(area_limits['v']), step=0.1, format="%.2f", key=f"av_{area_suffix}")
+
+            save_col, _ = st.columns([1, 5])
+            with save_col:
+                submitted_area = st.form_submit_button("エリア設定を保存")
+
+        if submitted_area:
+            try:
+                registry.set_area_default(th_area, {'x': area_x, 'y': area_y, 'z': area_z, 'v': area_v})
+            except ValueError as e:
+                st.error(f"❌ 失敗：{e}")
+            else:
+                flash(f"成功：{th_area} のエリア別デフォルト値を保存しました。")
+                st.rerun()
+
+        if th_area in registry.area_defaults:
+            if st.button("エリア別デフォルト値を解除"):
+                registry.clear_area_default(th_area)
+                st.rerun()
+
+        st.divider()
+        st.subheader("CSV 一括設定")
+        st.write("全センサーの閾値を CSV（sensor_id,x,y,z,v）で入出力します。取り込みは1回の更新でまとめて反映されます。")
+        st.download_button(
+            "📥 現在の閾値をエクスポート",
+            registry.export_csv(),
+            file_name="sensor_thresholds.csv",
+            mime="text/csv"
+        )
+        uploaded = st.file_uploader("閾値 CSV をインポート", type="csv")
+        if uploaded is not None and st.button("インポート実行", type="primary"):
+            try:
+                n_set, n_reset = registry.import_csv(uploaded.getvalue().decode("utf-8-sig"))
+            except ValueError as e:
+                st.error(f"❌ 失敗：{e}")
+            else:
+                st.success(f"✅ 成功：個別設定 {n_set} 件を保存、{n_reset} 件をデフォルト設定に戻しました。")
+
+# --------------------------
+# 6. 診断画面（管理者のみ）
+# --------------------------
+elif menu == "診断":
+    st.title("🩺 診断")
+    if not METRICS.enabled:
+        st.info("画面処理の計測は無効になっています（SENSOR_METRICS=0）。")
+
+    latency, payload, cache = METRICS.snapshot()
+    cost, ratio = METRICS.overhead_ratio()
+    col_d1, col_d2, col_d3 = st.columns([4, 1, 1])
+    with col_d1:
+        started = datetime.fromtimestamp(METRICS.started_at, JST).strftime('%Y-%m-%d %H:%M:%S')
+        ratio_text = "-" if np.isnan(ratio) else f"{ratio:.2%}"
+        st.caption(f"計測開始: {started}　/　計測そのものの負荷（推定）: {cost * 1000:.1f} ms（実行時間の {ratio_text}）")
+    with col_d2:
+        st.button("🔄 更新", key="diag_refresh")
+    with col_d3:
+        st.button("計測値をリセット", on_click=METRICS.reset, key="diag_reset")
+
+    st.subheader("段階ごとの所要時間")
+    st.caption("全セッションの合計。p50 / p95 / p99 はヒストグラムのバケットから推定した値です。")
+    st.dataframe(
+        latency_frame(latency).style.format(
+            {c: "{:.1f}" for c in ["平均 (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "最大 (ms)"]} | {"合計 (秒)": "{:.2f}"}
+        ),
+        use_container_width=True, hide_index=True
+    )
+    if latency:
+        keys = sorted(latency, key=lambda k: -latency[k].sum)
+        target = st.selectbox(
+            "ヒストグラムを表示する段階", keys,
+            format_func=lambda k: f"{STAGE_LABELS.get(k[0], k[0])} / {k[1]}", key="diag_stage"
+        )
+        st.altair_chart(create_histogram_chart(latency[target]), use_container_width=True)
+
+    col_c1, col_c2 = st.columns(2)
+    with col_c1:
+        st.subheader("キャッシュのヒット率")
+        st.dataframe(
+            cache_frame(cache).style.format({"ヒット率 (%)": "{:.1f}"}), use_container_width=True, hide_index=True
+        )
+    with col_c2:
+        st.subheader("画面へ送るデータ量")
+        st.dataframe(
+            payload_frame(payload).style.format({c: "{:.1f}" for c in ["平均 (KB)", "p95 (KB)", "最大 (KB)"]}),
+            use_container_width=True, hide_index=True
+        )
+
+    st.subheader("共有リソース")
+    store = get_sample_store(topology)
+    publisher = get_snapshot_publisher(topology)
+    export_jobs = get_export_service().jobs.values()
+    st.caption(
+        f"時系列ストア {store.nbytes / 1024 / 1024:,.0f} MB（{TOTAL_SENSORS:,} センサー × {store.capacity:,} 件）　/　"
+        f"スナップショット作成 {publisher.builds:,} 回　/　"
+        f"実行中のエクスポート {sum(job.state == 'running' for job in export_jobs)} 件"
+    )
+
+    st.subheader("Prometheus")
+    if METRICS_PORT:
+        st.caption(f"同じ計測値を http://127.0.0.1:{METRICS_PORT}/metrics で公開しています（このサーバーからのみ参照できます）。")
+    else:
+        st.caption("環境変数 SENSOR_METRICS_PORT を設定すると、同じ計測値を Prometheus 形式で公開します。")
+    with st.expander("Prometheus 形式のテキスト"):
+        st.code(METRICS.prometheus_text(), language="text")
+
+# --- 画面処理の計測（最後まで実行された回のみ。st.rerun() / st.stop() で抜けた回は含めない） ---
+METRICS.observe("page", menu, time.perf_counter() - page_started)
+METRICS.end_run(menu)
@@ -0,0 +1,419 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from chart_specs import compare_spec, trend_spec
+from compare import align_samples, grid_means
+from downsample import bucket_width_ns, minmax_downsample
+from simulator import NS_PER_SEC, FleetSimulator
+from snapshot import FleetSnapshot
+from status_engine import AXES, FleetStatusEngine
+from table_style import style_table
+from timeseries_store import SampleStore, to_frame
+from topology import even_topology
+
+# --- 性能計測スクリプト ---
+# センサー数・1系列あたりの点数を変えながら、画面を作る各処理の所要時間を測り、JSON に書き出す。
+#   python benchmark.py                                   # 既定: 110 / 1,000 / 10,000 / 100,000 センサー
+#   python benchmark.py --sizes 110,1000 --no-app         # 画面の通し実行（AppTest）を省く
+#   python benchmark.py --baseline data/benchmarks/前回.json   # 前回の結果と比べ、遅くなった項目を表示する
+# 計測する処理（旧実装の関数 → 現在の対応する処理）:
+#   generate_area_data       → status.evaluate（全センサーの一括判定 + エリア別集計）
+#   generate_timeseries_data → simulator.batch（模擬データの生成）, store.append（時系列ストアへの追加）,
+#                              series.downsample（1センサー分の切り出し + 間引き）
+#   highlight_cells + Styler → table.page（一覧表の1ページ）, table.area（1エリア全体の表）
+#   create_chart             → chart.trend（トレンドグラフの仕様）, chart.compare（複数センサー比較）
+# 画面の通し実行は、センサー数ごとに別プロセスで app.py を AppTest で動かして測る
+# （Streamlit のキャッシュはプロセス単位なので、センサー数ごとに初期状態から始める）。
+# 計測する画面は app.py のメニューから取るので、画面を追加すると自動で対象になる（管理者用の診断画面は除く）。
+
+AREAS = [f"エリア {chr(65+i)}" for i in range(13)]
+LIMITS = {"x": 0.5, "y": 0.5, "z": 2.0, "v": 2.8}
+
+DEFAULT_SIZES = (110, 1_000, 10_000, 100_000)
+DEFAULT_POINTS = (60, 800, 3_600)
+DEFAULT_APP_SIZES = (110, 1_000, 10_000)
+
+# 時系列ストアは1点あたり 48B（時刻 8B + 4軸 × 4B、鏡像で2倍）
+STORE_BYTES_PER_POINT = 48
+# 画面の時系列ストアの保持件数（app.HISTORY_SECONDS と同じ）と、通し実行の1点あたりの最大使用メモリの目安。
+# 起動時に保持期間分の模擬データをまとめて作るため、ストア本体の数倍になる（1,000センサーで約 1.1GB）
+APP_HISTORY_SECONDS = 3600
+APP_BYTES_PER_POINT = 256
+# 通し実行のプロセスが異常終了したとき、結果に残す標準エラー出力の末尾の行数
+STDERR_TAIL_LINES = 20
+
+TABLE_PAGE_SIZE = 50
+MAX_CHART_POINTS = 800
+COMPARE_SENSORS = 50
+
+JST = timezone(timedelta(hours=9), 'JST')
+
+
+def measure(func, repeat, budget):
+    # 1回空打ちしてから最大 repeat 回測る（budget 秒を超えたらそこで打ち切る。最低1回）
+    func()
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat:
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+        if time.perf_counter() - started > budget:
+            break
+    return times
+
+
+def result(case, times, sensors=None, points=None, page=None, skipped=None, failed=None):
+    # skipped: 依存パッケージ・メモリが足りず測らなかった項目、failed: 実行に失敗した項目
+    row = {"case": case, "sensors": sensors, "points": points, "page": page}
+    if skipped:
+        row["skipped"] = skipped
+        return row
+    if failed:
+        row["failed"] = failed
+        return row
+    ms = [t * 1000 for t in times]
+    row.update({
+        "runs": len(ms),
+        "min_ms": round(min(ms), 3),
+        "median_ms": round(statistics.median(ms), 3),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "max_ms": round(max(ms), 3),
+    })
+    return row
+
+
+def result_key(row):
+    return row["case"], row["sensors"], row["points"], row["page"]
+
+
+def fleet_inputs(n):
+    topology = even_topology(AREAS, n)
+    _, values = FleetSimulator(n, seed=0, spike_prob=0.05).batch(0, 1)
+    readings = {a: values[0, :, j].astype(np.float64) for j, a in enumerate(AXES)}
+    limits = {a: np.full(n, LIMITS[a]) for a in AXES}
+    return topology, readings, limits
+
+
+def bench_fleet(n, points_list, repeat, budget, max_bytes):
+    rows = []
+    topology, readings, limits = fleet_inputs(n)
+    engine = FleetStatusEngine(topology.sensor_ids, topology.area_slices)
+    rows.append(result("status.evaluate", measure(
+        lambda: engine.evaluate(readings, limits).area_summary(), repeat, budget), n))
+
+    # 一覧表: スナップショットの最初のページ（全エリア・閾値比の高い順）と、1エリア全体をスタイル付きで HTML にする
+    def table_page():
+        snap = FleetSnapshot(engine.evaluate(readings, limits))
+        return snap.table_page(by_ratio=True, page_size=TABLE_PAGE_SIZE)[0].to_html()
+
+    rows.append(result("table.page", measure(table_page, repeat, budget), n))
+
+    fleet = engine.evaluate(readings, limits)
+    area_idx = np.arange(len(topology))[topology.area_slices[AREAS[0]]]
+
+    def table_area():
+        df = fleet.rows_frame(area_idx)
+        return style_table(df, fleet.rows_limits(area_idx)).to_html()
+
+    rows.append(result("table.area", measure(table_area, repeat, budget), n))
+
+    simulator = FleetSimulator(n, seed=0, spike_prob=0.05)
+    for points in points_list:
+        if n * points * STORE_BYTES_PER_POINT > max_bytes:
+            reason = f"メモリ上限 {max_bytes // 2**20}MB を超える"
+            rows.append(result("simulator.batch", None, n, points, skipped=reason))
+            rows.append(result("store.append", None, n, points, skipped=reason))
+            continue
+        rows.append(result("simulator.batch", measure(
+            lambda: simulator.batch(0, points), repeat, budget), n, points))
+        times, values = simulator.batch(0, points)
+        times = times + NS_PER_SEC
+        store = SampleStore(topology.sensor_ids, points)
+        rows.append(result("store.append", measure(
+            lambda: store.append_ticks(times, values), repeat, budget), n, points))
+        del store, values
+    return rows
+
+
+def bench_series(points_list, repeat, budget):
+    # センサー数によらない処理（1センサー分のグラフ、比較グラフは最大 COMPARE_SENSORS センサー）
+    rows = []
+    simulator = FleetSimulator(COMPARE_SENSORS, seed=0, spike_prob=0.05)
+    for points in points_list:
+        times, values = simulator.batch(0, points)
+        store = SampleStore(["Sensor-001"], points)
+        store.append_ticks(times, values[:, :1])
+        width_ns = bucket_width_ns(points, MAX_CHART_POINTS, NS_PER_SEC)
+
+        def series():
+            ts, vals = store.window(0, points)
+            ts, vals = minmax_downsample(ts, vals, width_ns)
+            return to_frame(ts, vals, JST)
+
+        rows.append(result("series.downsample", measure(series, repeat, budget), 1, points))
+
+        df = to_frame(times, values[:, 0], JST)
+        rows.append(result("chart.trend", measure(
+            lambda: trend_spec(df, "振動データ(XYZ)", "電圧データ"), repeat, budget), 1, points))
+
+        ts_list = [times] * COMPARE_SENSORS
+        vals_list = [values[:, i] for i in range(COMPARE_SENSORS)]
+        n_buckets = min(points, 240)
+        width = -(-points * NS_PER_SEC // n_buckets)
+        labels = [f"Sensor-{i:03d}" for i in range(1, COMPARE_SENSORS + 1)]
+
+        def compare():
+            grid = align_samples(ts_list, vals_list, int(times[0]), width, n_buckets)
+            grid_ts = times[0] + width * np.arange(n_buckets)
+            return compare_spec(grid_ts, grid_means(grid)[..., 0], labels, "X軸 (G)", "値 (G)")
+
+        rows.append(result("chart.compare", measure(compare, repeat, budget), COMPARE_SENSORS, points))
+    return rows
+
+
+# --- 画面の通し実行（AppTest） ---
+
+def write_topology(path, n):
+    topology = even_topology(AREAS, n)
+    areas = np.array(topology.area_names, dtype=object)[topology.sensor_area]
+    pd.DataFrame({"sensor_id": topology.sensor_ids, "area": areas}).to_csv(path, index=False)
+
+
+def app_worker(n, repeat, output):
+    # 別プロセスで呼ばれる。環境変数（構成ファイル・保存先）は呼び出し側で設定済み
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+    def session():
+        at = AppTest.from_file(app_path, default_timeout=900)
+        at.query_params["auth"] = "true"
+        return at
+
+    rows = []
+    at = session()
+    t0 = time.perf_counter()
+    at.run()
+    rows.append(result("app.startup", [time.perf_counter() - t0], n))
+    error = [str(e.value) for e in at.exception]
+    # 計測する画面はアプリのメニューそのもの（起動に失敗してメニューがなければ画面は測らない）
+    menus = list(at.sidebar.radio[0].options) if at.sidebar.radio else []
+    for menu in menus:
+        opened, rerun = [], []
+        for _ in range(repeat):
+            at = session()
+            at.run()
+            t0 = time.perf_counter()
+            at.sidebar.radio[0].set_value(menu).run()
+            opened.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            at.run()
+            rerun.append(time.perf_counter() - t0)
+            error += [str(e.value) for e in at.exception]
+        rows.append(result("app.open", opened, n, page=menu))
+        rows.append(result("app.rerun", rerun, n, page=menu))
+    # プロセスの最大使用メモリ（Linux の ru_maxrss は KB）
+    rows[0]["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"results": rows, "errors": error}, f, ensure_ascii=False)
+
+
+def available_memory():
+    # 解放できるページキャッシュも含めた空きメモリ（Linux 以外では確認しない）
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def bench_app(n, repeat):
+    if importlib.util.find_spec("streamlit") is None:
+        return [result("app.startup", None, n, skipped="streamlit がインストールされていません")], []
+    need = n * APP_HISTORY_SECONDS * APP_BYTES_PER_POINT
+    free = available_memory()
+    if free is not None and need > free:
+        reason = f"約 {need / 2**30:.1f}GB のメモリが必要（空きメモリ {free / 2**30:.1f}GB）"
+        return [result("app.startup", None, n, skipped=reason)], []
+    with tempfile.TemporaryDirectory(prefix="sensor_bench_") as tmp:
+        topology_path = os.path.join(tmp, "topology.csv")
+        write_topology(topology_path, n)
+        env = dict(
+            os.environ,
+            SENSOR_TOPOLOGY_FILE=topology_path,
+            SENSOR_HISTORY_DIR=os.path.join(tmp, "history"),
+            SENSOR_THRESHOLD_DB=os.path.join(tmp, "thresholds.db"),
+            SENSOR_EVENT_DB=os.path.join(tmp, "events.db"),
+            SENSOR_MAIL_DB=os.path.join(tmp, "mail.db"),
+            SENSOR_EXPORT_DIR=os.path.join(tmp, "exports"),
+            SENSOR_SIM_SEED="0",
+        )
+        for key in ("SENSOR_INGEST_PORT", "SENSOR_METRICS_PORT"):
+            env.pop(key, None)
+        output = os.path.join(tmp, "result.json")
+        command = [sys.executable, os.path.abspath(__file__), "--app-worker", str(n),
+                   "--repeat", str(repeat), "--worker-output", output]
+        proc = subprocess.run(command, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            reason = f"実行に失敗しました（終了コード {proc.returncode}）"
+            row = result("app.startup", None, n, failed=reason)
+            row["stderr"] = "\n".join(proc.stderr.splitlines()[-STDERR_TAIL_LINES:])
+            return [row], [reason]
+        with open(output, encoding="utf-8") as f:
+            data = json.load(f)
+    return data["results"], data["errors"]
+
+
+# --- 結果の保存・比較 ---
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment():
+    import streamlit
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "streamlit": streamlit.__version__,
+    }
+
+
+def compare_results(rows, baseline_rows, tolerance):
+    # 中央値の比（今回 / 前回）。1 + tolerance を超えたものを遅くなった項目とする
+    previous = {result_key(r): r for r in baseline_rows if "median_ms" in r}
+    out = []
+    for row in rows:
+        base = previous.get(result_key(row))
+        if base is None or "median_ms" not in row or base["median_ms"] <= 0:
+            continue
+        ratio = row["median_ms"] / base["median_ms"]
+        out.append({
+            "case": row["case"], "sensors": row["sensors"], "points": row["points"], "page": row["page"],
+            "baseline_ms": base["median_ms"], "median_ms": row["median_ms"], "ratio": round(ratio, 3),
+            "regression": ratio > 1 + tolerance,
+        })
+    return out
+
+
+def label(row):
+    parts = [row["case"]]
+    if row["page"]:
+        parts.append(row["page"])
+    if row["sensors"] is not None:
+        parts.append(f"{row['sensors']:,}センサー")
+    if row["points"] is not None:
+        parts.append(f"{row['points']:,}点")
+    return " / ".join(parts)
+
+
+def print_row(row):
+    if "skipped" in row:
+        print(f"  {label(row):<48} 省略: {row['skipped']}")
+    elif "failed" in row:
+        print(f"  {label(row):<48} 失敗: {row['failed']}")
+        for line in row.get("stderr", "").splitlines():
+            print(f"      {line}")
+    else:
+        print(f"  {label(row):<48} 中央値 {row['median_ms']:>10.2f} ms  (最小 {row['min_ms']:.2f}, {row['runs']}回)")
+
+
+def int_list(text):
+    return [int(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダッシュボードの各処理の所要時間を計測し、JSON に書き出します")
+    parser.add_argument("--sizes", type=int_list, default=list(DEFAULT_SIZES), help="センサー数（カンマ区切り）")
+    parser.add_argument("--points", type=int_list, default=list(DEFAULT_POINTS), help="1系列あたりの点数（カンマ区切り）")
+    parser.add_argument("--app-sizes", type=int_list, default=list(DEFAULT_APP_SIZES),
+                        help="画面の通し実行を行うセンサー数（カンマ区切り）")
+    parser.add_argument("--no-app", action="store_true", help="画面の通し実行（AppTest）を行わない")
+    parser.add_argument("--repeat", type=int, default=5, help="1項目あたりの最大計測回数")
+    parser.add_argument("--budget", type=float, default=3.0, help="1項目あたりの計測時間の目安（秒）")
+    parser.add_argument("--max-mb", type=int, default=2048, help="模擬データ・ストアの計測で確保するメモリの上限（MB）")
+    parser.add_argument("--output", help="結果の JSON（省略時は data/benchmarks/ に日時付きで保存）")
+    parser.add_argument("--baseline", help="比較する前回の結果の JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="遅くなったとみなす中央値の増加率")
+    parser.add_argument("--app-worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.app_worker is not None:
+        app_worker(args.app_worker, args.repeat, args.worker_output)
+        return
+
+    rows = []
+    errors = []
+    print("処理単体:")
+    for row in bench_series(args.points, args.repeat, args.budget):
+        print_row(row)
+        rows.append(row)
+    for n in args.sizes:
+        for row in bench_fleet(n, args.points, args.repeat, args.budget, args.max_mb * 2**20):
+            print_row(row)
+            rows.append(row)
+    if not args.no_app:
+        print("画面の通し実行（AppTest）:")
+        for n in args.app_sizes:
+            app_rows, app_errors = bench_app(n, args.repeat)
+            for row in app_rows:
+                print_row(row)
+            rows += app_rows
+            errors += [f"{n}センサー: {e}" for e in app_errors]
+        for e in errors:
+            print(f"  ⚠️ 画面の通し実行でエラーが発生しました: {e}")
+
+    report = {"environment": environment(), "settings": vars(args), "results": rows, "errors": errors}
+    report["settings"] = {k: v for k, v in report["settings"].items() if k not in ("app_worker", "worker_output")}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["baseline"] = {"path": args.baseline, "environment": baseline.get("environment")}
+        report["comparison"] = compare_results(rows, baseline.get("results", []), args.tolerance)
+        regressions = [c for c in report["comparison"] if c["regression"]]
+        print(f"前回との比較（{args.baseline}）: {len(report['comparison'])} 項目中 {len(regressions)} 項目が遅くなりました")
+        for c in regressions:
+            print(f"  {label(c):<48} {c['baseline_ms']:.2f} → {c['median_ms']:.2f} ms (×{c['ratio']:.2f})")
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "benchmarks", f"benchmark_{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果: {output}")
+    if regressions or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import copy
+import functools
+import json
+
+import numpy as np
+import pandas as pd
+
+from timeseries_store import VALUE_COLUMNS
+
+# --- トレンドグラフの Vega-Lite 仕様 ---
+# 振動（X/Y/Z）と電圧のグラフを1つの縦連結（vconcat）の仕様にまとめ、データは名前付きの
+# データセット1つ（横持ち: 時刻 + 軸ごとの列）を両方のグラフで共有する。縦持ちへの変換（fold）は
+# ブラウザ側で行うので、送るのは「時刻 × 4列」だけになる（軸名や時刻を行ごとに繰り返さない）。
+# 仕様の骨組みはグラフの種類・操作モード・表示形式ごとに1回だけ作り、データだけを差し込む。
+
+DATASET = "trend"
+
+# データセット上の列名（短い名前で送る） → 表示名
+AXIS_FIELDS = dict(zip(("x", "y", "z", "v"), VALUE_COLUMNS))
+
+VIBRATION_DOMAIN = [-2.0, 2.0]
+VOLTAGE_DOMAIN = [2.0, 4.0]
+VOLTAGE_COLOR = "#ffaa00"
+
+
+def chart_frame(df):
+    # 表示用 DataFrame（VALUE_COLUMNS と、ロールアップの場合は "_min"/"_max"/"_rms" 列）を
+    # 送信用の横持ちデータにする。時刻は UNIX エポックのミリ秒、値は float32
+    out = {"t": df.index.asi8 // 1_000_000}
+    for field, col in AXIS_FIELDS.items():
+        out[field] = df[col].to_numpy(dtype=np.float32)
+        for suffix in ("_min", "_max", "_rms"):
+            if col + suffix in df.columns:
+                out[field + suffix] = df[col + suffix].to_numpy(dtype=np.float32)
+    return pd.DataFrame(out)
+
+
+def _label_expr(fields):
+    # 列名 → 表示名の対応を Vega の式で書く（fold 後の key 列から凡例名を作る）
+    pairs = ", ".join(f"'{f}': '{AXIS_FIELDS[f]}'" for f in fields)
+    return f"{{{pairs}}}[datum.key]"
+
+
+def _panel(fields, title, voltage, aggregate, interactive, time_format, name):
+    domain = VOLTAGE_DOMAIN if voltage else VIBRATION_DOMAIN
+    y_title = "値 (V)" if voltage else "値 (G)"
+    transform = [
+        {"fold": list(fields)},
+        {"calculate": _label_expr(fields), "as": "Metric"},
+        {"calculate": "datum.value", "as": "Value"},
+    ]
+    if aggregate:
+        transform += [
+            {"calculate": "datum[datum.key + '_min']", "as": "Low"},
+            {"calculate": "datum[datum.key + '_max']", "as": "High"},
+            {"calculate": "datum[datum.key + '_rms']", "as": "RMS"},
+        ]
+
+    x = {"field": "t", "type": "temporal", "title": "時間", "axis": {"format": time_format}}
+    y = {"field": "Value", "type": "quantitative", "title": y_title, "scale": {"domain": domain}}
+    if voltage:
+        color = {"value": VOLTAGE_COLOR}
+    else:
+        color = {"field": "Metric", "type": "nominal", "title": "凡例", "scale": {"scheme": "category10"}}
+
+    tooltip = [
+        {"field": "t", "type": "temporal", "title": "時間", "format": time_format},
+        {"field": "Metric", "type": "nominal", "title": "項目"},
+        {"field": "Value", "type": "quantitative", "title": "平均" if aggregate else "値", "format": ".3f"},
+    ]
+    if aggregate:
+        tooltip += [
+            {"field": "Low", "type": "quantitative", "title": "最小", "format": ".3f"},
+            {"field": "High", "type": "quantitative", "title": "最大", "format": ".3f"},
+            {"field": "RMS", "type": "quantitative", "title": "RMS", "format": ".3f"},
+        ]
+
+    line = {"mark": {"type": "line"}, "encoding": {"x": x, "y": y, "color": color}}
+    if interactive:
+        # Y軸は固定のまま、時間軸(X)だけ動かせるようにする
+        line["params"] = [{"name": name, "select": {"type": "interval", "encodings": ["x"]}, "bind": "scales"}]
+    points = {
+        "mark": {"type": "circle", "size": 100},
+        "encoding": {"x": x, "y": y, "color": color, "opacity": {"value": 0}, "tooltip": tooltip},
+    }
+    layers = [line, points]
+    if aggregate:
+        band_y = {"field": "Low", "type": "quantitative", "title": y_title, "scale": {"domain": domain}}
+        band = {
+            "mark": {"type": "area", "opacity": 0.25},
+            "encoding": {"x": x, "y": band_y, "y2": {"field": "High"}, "color": color},
+        }
+        layers.insert(0, band)
+
+    return {
+        "title": title,
+        "width": "container",
+        "height": 300,
+        "transform": transform,
+        "layer": layers,
+    }
+
+
+@functools.lru_cache(maxsize=64)
+def _skeleton(xyz_title, v_title, aggregate, interactive, time_format):
+    return {
+        "data": {"name": DATASET},
+        "vconcat": [
+            _panel(("x", "y", "z"), xyz_title, False, aggregate, interactive, time_format, "zoom_xyz"),
+            _panel(("v",), v_title, True, aggregate, interactive, time_format, "zoom_v"),
+        ],
+        # 拡大・移動は振動・電圧のグラフで連動させる
+        "resolve": {"scale": {"x": "shared", "color": "independent"}},
+    }
+
+
+def trend_spec(df, xyz_title, v_title, interactive=False, time_format="%H:%M:%S"):
+    # df: 表示用 DataFrame（時刻インデックス）。骨組みの複製にデータセットを差し込んで返す
+    aggregate = f"{VALUE_COLUMNS[0]}_min" in df.columns
+    spec = copy.deepcopy(_skeleton(xyz_title, v_title, aggregate, interactive, time_format))
+    spec["datasets"] = {DATASET: chart_frame(df)}
+    return spec
+
+
+# --- 複数センサーの重ね描き（compare.py で共通の時間グリッドに揃えた1軸分） ---
+# データセットは「時刻 + センサーごとの列 (s0, s1, ...)」の横持ちで、fold で縦持ちにする。
+# 凡例をクリックするとそのセンサーだけを強調する。
+
+COMPARE_DATASET = "compare"
+
+
+@functools.lru_cache(maxsize=64)
+def _compare_skeleton(labels, title, y_title, time_format):
+    fields = [f"s{i}" for i in range(len(labels))]
+    # 列名 → センサー名の対応は JSON として式に埋め込む（' や \ を含むセンサーIDでも式が壊れない）
+    pairs = json.dumps(dict(zip(fields, labels)), ensure_ascii=False)
+    x = {"field": "t", "type": "temporal", "title": "時間", "axis": {"format": time_format}}
+    y = {"field": "Value", "type": "quantitative", "title": y_title, "scale": {"zero": False}}
+    color = {
+        "field": "Sensor", "type": "nominal", "title": "センサー",
+        "scale": {"scheme": "category20"}, "legend": {"symbolLimit": len(labels)},
+    }
+    opacity = {"condition": {"param": "pick", "value": 1.0}, "value": 0.15}
+    tooltip = [
+        {"field": "t", "type": "temporal", "title": "時間", "format": time_format},
+        {"field": "Sensor", "type": "nominal", "title": "センサー"},
+        {"field": "Value", "type": "quantitative", "title": "平均", "format": ".3f"},
+    ]
+    return {
+        "data": {"name": COMPARE_DATASET},
+        "title": title,
+        "width": "container",
+        "height": 400,
+        "transform": [
+            {"fold": fields},
+            {"calculate": f"{pairs}[datum.key]", "as": "Sensor"},
+            {"calculate": "datum.value", "as": "Value"},
+        ],
+        "layer": [
+            {
+                "mark": {"type": "line", "strokeWidth": 1.5},
+                "params": [{"name": "pick", "select": {"type": "point", "fields": ["Sensor"]}, "bind": "legend"}],
+                "encoding": {"x": x, "y": y, "color": color, "opacity": opacity},
+            },
+            {
+                "mark": {"type": "circle", "size": 60},
+                "encoding": {"x": x, "y": y, "color": color, "opacity": {"value": 0}, "tooltip": tooltip},
+            },
+        ],
+    }
+
+
+def compare_spec(ts_ns, values, labels, title, y_title, time_format="%H:%M:%S"):
+    # ts_ns: (n,) グリッドの時刻  values: (センサー数, n)  labels: センサー名
+    spec = copy.deepcopy(_compare_skeleton(tuple(labels), title, y_title, time_format))
+    frame = {"t": np.asarray(ts_ns) // 1_000_000}
+    for i, row in enumerate(values):
+        frame[f"s{i}"] = np.asarray(row, dtype=np.float32)
+    spec["datasets"] = {COMPARE_DATASET: pd.DataFrame(frame)}
+    return spec
@@ -0,0 +1,104 @@
+import numpy as np
+
+# --- 複数センサー比較（共通の時間グリッドへの整列とピア比較） ---
+# 各センサーの時系列を同じ幅のバケットに割り当て、バケットごとの件数・合計・二乗和・最小・最大
+# （グリッド: {"count": (センサー数, バケット数), "sum"/"sumsq"/"min"/"max": (センサー数, バケット数, 4)}）を作る。
+# 全センサー分を連結して bincount / reduceat で集計するので、センサーごとのループで再サンプリングはしない。
+# グラフにはバケットごとの平均値（サンプルのないバケットは NaN）を描き、集計表の RMS・最大・最小は
+# 平均値ではなく元のサンプルの二乗和・最小・最大から求める（平均すると打ち消し合う振動成分も反映される）。
+
+
+def empty_grid(k, n_buckets):
+    return {
+        "count": np.zeros((k, n_buckets), dtype=np.int64),
+        "sum": np.zeros((k, n_buckets, 4)),
+        "sumsq": np.zeros((k, n_buckets, 4)),
+        "min": np.full((k, n_buckets, 4), np.inf),
+        "max": np.full((k, n_buckets, 4), -np.inf),
+    }
+
+
+def align_samples(ts_list, vals_list, start_ns, width_ns, n_buckets):
+    # ts_list / vals_list: センサーごとの時刻 (m,) と値 (m, 4)。戻り値はグリッド
+    k = len(ts_list)
+    grid = empty_grid(k, n_buckets)
+    lengths = np.array([len(ts) for ts in ts_list], dtype=np.int64)
+    if lengths.sum() == 0:
+        return grid
+    ts = np.concatenate(ts_list)
+    vals = np.concatenate(vals_list).astype(np.float64)
+    row = np.repeat(np.arange(k), lengths)
+    bucket = (ts - start_ns) // width_ns
+    ok = (bucket >= 0) & (bucket < n_buckets)
+    flat, vals = row[ok] * n_buckets + bucket[ok], vals[ok]
+    if len(flat) == 0:
+        return grid
+    size = k * n_buckets
+    grid["count"] = np.bincount(flat, minlength=size).reshape(k, n_buckets)
+    for name, part in (("sum", vals), ("sumsq", vals * vals)):
+        grid[name] = np.stack(
+            [np.bincount(flat, weights=part[:, j], minlength=size) for j in range(part.shape[1])], axis=-1
+        ).reshape(k, n_buckets, -1)
+    # 最小・最大はバケット順に並べて reduceat
+    order = np.argsort(flat, kind="stable")
+    flat, vals = flat[order], vals[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(flat)) + 1))
+    cells = flat[starts]
+    grid["min"].reshape(size, -1)[cells] = np.minimum.reduceat(vals, starts, axis=0)
+    grid["max"].reshape(size, -1)[cells] = np.maximum.reduceat(vals, starts, axis=0)
+    return grid
+
+
+def coarsen(grid, factor):
+    # 隣り合う factor 個のバケットを1つにまとめる（バケット数は factor の倍数であること）
+    if factor == 1:
+        return grid
+    k, n = grid["count"].shape
+    out = {"count": grid["count"].reshape(k, n // factor, factor).sum(axis=2)}
+    for name, reduce in (("sum", np.sum), ("sumsq", np.sum), ("min", np.min), ("max", np.max)):
+        out[name] = reduce(grid[name].reshape(k, n // factor, factor, -1), axis=2)
+    return out
+
+
+def grid_means(grid):
+    count = grid["count"][..., None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, grid["sum"] / count, np.nan)
+
+
+def sensor_totals(grid):
+    # グリッドの全バケットをまとめたセンサーごとの件数 (k,) と合計・二乗和・最小・最大 (k, 4)
+    return {
+        "count": grid["count"].sum(axis=1),
+        "sum": grid["sum"].sum(axis=1),
+        "sumsq": grid["sumsq"].sum(axis=1),
+        "min": grid["min"].min(axis=1),
+        "max": grid["max"].max(axis=1),
+    }
+
+
+def peer_summary(totals, axis, area_rows):
+    # totals: sensor_totals の結果  axis: 軸の位置  area_rows: 各センサーのエリア番号（同じエリアは連続していること）
+    # センサーごとの平均・RMS・最大・最小と、同じエリアのセンサー間で見た RMS の z スコアを返す
+    n = totals["count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(n > 0, totals["sum"][:, axis] / n, np.nan)
+        rms = np.sqrt(np.where(n > 0, totals["sumsq"][:, axis] / n, np.nan))
+    peak_hi = np.where(n > 0, totals["max"][:, axis], np.nan)
+    peak_lo = np.where(n > 0, totals["min"][:, axis], np.nan)
+
+    # エリアごとの RMS の平均・標準偏差（データのあるセンサーだけで）
+    starts = np.flatnonzero(np.diff(area_rows, prepend=area_rows[0] - 1))
+    has = ~np.isnan(rms)
+    r = np.where(has, rms, 0.0)
+    peers = np.add.reduceat(has.astype(np.int64), starts)
+    area_mean = np.add.reduceat(r, starts) / np.maximum(peers, 1)
+    area_sq = np.add.reduceat(r * r, starts) / np.maximum(peers, 1)
+    area_std = np.sqrt(np.maximum(area_sq - area_mean ** 2, 0.0))
+    lengths = np.diff(np.append(starts, len(area_rows)))
+    mu = np.repeat(area_mean, lengths)
+    sd = np.repeat(area_std, lengths)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = np.where(sd > 0, (rms - mu) / sd, 0.0)
+    z[~has] = np.nan
+    return {"mean": mean, "rms": rms, "max": peak_hi, "min": peak_lo, "z": z}
@@ -0,0 +1,40 @@
+import numpy as np
+
+# --- グラフ表示用の間引き（min/max 方式） ---
+# 時刻を固定幅のバケットに区切り、各バケットで軸ごとの最小値・最大値をとったサンプルだけを残す。
+# 警報に関わる振動スパイクや電圧降下は必ず残り、実際に起きた時刻に描かれる。
+# 残すのは元のサンプルの行そのもの（時刻順）なので、1バケットあたり最大 2×軸数 行になる。
+# バケット境界は時刻 0 基準で揃えるため、同じバケット幅なら結果を使い回せる。
+
+
+def bucket_width_ns(seconds, max_points, period_ns):
+    # 1バケットあたり2点になるよう幅を決める（サンプリング周期未満にはしない）
+    buckets = max(1, max_points // 2)
+    width = int(seconds * 1_000_000_000) // buckets
+    width = max(width, period_ns)
+    return width - width % period_ns
+
+
+def minmax_downsample(ts, vals, width_ns):
+    # ts: (n,) 昇順の時刻[ns]  vals: (n, 軸数)
+    # 戻り値は残したサンプルの時刻 (m,) と値 (m, 軸数)（時刻順）
+    if len(ts) == 0:
+        return ts, vals
+    bucket = ts // width_ns
+    starts = np.flatnonzero(np.diff(bucket)) + 1
+    starts = np.concatenate(([0], starts))
+    if len(starts) * 2 >= len(ts):
+        return ts, vals
+    n = len(ts)
+
+    # バケットごと・軸ごとの最小・最大（欠測は無視）と、それが最初に現れる行
+    lo = np.fmin.reduceat(vals, starts, axis=0)
+    hi = np.fmax.reduceat(vals, starts, axis=0)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, n)))
+    rows = np.arange(n)[:, None]
+    at_lo = np.minimum.reduceat(np.where(vals == lo[group], rows, n), starts, axis=0)
+    at_hi = np.minimum.reduceat(np.where(vals == hi[group], rows, n), starts, axis=0)
+
+    keep = np.unique(np.concatenate((at_lo.ravel(), at_hi.ravel())))
+    keep = keep[keep < n]
+    return ts[keep], vals[keep]
@@ -0,0 +1,283 @@
+import contextlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from status_engine import AXES
+
+# --- 異常イベントエンジン ---
+# センサー × 軸ごとに状態（正常 / 異常継続中）を持ち、サンプル到着ごとに更新する。
+#   発生: 閾値超過（電圧は下限未満）が debounce 回連続したとき
+#   復帰: 閾値から hysteresis の割合だけ戻った値が debounce 回連続したとき
+# 閾値付近でばたつくセンサーでも、発生と復帰が1サンプルごとに繰り返されることはない。
+# イベントは追記のみのログ（SQLite）に書き、時刻・センサー・エリアの索引で検索する。
+# ログ上のセンサー・エリアは名前ごとに固定のキーで持つ（センサー構成を変えても過去のイベントの対応は変わらない）。
+
+KIND_RECOVERY = 0
+KIND_ONSET = 1
+
+CHANNEL_NAMES = ["X軸", "Y軸", "Z軸", "電圧"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    sensor INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    channel INTEGER NOT NULL,
+    value REAL NOT NULL,
+    peak REAL NOT NULL,
+    onset_ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_sensor_ts ON events (sensor, ts);
+CREATE INDEX IF NOT EXISTS events_area_ts ON events (area, ts);
+CREATE TABLE IF NOT EXISTS sensor_keys (key INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS area_keys (key INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+"""
+
+# 件数のキャッシュに持つ絞り込み条件の数（超えたら捨てて数え直す）
+MAX_CACHED_COUNTS = 256
+
+COLUMNS = ["id", "ts", "sensor", "area", "kind", "channel", "value", "peak", "onset_ts"]
+
+
+class EventLog:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._writer = sqlite3.connect(db_path, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.sensor_names = {}
+        self.area_names = {}
+        self._load_names()
+        # 追記のたびに進める版番号と、絞り込み条件ごとの件数（同じ版の間は数え直さない）
+        self.version = 0
+        self._counts = {}
+
+    def _load_names(self):
+        self.sensor_names = dict(self._writer.execute("SELECT key, name FROM sensor_keys"))
+        self.area_names = dict(self._writer.execute("SELECT key, name FROM area_keys"))
+
+    def _known(self, table):
+        return self.sensor_names if table == "sensor_keys" else self.area_names
+
+    def key_of(self, table, name):
+        # 名前に対応するログ上のキー。未登録なら None（登録はしない）
+        for key, known_name in self._known(table).items():
+            if known_name == name:
+                return key
+        return None
+
+    def keys(self, table, names):
+        # 名前の一覧に対応するログ上のキー（配列）。未登録の名前には新しいキーを割り当てる
+        by_name = {name: key for key, name in self._known(table).items()}
+        new = [name for name in names if name not in by_name]
+        if new:
+            with self.lock, self._writer:
+                self._writer.executemany(
+                    f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", [(name,) for name in new]
+                )
+                self._load_names()
+            by_name = {name: key for key, name in self._known(table).items()}
+        return np.array([by_name[name] for name in names], dtype=np.int64)
+
+    def append(self, rows):
+        # rows: (ts, sensor, area, kind, channel, value, peak, onset_ts) のリスト
+        if not rows:
+            return
+        with self.lock, self._writer:
+            self._writer.executemany(
+                "INSERT INTO events (ts, sensor, area, kind, channel, value, peak, onset_ts)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.version += 1
+
+    def _where(self, area=None, sensor=None, channel=None, kind=None, start_ns=None, end_ns=None):
+        clauses, params = [], []
+        for column, value in (("area", area), ("sensor", sensor), ("channel", channel), ("kind", kind)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(int(value))
+        if start_ns is not None:
+            clauses.append("ts >= ?")
+            params.append(int(start_ns))
+        if end_ns is not None:
+            clauses.append("ts < ?")
+            params.append(int(end_ns))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, limit=50, before=None, after=None, **filters):
+        # 新しい順に limit 件。before / after は (ts, id) のカーソルで、ページ送りに使う
+        where, params = self._where(**filters)
+        order = "DESC"
+        if before is not None:
+            where += (" AND " if where else " WHERE ") + "(ts, id) < (?, ?)"
+            params += list(before)
+        elif after is not None:
+            where += (" AND " if where else " WHERE ") + "(ts, id) > (?, ?)"
+            params += list(after)
+            order = "ASC"
+        sql = f"SELECT {', '.join(COLUMNS)} FROM events{where} ORDER BY ts {order}, id {order} LIMIT ?"
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            rows = conn.execute(sql, params + [int(limit)]).fetchall()
+        if order == "ASC":
+            rows.reverse()
+        return rows
+
+    def iter_chunks(self, chunk_rows=10_000, **filters):
+        # 条件に合うイベントを古い順に chunk_rows 件ずつ返す（(ts, id) のカーソルで読み進め、全件は読み込まない）
+        where, params = self._where(**filters)
+        cursor = None
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            while True:
+                sql_where, sql_params = where, list(params)
+                if cursor is not None:
+                    sql_where += (" AND " if sql_where else " WHERE ") + "(ts, id) > (?, ?)"
+                    sql_params += cursor
+                rows = conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM events{sql_where} ORDER BY ts, id LIMIT ?",
+                    sql_params + [int(chunk_rows)],
+                ).fetchall()
+                if not rows:
+                    return
+                yield rows
+                cursor = [rows[-1][1], rows[-1][0]]
+
+    def count(self, **filters):
+        key = tuple(sorted(filters.items()))
+        version = self.version
+        cached = self._counts.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        where, params = self._where(**filters)
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            n = conn.execute(f"SELECT COUNT(*) FROM events{where}", params).fetchone()[0]
+        if len(self._counts) >= MAX_CACHED_COUNTS:
+            self._counts = {}
+        self._counts[key] = (version, n)
+        return n
+
+
+class EventEngine:
+    # sensor_ids / area_names / sensor_area はセンサー構成（topology.Topology）の並び
+    def __init__(self, log, sensor_ids, area_names, sensor_area, limits_source, debounce=3, hysteresis=0.1):
+        self.log = log
+        self.sensor_area = np.asarray(sensor_area, dtype=np.int64)
+        # センサー番号 → ログ上のセンサーのキー・エリアのキー
+        self.sensor_keys = log.keys("sensor_keys", list(sensor_ids))
+        self.area_keys = log.keys("area_keys", list(area_names))[self.sensor_area]
+        self.limits_source = limits_source
+        self.debounce = debounce
+        self.hysteresis = hysteresis
+        shape = (len(self.sensor_area), 4)
+        self.active = np.zeros(shape, dtype=bool)
+        self.over_run = np.zeros(shape, dtype=np.int32)
+        self.clear_run = np.zeros(shape, dtype=np.int32)
+        self.over_since = np.zeros(shape, dtype=np.int64)
+        self.onset_ts = np.zeros(shape, dtype=np.int64)
+        self.peak = np.zeros(shape, dtype=np.float64)
+        # 連続超過中の最大値（電圧は最小値）。発生時のピークの初期値にする
+        self.run_peak = np.zeros(shape, dtype=np.float64)
+        # 最後に受け取った欠測でない値（欠測で復帰とするときの記録値）
+        self.last = np.zeros(shape, dtype=np.float64)
+        # 電圧（列3）だけは下限値判定
+        self.is_lower = np.array([False, False, False, True])
+        self.lock = threading.Lock()
+        # 記録したイベントを受け取る通知先（mail_dispatcher.MailDispatcher.notify など）
+        self.listeners = []
+
+    def _step(self, idx, t, values, limits):
+        # idx のセンサーそれぞれに1サンプルずつ（時刻 t, 値 values (m, 4)）を反映する。
+        # 欠測（NaN）は超過にも復帰にも数えないと異常継続中のまま閉じなくなるため、復帰側に数える
+        # （欠測が debounce 回続くと、最後に受け取った値で復帰を記録する）
+        lim = np.stack([limits[a][idx] for a in AXES], axis=1)
+        upper = ~self.is_lower
+        missing = np.isnan(values)
+        over = np.where(upper, values >= lim, values < lim)
+        clear = missing | np.where(
+            upper,
+            values < lim * (1 - self.hysteresis),
+            values > lim * (1 + self.hysteresis),
+        )
+        last = np.where(missing, self.last[idx], values)
+
+        active = self.active[idx]
+        over_run = np.where(over, self.over_run[idx] + 1, 0)
+        clear_run = np.where(clear, self.clear_run[idx] + 1, 0)
+        peak = np.where(upper, np.fmax(self.peak[idx], values), np.fmin(self.peak[idx], values))
+        peak = np.where(active, peak, self.peak[idx])
+        onset_ts = self.onset_ts[idx]
+        t_mat = np.broadcast_to(t[:, None], values.shape)
+        # 超過が始まった時刻（連続超過の1サンプル目）を発生時刻とし、連続超過中のピークを追う
+        over_since = np.where(over_run == 1, t_mat, self.over_since[idx])
+        run_peak = np.where(upper, np.fmax(self.run_peak[idx], values), np.fmin(self.run_peak[idx], values))
+        run_peak = np.where(over_run == 1, values, run_peak)
+
+        onset = ~active & (over_run >= self.debounce)
+        recover = active & (clear_run >= self.debounce)
+
+        rows = []
+        for r, c in zip(*np.nonzero(onset)):
+            rows.append((int(over_since[r, c]), int(self.sensor_keys[idx[r]]), int(self.area_keys[idx[r]]), KIND_ONSET, int(c),
+                         float(values[r, c]), float(run_peak[r, c]), int(over_since[r, c])))
+        for r, c in zip(*np.nonzero(recover)):
+            rows.append((int(t_mat[r, c]), int(self.sensor_keys[idx[r]]), int(self.area_keys[idx[r]]), KIND_RECOVERY, int(c),
+                         float(last[r, c]), float(peak[r, c]), int(onset_ts[r, c])))
+
+        active = (active | onset) & ~recover
+        peak = np.where(onset, run_peak, peak)
+        onset_ts = np.where(onset, over_since, onset_ts)
+
+        self.active[idx] = active
+        self.over_run[idx] = over_run
+        self.clear_run[idx] = clear_run
+        self.over_since[idx] = over_since
+        self.run_peak[idx] = run_peak
+        self.last[idx] = last
+        self.peak[idx] = peak
+        self.onset_ts[idx] = onset_ts
+        return rows
+
+    def add(self, sensor_idx, times_ns, values):
+        # 1バッチ内で同じセンサーが複数回現れる場合は、時刻順に1サンプルずつ段階的に処理する
+        sensor_idx = np.asarray(sensor_idx, dtype=np.int64)
+        times_ns = np.asarray(times_ns, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(sensor_idx) == 0:
+            return
+        order = np.lexsort((times_ns, sensor_idx))
+        sensor_idx, times_ns, values = sensor_idx[order], times_ns[order], values[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sensor_idx)) + 1))
+        rank = np.arange(len(sensor_idx)) - np.repeat(starts, np.diff(np.append(starts, len(sensor_idx))))
+        limits = self.limits_source()
+        rows = []
+        with self.lock:
+            for r in range(int(rank.max()) + 1):
+                sel = rank == r
+                rows += self._step(sensor_idx[sel], times_ns[sel], values[sel], limits)
+        rows.sort()
+        self._publish(rows)
+
+    def add_ticks(self, times_ns, values):
+        # 全センサー同時刻のサンプル（values: (k, センサー数, 4)）
+        idx = np.arange(values.shape[1])
+        limits = self.limits_source()
+        rows = []
+        with self.lock:
+            for t, v in zip(times_ns, values):
+                rows += self._step(idx, np.full(len(idx), t, dtype=np.int64), np.asarray(v, dtype=np.float64), limits)
+        self._publish(rows)
+
+    def _publish(self, rows):
+        if not rows:
+            return
+        self.log.append(rows)
+        for listener in self.listeners:
+            listener(rows)
@@ -0,0 +1,235 @@
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from event_engine import CHANNEL_NAMES, COLUMNS as EVENT_FIELDS, KIND_ONSET, KIND_RECOVERY
+from status_engine import AXES, COLUMNS, STATUS_LABELS, compute_flags
+
+# --- 履歴データ・異常イベントのエクスポート（CSV / Parquet） ---
+# 保存済みのデータをブロックごとに読み（history_store.iter_blocks / EventLog.iter_chunks）、
+# ブロックごとに DataFrame にしてファイルへ追記する。期間がどれだけ長くても、
+# 一度にメモリに載るのは1ブロック分だけ。
+# 書き出しは ExportService の作業スレッドで行い、画面側は進捗と完成したファイルを参照するだけなので、
+# 長い期間のエクスポート中も他のセッションの表示は止まらない。
+
+FORMATS = {"CSV": ".csv", "Parquet": ".parquet"}
+
+# 履歴データの列（キー → 表示名）。"limits" は軸ごとの閾値の4列（書き出し開始時点で有効な設定）
+HISTORY_COLUMNS = {
+    "time": "時刻",
+    "sensor": "センサーID",
+    "area": "エリア",
+    "x": COLUMNS["x"],
+    "y": COLUMNS["y"],
+    "z": COLUMNS["z"],
+    "v": COLUMNS["v"],
+    "status": "状態",
+    "limits": "閾値",
+}
+LIMIT_COLUMNS = {"x": "X軸 閾値 (G)", "y": "Y軸 閾値 (G)", "z": "Z軸 閾値 (G)", "v": "電圧 下限値 (V)"}
+
+EVENT_COLUMNS = {
+    "time": "発生日時",
+    "sensor": "センサーID",
+    "area": "設置エリア",
+    "channel": "異常種別",
+    "kind": "区分",
+    "value": "検測値",
+    "peak": "ピーク値",
+    "duration": "継続時間 (秒)",
+}
+
+
+def history_frame(rec, sensor_index, sensor_id, area_name, columns, limits, tz):
+    # 履歴レコード1ブロック（history_store.RECORD の配列）を指定の列の DataFrame にする
+    data = {}
+    if "time" in columns:
+        data[HISTORY_COLUMNS["time"]] = pd.to_datetime(np.asarray(rec["ts"]), utc=True).tz_convert(tz)
+    if "sensor" in columns:
+        data[HISTORY_COLUMNS["sensor"]] = sensor_id
+    if "area" in columns:
+        data[HISTORY_COLUMNS["area"]] = area_name
+    for a in AXES:
+        if a in columns:
+            data[COLUMNS[a]] = np.asarray(rec[a])
+    if "status" in columns:
+        readings = {a: np.asarray(rec[a]) for a in AXES}
+        flags = compute_flags(readings, {a: limits[a][sensor_index] for a in AXES})
+        data[HISTORY_COLUMNS["status"]] = STATUS_LABELS[flags]
+    if "limits" in columns:
+        for a in AXES:
+            data[LIMIT_COLUMNS[a]] = float(limits[a][sensor_index])
+    return pd.DataFrame(data, index=pd.RangeIndex(len(rec)))
+
+
+def history_chunks(history, sensors, start_ns, end_ns, columns, limits, tz, block_rows=65536):
+    # sensors: (センサー番号, センサーID, エリア名) の並び  limits: 軸ごとの閾値配列（センサー番号順）
+    # start_ns < 時刻 <= end_ns のデータを (DataFrame, 進捗 0〜1) として順に返す。
+    # まだ書き込まれていないバッファ分も含める（書き込みスレッドの flush を待たせない）
+    for n, (i, sensor_id, area_name) in enumerate(sensors):
+        for rec in history.iter_blocks(i, start_ns, end_ns, block_rows, buffered=True):
+            yield history_frame(rec, i, sensor_id, area_name, columns, limits, tz), n / len(sensors)
+
+
+def events_frame(rows, event_log, columns, tz):
+    # EventLog の行（event_engine.COLUMNS の並び）を指定の列の DataFrame にする
+    raw = pd.DataFrame(rows, columns=EVENT_FIELDS)
+    data = {}
+    if "time" in columns:
+        data[EVENT_COLUMNS["time"]] = pd.to_datetime(raw["ts"].to_numpy(), utc=True).tz_convert(tz)
+    if "sensor" in columns:
+        data[EVENT_COLUMNS["sensor"]] = raw["sensor"].map(event_log.sensor_names).to_numpy()
+    if "area" in columns:
+        data[EVENT_COLUMNS["area"]] = raw["area"].map(event_log.area_names).to_numpy()
+    if "channel" in columns:
+        labels = np.array([name + ("低下" if c == 3 else "異常") for c, name in enumerate(CHANNEL_NAMES)])
+        data[EVENT_COLUMNS["channel"]] = labels[raw["channel"].to_numpy()]
+    if "kind" in columns:
+        data[EVENT_COLUMNS["kind"]] = np.where(raw["kind"].to_numpy() == KIND_ONSET, "発生", "復帰")
+    if "value" in columns:
+        data[EVENT_COLUMNS["value"]] = raw["value"].to_numpy()
+    if "peak" in columns:
+        data[EVENT_COLUMNS["peak"]] = raw["peak"].to_numpy()
+    if "duration" in columns:
+        recovery = raw["kind"].to_numpy() == KIND_RECOVERY
+        seconds = (raw["ts"].to_numpy() - raw["onset_ts"].to_numpy()) / 1e9
+        data[EVENT_COLUMNS["duration"]] = np.where(recovery, seconds, np.nan)
+    return pd.DataFrame(data, index=pd.RangeIndex(len(raw)))
+
+
+def event_chunks(event_log, filters, columns, tz, chunk_rows=10_000):
+    # 条件に合うイベントを古い順に (DataFrame, 進捗 0〜1) として返す
+    total = max(event_log.count(**filters), 1)
+    done = 0
+    for rows in event_log.iter_chunks(chunk_rows, **filters):
+        done += len(rows)
+        yield events_frame(rows, event_log, columns, tz), min(done / total, 1.0)
+
+
+class _CsvSink:
+    def __init__(self, path):
+        # Excel でそのまま開けるよう BOM 付き UTF-8 で書く
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")
+        self._header = True
+
+    def write(self, df):
+        df.to_csv(self._file, index=False, header=self._header)
+        self._header = False
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path):
+        # pyarrow は Parquet を選んだときだけ読み込む
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self._writer = None
+
+    def write(self, df):
+        # ブロックごとに行グループとして追記する
+        table = self._pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            self._pq.write_table(self._pa.table({}), self.path)
+
+
+class ExportJob:
+    # state: "running" / "done" / "failed" / "cancelled"。画面側は読むだけ（cancel 以外で書き換えない）
+    def __init__(self, job_id, label, path):
+        self.id = job_id
+        self.label = label
+        self.path = path
+        self.state = "running"
+        self.progress = 0.0
+        self.rows = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+
+class ExportService:
+    # エクスポートの作業スレッド（全セッション共通）。完了したファイルは新しい順に keep 件だけ残す
+    def __init__(self, root, max_workers=2, keep=20):
+        self.root = root
+        self.keep = keep
+        os.makedirs(root, exist_ok=True)
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="export")
+
+    def submit(self, label, chunks, fmt, file_stem):
+        # chunks: (DataFrame, 進捗) を返すジェネレーター（history_chunks / event_chunks）
+        with self._lock:
+            job_id = next(self._ids)
+            stamp = time.strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(self.root, f"{file_stem}_{stamp}_{job_id}{FORMATS[fmt]}")
+            job = ExportJob(job_id, label, path)
+            self.jobs[job_id] = job
+            self._prune_locked()
+        self._pool.submit(self._run, job, chunks, fmt)
+        return job
+
+    def _run(self, job, chunks, fmt):
+        try:
+            sink = _CsvSink(job.path) if fmt == "CSV" else _ParquetSink(job.path)
+            try:
+                for df, progress in chunks:
+                    if job._cancel.is_set():
+                        job.state = "cancelled"
+                        break
+                    sink.write(df)
+                    job.rows += len(df)
+                    job.progress = progress
+            finally:
+                sink.close()
+        except Exception as e:
+            # 作業スレッドの例外は画面に表示する（ここで止めないとジョブが実行中のまま残る）
+            job.state = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        if job.state == "running":
+            job.progress = 1.0
+            job.state = "done"
+        else:
+            self._remove_file(job.path)
+        job.finished_at = time.time()
+
+    def _prune_locked(self):
+        finished = sorted((j for j in self.jobs.values() if j.state != "running"), key=lambda j: j.id)
+        for job in finished[:max(len(finished) - self.keep, 0)]:
+            self._remove_file(job.path)
+            del self.jobs[job.id]
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,245 @@
+import atexit
+import os
+import threading
+import time
+
+import numpy as np
+from numpy.lib import recfunctions
+
+from downsample import minmax_downsample
+
+# --- ディスク上の履歴データ（日別パーティション × センサー別ファイル） ---
+#   <root>/<YYYY-MM-DD>/<センサーID>.bin
+# 1レコードは固定長（時刻 int64 + X/Y/Z/V float32 = 24B）で、時刻順に追記する。
+# 読み出しは np.memmap で開き、時刻列を二分探索して必要な範囲だけを参照する。
+# 追記はバッファにため、書き込みスレッドが flush_interval 秒ごと（または flush_rows 件たまったら）
+# まとめて書く。受信・画面のスレッドはバッファに積むだけで、ディスクの書き込みを待たない。
+# ディスクへの同期は1回の書き出しごとに1回（os.sync。ない環境ではファイルごとに fsync）。
+# 書き込み途中で落ちて末尾に半端なレコードが残った場合は、読み出し時は無視し、次の追記前に切り詰める。
+# iter_blocks(buffered=True) は、まだファイルに書かれていないバッファ分も flush せずに続けて返す。
+
+RECORD = np.dtype([("ts", "<i8"), ("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("v", "<f4")])
+
+NS_PER_DAY = 86_400 * 1_000_000_000
+
+
+def _day_name(day):
+    return str(np.datetime64(int(day), "D"))
+
+
+def _sync(paths):
+    # 書き出したファイルをまとめてディスクに同期する
+    if hasattr(os, "sync"):
+        os.sync()
+        return
+    for path in paths:
+        fd = os.open(path, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class HistoryStore:
+    def __init__(self, root, sensor_ids, flush_interval=5.0, flush_rows=100_000):
+        self.root = root
+        self.sensor_ids = list(sensor_ids)
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.last_ts = np.full(len(self.sensor_ids), -1, dtype=np.int64)
+        self._pending = []
+        self._pending_rows = 0
+        self._last_flush = time.monotonic()
+        # lock はバッファ、write_lock はファイルへの書き出し（書き込みスレッドと flush の呼び出し）を守る
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(root, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def close(self):
+        # 書き込みスレッドを止め、残りを書き出す（センサー構成の変更で作り直すときも呼ぶ）
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+            atexit.unregister(self.close)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _path(self, day, sensor_index):
+        return os.path.join(self.root, _day_name(day), f"{self.sensor_ids[sensor_index]}.bin")
+
+    # --- 書き込み ---
+    def add(self, sensor_idx, times_ns, values):
+        # sensor_idx: (m,)  times_ns: (m,)  values: (m, 4)
+        rec = np.empty(len(sensor_idx), dtype=RECORD)
+        rec["ts"] = times_ns
+        values = np.asarray(values, dtype=np.float32)
+        for j, name in enumerate(("x", "y", "z", "v")):
+            rec[name] = values[:, j]
+        with self.lock:
+            self._pending.append((np.asarray(sensor_idx, dtype=np.int64), rec))
+            self._pending_rows += len(rec)
+            full = self._pending_rows >= self.flush_rows
+            due = full or time.monotonic() - self._last_flush >= self.flush_interval
+        if full:
+            self._wake.set()
+        elif due and self._thread is None:
+            # 書き込みスレッドを起動していない場合（スクリプトからの利用など）はその場で書く
+            self.flush()
+
+    def add_ticks(self, times_ns, values):
+        k, n = values.shape[0], values.shape[1]
+        self.add(np.tile(np.arange(n), k), np.repeat(times_ns, n), values.reshape(k * n, 4))
+
+    def flush(self):
+        # バッファを取り出してからファイルに書く（書いている間も add はバッファに積める）
+        with self.write_lock:
+            with self.lock:
+                self._last_flush = time.monotonic()
+                pending = self._pending
+                self._pending = []
+                self._pending_rows = 0
+            if pending:
+                self._write_pending(pending)
+
+    def _write_pending(self, pending):
+        sensor_idx = np.concatenate([p[0] for p in pending])
+        rec = np.concatenate([p[1] for p in pending])
+
+        # (日, センサー, 時刻) 順に並べ、ファイルごとに1回の write にまとめる
+        day = rec["ts"] // NS_PER_DAY
+        order = np.lexsort((rec["ts"], sensor_idx, day))
+        sensor_idx, rec, day = sensor_idx[order], rec[order], day[order]
+        key = day * len(self.sensor_ids) + sensor_idx
+        starts = np.flatnonzero(np.diff(key)) + 1
+        written = []
+        for lo, hi in zip(np.concatenate(([0], starts)), np.append(starts, len(rec))):
+            i = int(sensor_idx[lo])
+            chunk = rec[lo:hi]
+            if self.last_ts[i] < 0:
+                # 再起動後の初回は既存ファイル末尾の時刻から続ける
+                mm = self._open(day[lo], i)
+                if mm is not None:
+                    self.last_ts[i] = mm["ts"][-1]
+            # 書き込み済みより古い時刻は捨てる（時刻列の昇順を保つ）
+            chunk = chunk[chunk["ts"] > self.last_ts[i]]
+            if len(chunk) == 0:
+                continue
+            path = self._path(day[lo], i)
+            self._write(path, chunk)
+            written.append(path)
+            self.last_ts[i] = chunk["ts"][-1]
+        if written:
+            _sync(written)
+
+    def _write(self, path, chunk):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            torn = size % RECORD.itemsize
+            if torn:
+                os.ftruncate(fd, size - torn)
+            os.write(fd, chunk.tobytes())
+        finally:
+            os.close(fd)
+
+    # --- 読み出し ---
+    def _rows(self, day, sensor_index):
+        try:
+            return os.path.getsize(self._path(day, sensor_index)) // RECORD.itemsize
+        except OSError:
+            return 0
+
+    def _open(self, day, sensor_index, rows=None):
+        # rows を渡すとファイルの先頭 rows 件だけを開く
+        if rows is None:
+            rows = self._rows(day, sensor_index)
+        if rows == 0:
+            return None
+        return np.memmap(self._path(day, sensor_index), dtype=RECORD, mode="r", shape=(rows,))
+
+    def _iter_ranges(self, sensor_index, start_ns, end_ns, rows=None):
+        # 期間に掛かる日別ファイルを順に開き、該当範囲のレコード（memmap のビュー）を返す
+        # rows: 日ごとに読む件数（_buffered で取った時点のファイルの長さ）
+        for day in range(start_ns // NS_PER_DAY, end_ns // NS_PER_DAY + 1):
+            mm = self._open(day, sensor_index, None if rows is None else rows[day])
+            if mm is None:
+                continue
+            ts = mm["ts"]
+            lo = np.searchsorted(ts, start_ns, side="right")
+            hi = np.searchsorted(ts, end_ns, side="right")
+            if hi > lo:
+                yield mm[lo:hi]
+
+    def _buffered(self, sensor_index, start_ns, end_ns):
+        # 書き込み中でない時点の「日別ファイルの件数」と「まだ書かれていないレコード（時刻順）」を揃えて取る。
+        # flush はせず、書き込み中ならその1回が終わるのを待つだけ。
+        # 書き込み時に捨てられる（書き込み済みより古い時刻の）レコードは除く
+        with self.write_lock:
+            with self.lock:
+                batches = list(self._pending)
+            rows = {day: self._rows(day, sensor_index)
+                    for day in range(start_ns // NS_PER_DAY, end_ns // NS_PER_DAY + 1)}
+            last = max(int(self.last_ts[sensor_index]), start_ns)
+        parts = [rec[(idx == sensor_index) & (rec["ts"] > last) & (rec["ts"] <= end_ns)] for idx, rec in batches]
+        rec = np.concatenate(parts) if parts else np.empty(0, dtype=RECORD)
+        return rows, rec[np.argsort(rec["ts"], kind="stable")]
+
+    def iter_blocks(self, sensor_index, start_ns, end_ns, block_rows=65536, buffered=False):
+        # start_ns < 時刻 <= end_ns のレコードを最大 block_rows 件ずつ（memmap のビューのまま）返す。
+        # 期間が長くても一度に読み込むのは1ブロック分だけ。
+        # buffered=True なら、ファイルの後にまだ書かれていないバッファ分も続けて返す
+        # （ファイルは同じ時点までの分だけを読むので、読んでいる間に書き込まれても重複・欠落しない）
+        rows, pending = self._buffered(sensor_index, start_ns, end_ns) if buffered else (None, None)
+        last = start_ns
+        for rec in self._iter_ranges(sensor_index, start_ns, end_ns, rows):
+            for lo in range(0, len(rec), block_rows):
+                yield rec[lo:lo + block_rows]
+            last = int(rec["ts"][-1])
+        if buffered:
+            pending = pending[pending["ts"] > last]
+            for lo in range(0, len(pending), block_rows):
+                yield pending[lo:lo + block_rows]
+
+    def read(self, sensor_index, start_ns, end_ns):
+        # start_ns < 時刻 <= end_ns のサンプルを (時刻, (m, 4) の値) で返す
+        parts = list(self._iter_ranges(sensor_index, start_ns, end_ns))
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.float32)
+        rec = np.concatenate(parts)
+        return rec["ts"], recfunctions.structured_to_unstructured(rec[["x", "y", "z", "v"]])
+
+    def read_downsampled(self, sensor_index, start_ns, end_ns, width_ns):
+        # 日別ファイルごとに min/max で間引いてから連結する（全期間を一度に読み込まない）
+        ts_parts, val_parts = [], []
+        for rec in self._iter_ranges(sensor_index, start_ns, end_ns):
+            vals = recfunctions.structured_to_unstructured(rec[["x", "y", "z", "v"]])
+            ts, vals = minmax_downsample(np.asarray(rec["ts"]), vals, width_ns)
+            ts_parts.append(ts)
+            val_parts.append(vals)
+        if not ts_parts:
+            return np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.float32)
+        return np.concatenate(ts_parts), np.concatenate(val_parts)
+
+    def first_day_ns(self):
+        # 最も古い日別パーティションの開始時刻（なければ None）
+        days = sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+        if not days:
+            return None
+        return int(np.datetime64(days[0], "D").astype(np.int64)) * NS_PER_DAY
@@ -0,0 +1,323 @@
+import atexit
+import collections
+import contextlib
+import os
+import queue
+import smtplib
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+
+from event_engine import CHANNEL_NAMES, KIND_ONSET
+
+# --- 警報メール送信サービス ---
+# 画面のスクリプト実行とは別スレッドで動き、呼び出し側は queue に積むだけで戻る。
+# SMTP 接続は1本を使い回し、一定時間使わなければ閉じる（切断されていれば張り直す）。
+# アラームが集中したときは宛先ごとに window 秒に1通のダイジェストにまとめる:
+#   最初のイベントから gather 秒待って1通目を送り、以後は前回送信から window 秒経つまで溜める。
+# SMTP サーバー未設定（host=None）の場合は送信せず outbox に積むだけ（画面で内容を確認できる）。
+# 動作確認用のローカル SMTP サーバー: python -m aiosmtpd -n -l localhost:8025
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mail_config (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    address TEXT NOT NULL,
+    enable_alert INTEGER NOT NULL,
+    enable_recovery INTEGER NOT NULL
+);
+"""
+
+DEFAULT_CONFIG = {"address": "admin@example.com", "enable_alert": True, "enable_recovery": False}
+
+# 1通のダイジェストの本文に載せる最大件数（まとめたイベントの数。エリア見出しは数えない。超えた分は件数のみ）
+MAX_DIGEST_LINES = 200
+
+
+class MailDispatcher:
+    # イベントのセンサー名・エリア名は event_log（event_engine.EventLog）のキー表から引く
+    def __init__(self, db_path, event_log, tz,
+                 host=None, port=25, sender="sensor-monitor@localhost", username=None, password=None,
+                 starttls=False, window=60.0, gather=2.0, idle_timeout=60.0, retry_delay=30.0, max_attempts=3):
+        self.db_path = db_path
+        self.event_log = event_log
+        self.tz = tz
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.window = window
+        self.gather = gather
+        self.idle_timeout = idle_timeout
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with contextlib.closing(sqlite3.connect(db_path)) as conn, conn:
+            conn.executescript(SCHEMA)
+            row = conn.execute("SELECT address, enable_alert, enable_recovery FROM mail_config").fetchone()
+        if row is None:
+            self.config = dict(DEFAULT_CONFIG)
+        else:
+            self.config = {"address": row[0], "enable_alert": bool(row[1]), "enable_recovery": bool(row[2])}
+
+        self.queue = queue.Queue()
+        # SMTP サーバー未設定のときは送らずにここへ残す（直近 50 通）
+        self.outbox = collections.deque(maxlen=50)
+        # stats・_pending・outbox は送信スレッドと画面・通知元のスレッドから触るため lock で守る
+        self.lock = threading.Lock()
+        self.stats = {
+            "queued_events": 0,
+            "sent": 0,
+            "stored": 0,
+            "failed": 0,
+            "connections": 0,
+            "last_sent_at": None,
+            "last_error": None,
+        }
+        # 宛先ごとの未送信イベント・送信予定時刻・前回送信時刻と、送信待ちのメール (送信時刻, 試行回数, メール)
+        self._pending = {}
+        self._due = {}
+        self._last_sent = {}
+        self._outgoing = []
+        self._smtp = None
+        self._smtp_used = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- 設定（全セッション共通） ---
+    def update_config(self, address, enable_alert, enable_recovery):
+        config = {"address": address, "enable_alert": bool(enable_alert), "enable_recovery": bool(enable_recovery)}
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO mail_config (id, address, enable_alert, enable_recovery) VALUES (1, ?, ?, ?)",
+                (address, int(config["enable_alert"]), int(config["enable_recovery"])),
+            )
+        # 参照側が途中の状態を見ないよう、辞書ごと差し替える
+        self.config = config
+
+    def recipients(self):
+        # 通報先はカンマ区切りで複数指定できる
+        return [a.strip() for a in self.config["address"].split(",") if a.strip()]
+
+    # --- 呼び出し側（ブロックしない） ---
+    def notify(self, rows):
+        # event_engine.EventEngine のリスナー。設定で無効な区分はここで捨てる
+        config = self.config
+        rows = [
+            r for r in rows
+            if (config["enable_alert"] if r[3] == KIND_ONSET else config["enable_recovery"])
+        ]
+        if rows:
+            self.queue.put(("events", rows))
+            with self.lock:
+                self.stats["queued_events"] += len(rows)
+
+    def send_test(self):
+        self.queue.put(("test", None))
+
+    def snapshot(self):
+        # 画面表示用の複製（outbox は古い順のリスト）
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pending_events"] = sum(len(v) for v in self._pending.values())
+            stats["outbox"] = list(self.outbox)
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mail-dispatcher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    # --- 送信スレッド ---
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            wakeups = list(self._due.values()) + [t for t, _, _ in self._outgoing]
+            if self._smtp is not None:
+                wakeups.append(self._smtp_used + self.idle_timeout)
+            timeout = min([max(t - now, 0.0) for t in wakeups] + [1.0])
+            try:
+                kind, payload = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            else:
+                self._handle(kind, payload)
+                # 続けて届いている分もまとめて取り込む
+                while True:
+                    try:
+                        kind, payload = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    self._handle(kind, payload)
+            self._send_due(time.monotonic())
+        # 終了時は溜まっている分を送ってから閉じる
+        while True:
+            try:
+                kind, payload = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._handle(kind, payload)
+        self._send_due(float("inf"))
+        self._close()
+
+    def _handle(self, kind, payload):
+        now = time.monotonic()
+        if kind == "test":
+            for address in self.recipients():
+                self._outgoing.append((now, 0, self._test_message(address)))
+            return
+        for address in self.recipients():
+            with self.lock:
+                self._pending.setdefault(address, []).extend(payload)
+            if address not in self._due:
+                last = self._last_sent.get(address)
+                due = now + self.gather
+                if last is not None:
+                    due = max(due, last + self.window)
+                self._due[address] = due
+
+    def _send_due(self, now):
+        for address, due in list(self._due.items()):
+            if due > now:
+                continue
+            with self.lock:
+                rows = self._pending.pop(address, [])
+            del self._due[address]
+            if rows:
+                self._last_sent[address] = min(now, time.monotonic())
+                self._outgoing.append((0.0, 0, self._digest_message(address, rows)))
+        outgoing, self._outgoing = self._outgoing, []
+        for at, attempts, msg in outgoing:
+            if at > now:
+                self._outgoing.append((at, attempts, msg))
+            elif not self._deliver(msg) and attempts + 1 < self.max_attempts and now != float("inf"):
+                self._outgoing.append((time.monotonic() + self.retry_delay, attempts + 1, msg))
+        if self._smtp is not None and time.monotonic() - self._smtp_used > self.idle_timeout:
+            self._close()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=10)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        with self.lock:
+            self.stats["connections"] += 1
+        return smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _deliver(self, msg):
+        if self.host is None:
+            # 送信はしていないので「送信済み」には数えない
+            with self.lock:
+                self.outbox.append(msg)
+                self.stats["stored"] += 1
+            return True
+        # 使い回している接続が切れていた場合は1回だけ張り直して送る
+        for _ in range(2):
+            try:
+                if self._smtp is None:
+                    self._smtp = self._connect()
+                self._smtp.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                self._smtp = None
+                error = e
+                continue
+            except (smtplib.SMTPException, OSError) as e:
+                self._close()
+                error = e
+                break
+            self._smtp_used = time.monotonic()
+            self._sent()
+            return True
+        with self.lock:
+            self.stats["failed"] += 1
+            self.stats["last_error"] = f"{msg['To']}: {error}"
+        return False
+
+    def _sent(self):
+        with self.lock:
+            self.stats["sent"] += 1
+            self.stats["last_sent_at"] = datetime.now(self.tz)
+            self.stats["last_error"] = None
+
+    # --- メール本文 ---
+    def _message(self, address, subject, body):
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = address
+        msg["Subject"] = subject
+        msg["Date"] = datetime.now(self.tz)
+        msg.set_content(body)
+        return msg
+
+    def _test_message(self, address):
+        return self._message(
+            address,
+            "[振動センサー監視] テストメール",
+            "振動センサー監視システムからのテストメールです。\nこのアドレスに警報メールが届きます。\n",
+        )
+
+    def _digest_message(self, address, rows):
+        # 同じセンサー・軸・区分のイベントは1行にまとめ、エリアごとに時刻順で並べる
+        groups = collections.OrderedDict()
+        for row in sorted(rows):
+            ts, sensor, area, kind, channel, value, peak, onset_ts = row
+            key = (area, sensor, channel, kind)
+            if key in groups:
+                first, _, count, _ = groups[key]
+                groups[key] = (first, ts, count + 1, peak)
+            else:
+                groups[key] = (ts, ts, 1, peak)
+
+        n_onset = sum(1 for r in rows if r[3] == KIND_ONSET)
+        n_recovery = len(rows) - n_onset
+        areas = sorted({r[2] for r in rows})
+        area_names = self.event_log.area_names
+        sensor_names = self.event_log.sensor_names
+        area_text = area_names[areas[0]] + (f" ほか{len(areas) - 1}エリア" if len(areas) > 1 else "")
+        parts = [f"異常発生 {n_onset}件"] if n_onset else []
+        parts += [f"復帰 {n_recovery}件"] if n_recovery else []
+        subject = f"[振動センサー監視] {area_text}: {' / '.join(parts)}"
+
+        lines = []
+        current_area = None
+        shown = 0
+        for (area, sensor, channel, kind), (first, last, count, peak) in sorted(
+                groups.items(), key=lambda item: (item[0][0], item[1][0], item[0][1])):
+            if shown >= MAX_DIGEST_LINES:
+                break
+            if area != current_area:
+                lines.append(f"\n■ {area_names[area]}")
+                current_area = area
+            label = CHANNEL_NAMES[channel] + ("低下" if channel == 3 else "異常")
+            when = datetime.fromtimestamp(first / 1e9, self.tz).strftime("%Y-%m-%d %H:%M:%S")
+            line = f"  {when}  {sensor_names[sensor]}  {label} {'発生' if kind == KIND_ONSET else '復帰'}"
+            line += f"  ピーク {peak:.2f}"
+            if count > 1:
+                line += f"  （{count}回）"
+            lines.append(line)
+            shown += 1
+        if len(groups) > shown:
+            lines.append(f"\n…ほか {len(groups) - shown} 件")
+
+        body = f"{len(rows)}件のイベントが記録されました。\n" + "\n".join(lines) + "\n"
+        return self._message(address, subject, body)
@@ -0,0 +1,329 @@
+import bisect
+import functools
+import http.server
+import threading
+import time
+
+# --- 画面処理の計測（段階ごとの所要時間・送信データ量・キャッシュのヒット率） ---
+# スクリプトの実行を「段階（stage）× 名前」ごとに計り、固定境界のヒストグラムに積む。
+# 1回の計測は perf_counter 2回とロック内の加算だけなので、計測の負荷は実行時間に比べて十分小さい
+# （1回あたりの負荷は起動時に実測し、診断画面に実行時間に対する割合として表示する）。
+# 集計はプロセス全体（全セッション共通）で持ち、診断画面と Prometheus 形式のテキストの両方から参照する。
+#   段階: run（スクリプト全体）/ page（画面の処理）/ data（データ取得）/ styling（表の描画）/
+#         chart（グラフの作成・送信）/ dialog（詳細ダイアログ）/ fragment（自動更新部分の再実行）
+
+# 所要時間（秒）とデータ量（バイト）のバケット境界（この値以下を数える。最後に +Inf がつく）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+PREFIX = "sensor_dashboard"
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # バケット内を線形補間した分位点（Prometheus の histogram_quantile と同じ考え方）。
+        # 補間の範囲は実測の最小値・最大値で狭める（件数が少ない場合に実測値から離れないように）
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c > 0:
+                lo = max(self.bounds[i - 1] if i > 0 else 0.0, self.min)
+                hi = min(self.bounds[i] if i < len(self.bounds) else self.max, self.max)
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.max
+
+
+class _Stage:
+    # with 文で使う計測区間（enabled=False の場合は _NULL_STAGE を返すので作られない）
+    __slots__ = ("_metrics", "_key", "_t0")
+
+    def __init__(self, metrics, key):
+        self._metrics = metrics
+        self._key = key
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics._observe(self._metrics._latency, self._key, time.perf_counter() - self._t0, LATENCY_BUCKETS)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._payload = {}
+        self._cache = {}
+        self._sizing_sec = 0.0
+        self._fragment_sec = 0.0
+        # 実行中のスクリプト（セッションごとのスレッド）の開始時刻。None は全体の実行中でない（自動更新部分だけの再実行）
+        self._run = threading.local()
+        self.stage_cost = self._calibrate() if enabled else 0.0
+
+    # --- 計測 ---
+
+    def stage(self, stage, name=""):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, (stage, name))
+
+    def timed(self, stage, name):
+        # 関数全体を1つの段階として計るデコレーター（例外・st.rerun() で抜けた場合も記録する）
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def begin_run(self):
+        # スクリプト全体の実行の開始（スクリプトの先頭で呼ぶ）
+        self._run.started = time.perf_counter()
+
+    def end_run(self, name):
+        # スクリプト全体の実行の終了。st.rerun() / st.stop() で途中で抜けた回は記録しない
+        started = getattr(self._run, "started", None)
+        self._run.started = None
+        if started is not None:
+            self.observe("run", name, time.perf_counter() - started)
+
+    def fragment(self, name):
+        # st.fragment で一定間隔で再実行する関数を計るデコレーター。
+        # 全体の実行の外で動いた時間は、計測の負荷の割合の分母（実行時間）に加える
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                t0 = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - t0
+                    self.observe("fragment", name, elapsed)
+                    if getattr(self._run, "started", None) is None:
+                        with self._lock:
+                            self._fragment_sec += elapsed
+            return wrapper
+        return decorate
+
+    def observe(self, stage, name, seconds):
+        if self.enabled:
+            self._observe(self._latency, (stage, name), seconds, LATENCY_BUCKETS)
+
+    def payload(self, name, data):
+        # 画面へ送るデータの大きさ。data は DataFrame か、データセットを差し込んだ Vega-Lite 仕様（dict）
+        if self.enabled:
+            t0 = time.perf_counter()
+            nbytes = spec_nbytes(data) if isinstance(data, dict) else frame_nbytes(data)
+            # 大きさの算出は計測そのものの負荷として数える
+            sizing = time.perf_counter() - t0
+            self._observe(self._payload, name, nbytes, SIZE_BUCKETS)
+            with self._lock:
+                self._sizing_sec += sizing
+
+    def cache_result(self, name, hit):
+        if self.enabled:
+            with self._lock:
+                counts = self._cache.setdefault(name, [0, 0])
+                counts[0 if hit else 1] += 1
+
+    def cached(self, name, cache):
+        # cache: st.cache_data(...) などのキャッシュのデコレーター。
+        # 呼び出し回数と、関数本体が実行された回数（= ミス）からヒット率を求める
+        def decorate(func):
+            local = threading.local()
+
+            @functools.wraps(func)
+            def body(*args, **kwargs):
+                local.miss = True
+                return func(*args, **kwargs)
+
+            cached_body = cache(body)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                local.miss = False
+                result = cached_body(*args, **kwargs)
+                self.cache_result(name, not local.miss)
+                return result
+
+            wrapper.clear = cached_body.clear
+            return wrapper
+        return decorate
+
+    def _observe(self, table, key, value, bounds):
+        with self._lock:
+            hist = table.get(key)
+            if hist is None:
+                hist = table[key] = Histogram(bounds)
+            hist.observe(value)
+
+    def _calibrate(self, n=2000):
+        # 計測区間1回あたりの負荷（秒）を実測する（計測結果には残さない）
+        key = ("calibrate", "")
+        t0 = time.perf_counter()
+        for _ in range(n):
+            with _Stage(self, key):
+                pass
+        cost = (time.perf_counter() - t0) / n
+        del self._latency[key]
+        return cost
+
+    def reset(self):
+        with self._lock:
+            self._latency = {}
+            self._payload = {}
+            self._cache = {}
+            self._sizing_sec = 0.0
+            self._fragment_sec = 0.0
+            self.started_at = time.time()
+
+    # --- 参照 ---
+
+    def snapshot(self):
+        # 診断画面用の集計 (所要時間, データ量, キャッシュの (ヒット, ミス))。ヒストグラムは複製して返す
+        with self._lock:
+            latency = {k: _copy(h) for k, h in self._latency.items()}
+            payload = {k: _copy(h) for k, h in self._payload.items()}
+            cache = {k: tuple(v) for k, v in self._cache.items()}
+        return latency, payload, cache
+
+    def overhead_ratio(self):
+        # 計測の負荷の推定値（計測区間の数 × 1回あたりの負荷 + データ量の算出時間）と、
+        # 実行時間（スクリプト全体の実行 + 自動更新部分だけの再実行）に対する割合
+        with self._lock:
+            n = sum(h.count for h in self._latency.values()) + sum(h.count for h in self._payload.values())
+            run = sum(h.sum for (stage, _), h in self._latency.items() if stage == "run") + self._fragment_sec
+            cost = n * self.stage_cost + self._sizing_sec
+        return cost, (cost / run if run > 0 else float("nan"))
+
+    def prometheus_text(self):
+        latency, payload, cache = self.snapshot()
+        lines = []
+        _histogram_lines(lines, f"{PREFIX}_stage_seconds", "画面処理の段階ごとの所要時間（秒）",
+                         {k: ({"stage": k[0], "name": k[1]}, h) for k, h in latency.items()})
+        _histogram_lines(lines, f"{PREFIX}_payload_bytes", "画面へ送るデータの大きさ（バイト）",
+                         {k: ({"name": k}, h) for k, h in payload.items()})
+        lines.append(f"# HELP {PREFIX}_cache_requests_total キャッシュの参照回数（result: hit / miss）")
+        lines.append(f"# TYPE {PREFIX}_cache_requests_total counter")
+        for name, (hits, misses) in sorted(cache.items()):
+            lines.append(f'{PREFIX}_cache_requests_total{{cache="{_escape(name)}",result="hit"}} {hits}')
+            lines.append(f'{PREFIX}_cache_requests_total{{cache="{_escape(name)}",result="miss"}} {misses}')
+        lines.append(f"# HELP {PREFIX}_metrics_overhead_seconds 計測そのものの負荷の推定値（秒）")
+        lines.append(f"# TYPE {PREFIX}_metrics_overhead_seconds gauge")
+        lines.append(f"{PREFIX}_metrics_overhead_seconds {self.overhead_ratio()[0]:.6g}")
+        return "\n".join(lines) + "\n"
+
+
+def _copy(hist):
+    out = Histogram(hist.bounds)
+    out.counts = list(hist.counts)
+    out.count = hist.count
+    out.sum = hist.sum
+    out.min = hist.min
+    out.max = hist.max
+    return out
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(lines, metric, help_text, series):
+    lines.append(f"# HELP {metric} {help_text}")
+    lines.append(f"# TYPE {metric} histogram")
+    for _, (labels, hist) in sorted(series.items()):
+        label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        cumulative = 0
+        for bound, c in zip(hist.bounds + (float("inf"),), hist.counts):
+            cumulative += c
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'{metric}_bucket{{{label_text},le="{le}"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{label_text}}} {hist.sum:.6g}")
+        lines.append(f"{metric}_count{{{label_text}}} {hist.count}")
+
+
+def frame_nbytes(df):
+    # 送信データ量の目安（列の配列の大きさの合計）。memory_usage(deep=True) は1回で数 ms かかるので使わない
+    return int(sum(col.nbytes for _, col in df.items()))
+
+
+def spec_nbytes(spec):
+    # Vega-Lite 仕様（chart_specs）に差し込んだデータセットの大きさの合計
+    return sum(frame_nbytes(df) for df in spec.get("datasets", {}).values())
+
+
+class MetricsServer:
+    # Prometheus 形式のテキストを返す HTTP エンドポイント（GET /metrics）。既定ではローカルからのみ受け付ける
+    def __init__(self, metrics, host="127.0.0.1", port=9108):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
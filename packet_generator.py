@@ -0,0 +1,96 @@
+import argparse
+import socket
+import time
+
+import numpy as np
+
+from ingest import MAX_DATAGRAM, PACKET
+from simulator import FAULT_KINDS, NS_PER_SEC, FleetSimulator, Replayer, record, stream
+
+# --- 模擬センサーパケット送信スクリプト ---
+# 実機の代わりに、受信サービス（ingest.IngestService）へ UDP でパケットを送る。
+# 波形は simulator.FleetSimulator で作るので、同じ --seed なら同じデータになる。
+#   python packet_generator.py --port 9999 --sensors 110 --hz 1
+#   python packet_generator.py --port 9999 --sensors 1000 --hz 1000 --duration 10 --datagram 65000
+#   python packet_generator.py --sensors 110 --hz 100 --duration 600 --record capture.bin
+#   python packet_generator.py --port 9999 --replay capture.bin --speed 20
+# 故障の注入: --fault bearing:5:30:120:0.8（種類:センサー番号:開始秒:継続秒:大きさ、開始は送信開始から）
+
+
+def udp_sender(host, port, datagram_bytes):
+    # パケット配列をデータグラム（パケット境界で区切る）に分けて送る
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    step = max(datagram_bytes // PACKET.itemsize, 1) * PACKET.itemsize
+
+    def send(packets):
+        payload = packets.tobytes()
+        for offset in range(0, len(payload), step):
+            sock.sendto(payload[offset:offset + step], (host, port))
+
+    return send
+
+
+def parse_fault(text):
+    kind, sensor, start, duration, magnitude = text.split(":")
+    if kind not in FAULT_KINDS:
+        raise argparse.ArgumentTypeError(f"故障の種類は {', '.join(FAULT_KINDS)} のいずれかです")
+    return kind, int(sensor), float(start), float(duration), float(magnitude)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="振動センサーの模擬パケットを UDP で送信します")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--sensors", type=int, default=110, help="センサー数（番号は1から）")
+    parser.add_argument("--hz", type=float, default=1.0, help="センサー1台あたりのサンプリング周波数")
+    parser.add_argument("--duration", type=float, default=0, help="送信時間（秒）。0 は無制限")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spike-prob", type=float, default=0.01, help="単発スパイクの確率（1サンプルあたり）")
+    parser.add_argument("--fault", type=parse_fault, action="append", default=[],
+                        help="故障の注入（種類:センサー番号:開始秒:継続秒:大きさ）。複数指定可")
+    parser.add_argument("--random-faults", type=int, default=0, help="送信時間内にランダムに注入する故障の件数")
+    parser.add_argument("--datagram", type=int, default=1400, help="1データグラムの最大バイト数")
+    parser.add_argument("--record", metavar="PATH", help="送信せず、--duration 秒分をキャプチャファイルに書く")
+    parser.add_argument("--replay", metavar="PATH", help="キャプチャファイルを再生して送信する")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度（1〜100 倍）")
+    parser.add_argument("--loop", action="store_true", help="キャプチャを繰り返し再生する")
+    args = parser.parse_args()
+
+    udp_send = udp_sender(args.host, args.port, min(args.datagram, MAX_DATAGRAM))
+    sent = 0
+
+    def send(packets):
+        nonlocal sent
+        udp_send(packets)
+        sent += len(packets)
+
+    started = time.monotonic()
+    try:
+        if args.replay:
+            Replayer(args.replay, args.speed).run(send, loop=args.loop)
+        else:
+            simulator = FleetSimulator(args.sensors, args.hz, seed=args.seed, spike_prob=args.spike_prob)
+            start_ns = time.time_ns()
+            for kind, sensor, start, duration, magnitude in args.fault:
+                simulator.inject(kind, sensor - 1, start_ns + int(start * NS_PER_SEC), duration, magnitude)
+            if args.random_faults:
+                span = args.duration or 3600
+                simulator.random_faults(args.random_faults, start_ns, start_ns + int(span * NS_PER_SEC))
+            numbers = np.arange(1, args.sensors + 1)
+            if args.record:
+                if not args.duration:
+                    parser.error("--record には --duration が必要です")
+                ticks = int(args.duration * args.hz)
+                written = record(simulator, args.record, start_ns // simulator.period_ns, ticks, numbers)
+                print(f"記録完了: {args.record}（{written:,} サンプル）")
+                return
+            stream(simulator, send, numbers, args.duration)
+    except KeyboardInterrupt:
+        pass
+
+    elapsed = time.monotonic() - started
+    print(f"送信完了: {sent} サンプル / {elapsed:.1f} 秒 ({sent / max(elapsed, 1e-9):,.0f} サンプル/秒)")
+
+
+if __name__ == "__main__":
+    main()
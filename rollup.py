@@ -0,0 +1,137 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from timeseries_store import VALUE_COLUMNS
+
+# --- 多段階ロールアップ（1分 / 1時間） ---
+# センサー × バケットの固定長リングに件数・合計・二乗和・最小・最大を持ち、
+# サンプル到着ごとに差分だけ加算する。長期間の表示は生データを走査せずにこれを読む。
+# バケットの位置は (バケット番号 % capacity) で決まり、古いバケットは上書きされる。
+#
+# メモリ使用量は確保時に決まり、以後増えない（センサー × バケットあたり）:
+#   バケット番号 8B + 件数 4B + X/Y/Z/V × (合計・二乗和 各 sum_dtype + 最小・最大 各 4B)
+#   = 76B（sum_dtype=float32）/ 108B（float64）
+#   例）10,000センサー × 1分幅 1,440バケット(float32) ≒ 1.1GB、1時間幅 168バケット(float64) ≒ 180MB
+# 最小・最大は元データ（時系列ストア）と同じ float32 なので誤差はない。合計・二乗和を float32 にすると
+# バケット内の件数が多いほど丸め誤差が増えるため、件数の少ない短い幅の段階だけに使う。
+
+
+class Rollup:
+    def __init__(self, n_sensors, width_sec, capacity, sum_dtype=np.float64):
+        self.width_ns = int(width_sec * 1_000_000_000)
+        self.capacity = int(capacity)
+        shape = (n_sensors, self.capacity)
+        self.bucket = np.full(shape, -1, dtype=np.int64)
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.sum = np.zeros(shape + (4,), dtype=sum_dtype)
+        self.sumsq = np.zeros(shape + (4,), dtype=sum_dtype)
+        self.min = np.full(shape + (4,), np.inf, dtype=np.float32)
+        self.max = np.full(shape + (4,), -np.inf, dtype=np.float32)
+        # 集計を開始した時刻（これより前のバケットは持っていない）
+        self.first_ns = None
+        self.lock = threading.Lock()
+
+    def add(self, sensor_idx, times_ns, values):
+        # sensor_idx: (m,)  times_ns: (m,)  values: (m, 4)
+        sensor_idx = np.asarray(sensor_idx, dtype=np.int64)
+        b = np.asarray(times_ns, dtype=np.int64) // self.width_ns
+        slot = b % self.capacity
+        values = np.asarray(values, dtype=np.float64)
+        if len(b) == 0:
+            return
+        with self.lock:
+            # すでに新しいバケットで上書きされた位置への遅延サンプルと、
+            # 同じバッチ内で保持数を超えて古くなるサンプルは捨てる
+            keep = (b >= self.bucket[sensor_idx, slot]) & (b > b.max() - self.capacity)
+            if not keep.all():
+                sensor_idx, b, slot, values = sensor_idx[keep], b[keep], slot[keep], values[keep]
+
+            stale = b > self.bucket[sensor_idx, slot]
+            if stale.any():
+                si, sl = sensor_idx[stale], slot[stale]
+                self.bucket[si, sl] = b[stale]
+                self.count[si, sl] = 0
+                self.sum[si, sl] = 0.0
+                self.sumsq[si, sl] = 0.0
+                self.min[si, sl] = np.inf
+                self.max[si, sl] = -np.inf
+
+            first = int(b.min()) * self.width_ns
+            if self.first_ns is None or first < self.first_ns:
+                self.first_ns = first
+
+            # (センサー, 位置) ごとにまとめてから1回ずつ加算する（np.add.at は要素ごとの処理で遅い）
+            key = sensor_idx * self.capacity + slot
+            order = np.argsort(key, kind="stable")
+            key, values = key[order], values[order]
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1))
+            cells = key[starts]
+            count = self.count.reshape(-1)
+            count[cells] += np.diff(np.append(starts, len(key))).astype(count.dtype)
+            for table, part in ((self.sum, values), (self.sumsq, values * values)):
+                flat = table.reshape(-1, 4)
+                flat[cells] += np.add.reduceat(part, starts, axis=0)
+            lo, hi = self.min.reshape(-1, 4), self.max.reshape(-1, 4)
+            lo[cells] = np.minimum(lo[cells], np.minimum.reduceat(values, starts, axis=0))
+            hi[cells] = np.maximum(hi[cells], np.maximum.reduceat(values, starts, axis=0))
+
+    def add_ticks(self, times_ns, values):
+        # 全センサー同時刻のサンプル（values: (k, センサー数, 4)）
+        k, n = values.shape[0], values.shape[1]
+        sensor_idx = np.tile(np.arange(n), k)
+        self.add(sensor_idx, np.repeat(times_ns, n), values.reshape(k * n, 4))
+
+    def query(self, sensor_index, start_ns, end_ns):
+        # start_ns〜end_ns に掛かるバケットを時刻順に返す
+        with self.lock:
+            row = self.bucket[sensor_index]
+            sel = np.flatnonzero((row >= start_ns // self.width_ns) & (row <= end_ns // self.width_ns))
+            sel = sel[np.argsort(row[sel])]
+            count = self.count[sensor_index, sel]
+            total = self.sum[sensor_index, sel]
+            total_sq = self.sumsq[sensor_index, sel]
+            lo = self.min[sensor_index, sel]
+            hi = self.max[sensor_index, sel]
+            starts = row[sel] * self.width_ns
+        n = count[:, None]
+        return {
+            "timestamp": starts,
+            "count": count,
+            "min": lo,
+            "max": hi,
+            "mean": total / n,
+            "rms": np.sqrt(total_sq / n),
+        }
+
+    def grid(self, sensor_idx, start_bucket, n_buckets):
+        # 複数センサーの連続したバケット列を compare.align_samples と同じ形のグリッド
+        # （(k, n_buckets) の件数と (k, n_buckets, 4) の合計・二乗和・最小・最大）で返す。
+        # 保持していないバケット（上書き済み・未到着）は件数 0
+        sensor_idx = np.asarray(sensor_idx, dtype=np.int64)[:, None]
+        b = start_bucket + np.arange(n_buckets)
+        slot = b % self.capacity
+        with self.lock:
+            valid = self.bucket[sensor_idx, slot] == b
+            cell = valid[..., None]
+            return {
+                "count": np.where(valid, self.count[sensor_idx, slot], 0).astype(np.int64),
+                "sum": np.where(cell, self.sum[sensor_idx, slot], 0.0).astype(np.float64),
+                "sumsq": np.where(cell, self.sumsq[sensor_idx, slot], 0.0).astype(np.float64),
+                "min": np.where(cell, self.min[sensor_idx, slot], np.inf).astype(np.float64),
+                "max": np.where(cell, self.max[sensor_idx, slot], -np.inf).astype(np.float64),
+            }
+
+
+def rollup_frame(result, tz):
+    # 列名: 平均値は元の列名のまま、他は "_min" / "_max" / "_rms" を付ける
+    index = pd.DatetimeIndex(result["timestamp"].view("datetime64[ns]"), name="timestamp")
+    index = index.tz_localize("UTC").tz_convert(tz)
+    data = {}
+    for j, col in enumerate(VALUE_COLUMNS):
+        data[col] = result["mean"][:, j]
+        data[f"{col}_min"] = result["min"][:, j]
+        data[f"{col}_max"] = result["max"][:, j]
+        data[f"{col}_rms"] = result["rms"][:, j]
+    return pd.DataFrame(data, index=index)
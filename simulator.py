@@ -0,0 +1,287 @@
+import os
+import time
+
+import numpy as np
+
+from ingest import PACKET, encode_packets
+
+# --- 振動センサーの模擬データ（負荷試験・デモ用） ---
+# センサーごとのパラメーター（回転周波数・高調波・電池の放電速度など）は seed から決まり、
+# 各時刻の値は (seed, 時刻) だけで決まる。同じ seed なら、どんな区切りで生成しても同じ値になる。
+#   振動 X/Y/Z: 回転周波数の 1x〜3x の正弦波 + ノイズ（Z は重力 1G を含む）
+#   軸受け損傷: 欠陥周波数ごとの減衰振動（インパルス列）
+#   電池電圧:   start_ns からの経過日数に比例して下がる
+#   故障注入:   inject() / random_faults() で期間を指定して上乗せする
+# ノイズは時刻をブロック（block_ticks 件）に区切り、ブロック番号をカウンターにした Philox 乱数で作る。
+#
+# 記録・再生: ingest.PACKET（受信パケットと同じ形式）の連続をファイルに書き、Replayer で
+# 1〜100 倍速で再生する。再生時の時刻は再生した時刻に付け替える（倍速ではその分高いレートになる）。
+
+NS_PER_SEC = 1_000_000_000
+NS_PER_DAY = 86_400 * NS_PER_SEC
+
+FAULT_KINDS = ("bearing", "imbalance", "battery")
+
+# 1ブロックのノイズ配列の要素数の目安（センサー数が多いほどブロックの時刻数を減らす）
+BLOCK_ELEMENTS = 1 << 20
+
+
+class FleetSimulator:
+    def __init__(self, n_sensors, rate_hz=1.0, seed=0, start_ns=0, spike_prob=0.0, block_ticks=None):
+        self.n_sensors = int(n_sensors)
+        self.rate_hz = float(rate_hz)
+        self.period_ns = int(round(NS_PER_SEC / rate_hz))
+        self.seed = int(seed)
+        self.start_ns = int(start_ns)
+        self.spike_prob = float(spike_prob)
+        if block_ticks is None:
+            block_ticks = max(1, min(1024, BLOCK_ELEMENTS // (4 * self.n_sensors)))
+        self.block_ticks = int(block_ticks)
+
+        n = self.n_sensors
+        rng = np.random.default_rng([self.seed, 0])
+        self.f0 = rng.uniform(10.0, 50.0, n)
+        # 1x の振幅 (G)（X, Y, Z）と、2x・3x の 1x に対する比
+        self.amp = rng.uniform(0.01, 0.04, (n, 3)) * np.array([1.0, 1.0, 0.5])
+        self.harmonics = np.column_stack([np.ones(n), rng.uniform(0.1, 0.5, (n, 2))])
+        phase = rng.uniform(0.0, 2 * np.pi, (n, 3, 3))
+        # 高調波 h の成分 A·sin(hθ + φ) = (A·cos φ)·sin hθ + (A·sin φ)·cos hθ の係数 (センサー数, 高調波, 軸)
+        scale = self.harmonics[:, :, None] * self.amp[:, None, :]
+        self.coef_sin = (scale * np.cos(phase)).astype(np.float32)
+        self.coef_cos = (scale * np.sin(phase)).astype(np.float32)
+        self.noise = rng.uniform(0.02, 0.04, n)
+        self.v0 = rng.normal(3.3, 0.02, n)
+        # 電池の放電速度 (V / 日)
+        self.discharge = rng.uniform(0.001, 0.005, n)
+        # 軸受け外輪の欠陥周波数（回転周波数の 3〜5.5 倍）と、減衰振動の共振周波数
+        self.bearing_freq = self.f0 * rng.uniform(3.0, 5.5, n)
+        self.resonance = rng.uniform(800.0, 2000.0, n)
+
+        # 故障（センサー番号, 種類, 開始時刻, 終了時刻, 大きさ）の配列
+        self.faults = {
+            "sensor": np.empty(0, dtype=np.int64),
+            "kind": np.empty(0, dtype=np.int64),
+            "start": np.empty(0, dtype=np.int64),
+            "end": np.empty(0, dtype=np.int64),
+            "magnitude": np.empty(0, dtype=np.float64),
+        }
+        self._block = None
+
+    # --- 故障注入 ---
+    def inject(self, kind, sensors, start_ns, duration_sec, magnitude):
+        # kind: "bearing"（減衰振動の振幅 G）/ "imbalance"（1x 振幅の増分 G）/ "battery"（電圧低下 V）
+        sensors = np.atleast_1d(np.asarray(sensors, dtype=np.int64))
+        n = len(sensors)
+        start_ns = int(start_ns)
+        return self._add_faults(
+            sensors, np.full(n, FAULT_KINDS.index(kind)), np.full(n, start_ns),
+            np.full(n, start_ns + int(duration_sec * NS_PER_SEC)), np.broadcast_to(magnitude, (n,)),
+        )
+
+    def random_faults(self, count, start_ns, end_ns, min_sec=60, max_sec=600):
+        # start_ns〜end_ns の間に count 件の故障を seed から決めて注入する
+        rng = np.random.default_rng([self.seed, 1])
+        kinds = rng.integers(0, len(FAULT_KINDS), count)
+        starts = rng.integers(int(start_ns), int(end_ns), count)
+        ends = starts + (rng.uniform(min_sec, max_sec, count) * NS_PER_SEC).astype(np.int64)
+        # 閾値（既定 X/Y 0.5G・電圧 2.8V）を超える程度の大きさ
+        magnitude = np.choose(kinds, [rng.uniform(0.6, 1.2, count), rng.uniform(0.5, 0.9, count),
+                                      rng.uniform(0.6, 1.0, count)])
+        return self._add_faults(rng.integers(0, self.n_sensors, count), kinds, starts, ends, magnitude)
+
+    def _add_faults(self, sensors, kinds, starts, ends, magnitude):
+        add = {"sensor": sensors, "kind": kinds, "start": starts, "end": ends, "magnitude": magnitude}
+        self.faults = {
+            k: np.concatenate([self.faults[k], np.asarray(add[k], dtype=self.faults[k].dtype)]) for k in self.faults
+        }
+        return self
+
+    # --- 生成 ---
+    def _noise_block(self, block):
+        # ブロック番号をカウンターにした乱数（(block_ticks, センサー数, 4) の正規乱数と、スパイク用の一様乱数）
+        if self._block is not None and self._block[0] == block:
+            return self._block[1]
+        gen = np.random.Generator(np.random.Philox(key=self.seed, counter=[0, 0, block % (1 << 64), 1]))
+        shape = (self.block_ticks, self.n_sensors)
+        arrays = (
+            gen.standard_normal(shape + (4,), dtype=np.float32),
+            gen.random(shape, dtype=np.float32),
+            gen.random(shape, dtype=np.float32),
+        )
+        self._block = (block, arrays)
+        return arrays
+
+    def _noise(self, start_tick, k):
+        normal = np.empty((k, self.n_sensors, 4), dtype=np.float32)
+        u_spike = np.empty((k, self.n_sensors), dtype=np.float32)
+        u_size = np.empty((k, self.n_sensors), dtype=np.float32)
+        tick = start_tick
+        while tick < start_tick + k:
+            block, offset = divmod(tick, self.block_ticks)
+            take = min(self.block_ticks - offset, start_tick + k - tick)
+            at = slice(tick - start_tick, tick - start_tick + take)
+            src = slice(offset, offset + take)
+            arrays = self._noise_block(block)
+            normal[at], u_spike[at], u_size[at] = arrays[0][src], arrays[1][src], arrays[2][src]
+            tick += take
+        return normal, u_spike, u_size
+
+    def batch(self, start_tick, k):
+        # 時刻番号 start_tick から k 件（全センサー同時刻）。戻り値は (k,) の時刻と (k, センサー数, 4) の値
+        ticks = int(start_tick) + np.arange(k, dtype=np.int64)
+        times_ns = ticks * self.period_ns
+        t = times_ns / NS_PER_SEC
+        values = np.empty((k, self.n_sensors, 4), dtype=np.float32)
+
+        # 振動: sin θ・cos θ を1回ずつ求め、2x・3x は倍角・3倍角の公式で作る（θ = 2π f0 t）
+        cycles = np.multiply.outer(t % 86_400, self.f0)
+        angle = (2 * np.pi * (cycles % 1.0)).astype(np.float32)
+        s1, c1 = np.sin(angle), np.cos(angle)
+        s2, c2 = 2 * s1 * c1, 2 * c1 * c1 - 1
+        s3, c3 = s1 * (3 - 4 * s1 * s1), c1 * (4 * c1 * c1 - 3)
+        normal, u_spike, u_size = self._noise(int(start_tick), k)
+        noise = self.noise.astype(np.float32)
+        for axis in range(3):
+            cs, cc = self.coef_sin[:, :, axis], self.coef_cos[:, :, axis]
+            values[..., axis] = (
+                s1 * cs[:, 0] + c1 * cc[:, 0] + s2 * cs[:, 1] + c2 * cc[:, 1] + s3 * cs[:, 2] + c3 * cc[:, 2]
+                + normal[..., axis] * noise
+            )
+        values[..., 2] += 1.0
+
+        days = (times_ns - self.start_ns) / NS_PER_DAY
+        volt = self.v0 - np.multiply.outer(np.maximum(days, 0.0), self.discharge) + normal[..., 3] * 0.01
+        values[..., 3] = np.maximum(volt, 2.0)
+
+        if self.spike_prob > 0:
+            # 単発のスパイク（X 60% / Y 25% / 電圧低下 15%）
+            spike = u_spike < self.spike_prob
+            which = u_spike / self.spike_prob
+            size = 0.5 + 0.5 * u_size
+            values[..., 0] += np.where(spike & (which < 0.6), size, 0)
+            values[..., 1] += np.where(spike & (which >= 0.6) & (which < 0.85), size, 0)
+            values[..., 3] -= np.where(spike & (which >= 0.85), size, 0)
+
+        self._apply_faults(times_ns, t, values, cycles)
+        return times_ns, values
+
+    def _apply_faults(self, times_ns, t, values, cycles):
+        f = self.faults
+        live = (f["start"] <= times_ns[-1]) & (f["end"] > times_ns[0])
+        if not live.any():
+            return
+        sensor, kind = f["sensor"][live], f["kind"][live]
+        start, end, magnitude = f["start"][live], f["end"][live], f["magnitude"][live]
+        # (時刻, 故障) の組のうち期間内のもの
+        ti, fi = np.nonzero((times_ns[:, None] >= start) & (times_ns[:, None] < end))
+        s, m = sensor[fi], magnitude[fi]
+        for code, name in enumerate(FAULT_KINDS):
+            sel = kind[fi] == code
+            if not sel.any():
+                continue
+            tk, sk, mk = ti[sel], s[sel], m[sel]
+            if name == "bearing":
+                # 直前のインパルスからの経過時間 tau に対する減衰振動（X/Y は Z の2倍）
+                tau = ((t[tk] * self.bearing_freq[sk]) % 1.0) / self.bearing_freq[sk]
+                decay = 0.2 / self.bearing_freq[sk]
+                ring = mk * np.exp(-tau / decay) * np.abs(np.sin(2 * np.pi * self.resonance[sk] * tau + 1.0))
+                for axis, weight in ((0, 1.0), (1, 1.0), (2, 0.5)):
+                    np.add.at(values, (tk, sk, axis), ring * weight)
+            elif name == "imbalance":
+                # 1x 成分の増加（X/Y のみ。位相は X と Y で 90° ずらす）
+                angle = 2 * np.pi * cycles[tk, sk]
+                np.add.at(values, (tk, sk, 0), mk * np.abs(np.sin(angle)) + 0.5 * mk)
+                np.add.at(values, (tk, sk, 1), mk * np.abs(np.cos(angle)) + 0.5 * mk)
+            else:
+                np.add.at(values, (tk, sk, 3), -mk)
+
+    def packets(self, start_tick, k, sensor_numbers):
+        # batch() の結果を受信パケット形式（ingest.PACKET、時刻順）にする
+        times_ns, values = self.batch(start_tick, k)
+        n = self.n_sensors
+        flat = values.reshape(k * n, 4)
+        return encode_packets(
+            np.tile(sensor_numbers, k), np.repeat(times_ns, n), flat[:, 0], flat[:, 1], flat[:, 2], flat[:, 3]
+        )
+
+
+def stream(simulator, deliver, sensor_numbers, duration_sec=0, chunk_sec=0.01, stop=None):
+    # 実時間に合わせて生成し、chunk_sec ごとに deliver(パケット配列) へ渡す。duration_sec=0 は無制限
+    # 戻り値は送ったサンプル数
+    period = simulator.period_ns
+    next_tick = time.time_ns() // period + 1
+    started = time.monotonic()
+    sent = 0
+    while not duration_sec or time.monotonic() - started < duration_sec:
+        if stop is not None and stop.is_set():
+            break
+        due = time.time_ns() // period + 1
+        if due > next_tick:
+            packets = simulator.packets(next_tick, int(due - next_tick), sensor_numbers)
+            deliver(packets)
+            sent += len(packets)
+            next_tick = due
+        time.sleep(chunk_sec)
+    return sent
+
+
+# --- 記録と再生 ---
+def record(simulator, path, start_tick, ticks, sensor_numbers, chunk_ticks=None):
+    # start_tick から ticks 件分をキャプチャファイル（ingest.PACKET の連続）に書く（時刻は生成時刻のまま）
+    if chunk_ticks is None:
+        chunk_ticks = simulator.block_ticks
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        for lo in range(0, ticks, chunk_ticks):
+            f.write(simulator.packets(start_tick + lo, min(chunk_ticks, ticks - lo), sensor_numbers).tobytes())
+    return ticks * simulator.n_sensors
+
+
+def open_capture(path):
+    rows = os.path.getsize(path) // PACKET.itemsize
+    return np.memmap(path, dtype=PACKET, mode="r", shape=(rows,))
+
+
+class Replayer:
+    # キャプチャを speed 倍速で再生する。deliver には時刻を再生時刻に付け替えたパケット配列を渡す
+    def __init__(self, path, speed=1.0, max_rows=65_536):
+        if not 1.0 <= speed <= 100.0:
+            raise ValueError("再生速度は 1〜100 倍で指定してください。")
+        self.capture = open_capture(path)
+        self.speed = float(speed)
+        self.max_rows = max_rows
+        self.stats = {"rows": 0, "batches": 0, "lag_ns": 0}
+
+    def run(self, deliver, stop=None, loop=False):
+        ts = self.capture["ts"]
+        if len(ts) == 0:
+            return self.stats
+        span = int(ts[-1] - ts[0]) + 1
+        base_wall = time.time_ns()
+        base_mono = time.monotonic_ns()
+        lap = 0
+        i = 0
+        while True:
+            if stop is not None and stop.is_set():
+                break
+            if i >= len(ts):
+                if not loop:
+                    break
+                lap += 1
+                i = 0
+            # 再生開始からの経過時間をキャプチャ上の時刻に換算し、そこまでのパケットを送る
+            elapsed = int((time.monotonic_ns() - base_mono) * self.speed) - lap * span
+            hi = min(int(np.searchsorted(ts, ts[0] + elapsed, side="right")), i + self.max_rows)
+            if hi <= i:
+                wait = (int(ts[i] - ts[0]) - elapsed) / self.speed / NS_PER_SEC
+                time.sleep(min(max(wait, 0.0), 0.1))
+                continue
+            chunk = np.array(self.capture[i:hi])
+            offset = chunk["ts"] - ts[0] + lap * span
+            chunk["ts"] = base_wall + (offset / self.speed).astype(np.int64)
+            deliver(chunk)
+            self.stats["rows"] += len(chunk)
+            self.stats["batches"] += 1
+            self.stats["lag_ns"] = max(0, elapsed - int(ts[hi - 1] - ts[0]))
+            i = hi
+        return self.stats
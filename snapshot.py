@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pandas as pd
+
+from table_style import highlight_cells, style_table
+
+# --- 全セッション共有のスナップショット ---
+# 判定結果と、一覧表のページ（表示用の表と強調表示の CSS）を、更新周期ごとに1回だけ作って全セッションで共有する。
+# 各セッションは最新スナップショットへの参照を持つだけで、同じ version なら何も作り直さない。
+# スナップショットは作成後に書き換えない（ページは初回参照時に1回だけ作って保持する）。
+# Styler は描画時に内部状態を書き換えるので共有せず、呼び出しごとに共有の表と CSS から作る。
+# 表に載せるのは表示中のページの行だけなので、センサー数が増えてもページの作成量は変わらない。
+# extras(idx, fleet) を渡すと、表に追加する列（振動評価など）もページの行の分だけ作る。
+# metrics（metrics.Metrics）を渡すと、スナップショット・ページの使い回し（キャッシュのヒット）を数える。
+
+
+class FleetSnapshot:
+    def __init__(self, fleet, extras=None, metrics=None):
+        self.fleet = fleet
+        self.extras = extras
+        self.metrics = metrics
+        self.version = fleet.version
+        self.built_at = time.monotonic()
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def table_page(self, area_name=None, anomalies_only=False, axis=None, by_ratio=False,
+                   page=0, page_size=50, extended=False):
+        # 一覧表の1ページ分だけを作ってスタイルを付ける（絞り込み・並べ替えは fleet.select）。
+        # 同じ条件のページの表と CSS は全セッションで共有し、Styler だけを毎回作る。戻り値は (スタイル済みの表, 表示用 DataFrame, 該当件数)
+        extended = extended and self.extras is not None
+        key = (area_name, anomalies_only, axis, by_ratio, page, page_size, extended)
+        cached = self._pages.get(key)
+        if self.metrics is not None:
+            self.metrics.cache_result("table_page", cached is not None)
+        if cached is None:
+            idx, total = self.fleet.select(area_name, anomalies_only, axis, by_ratio, page * page_size, page_size)
+            df = self.fleet.rows_frame(idx, axis, with_area=area_name is None)
+            if extended and len(idx):
+                df = pd.concat([df, self.extras(idx, self.fleet)], axis=1)
+            css = highlight_cells(df, self.fleet.rows_limits(idx))
+            with self._lock:
+                cached = self._pages.setdefault(key, (df, css, total))
+        df, css, total = cached
+        return style_table(df, css=css), df, total
+
+
+class SnapshotPublisher:
+    # build() が返す判定結果から、周期 interval 秒ごとに1回だけスナップショットを作る
+    def __init__(self, build, interval, extras=None, metrics=None):
+        self._build = build
+        self.interval = interval
+        self.extras = extras
+        self.metrics = metrics
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def _fresh(self, snap, threshold_version):
+        return (
+            snap is not None
+            and snap.fleet.threshold_version == threshold_version
+            and time.monotonic() - snap.built_at < self.interval
+        )
+
+    def latest(self, threshold_version=None):
+        snap = self._snapshot
+        built = False
+        if not self._fresh(snap, threshold_version):
+            with self._lock:
+                # 待っている間に他のセッションが作っていればそれを使う
+                snap = self._snapshot
+                built = not self._fresh(snap, threshold_version)
+                if built:
+                    snap = FleetSnapshot(self._build(), self.extras, self.metrics)
+                    self._snapshot = snap
+                    self.builds += 1
+        if self.metrics is not None:
+            self.metrics.cache_result("snapshot", not built)
+        return snap
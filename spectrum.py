@@ -0,0 +1,89 @@
+import numpy as np
+
+# --- 振動スペクトル解析（Welch 法の PSD とバンド RMS） ---
+# 入力は (..., サンプル数) の配列で、先頭の次元（センサー × 軸など）はまとめて1回の rfft で処理する。
+# 1センサーだけの場合も、エリア全体の場合も同じ関数を使う。
+# PSD は片側のパワースペクトル密度（単位²/Hz）で、PSD を周波数で積分すると分散（RMS²）になる。
+
+G = 9.80665
+
+# ISO 10816-3（グループ2・剛支持）の振動速度 RMS による評価区分の境界 (mm/s)
+ISO_BAND_HZ = (10.0, 1000.0)
+ISO_ZONES_MM_S = (1.4, 2.8, 4.5)
+
+# 閾値比による評価区分の境界（振動 RMS / 軸の閾値）。サンプリング周波数が ISO の帯域に届かない場合に使う
+RATIO_ZONES = (0.25, 0.5, 1.0)
+
+ZONE_LABELS = np.array(["A", "B", "C", "D"])
+
+
+def sample_rate(ts_ns):
+    # 時刻列 (..., n) [ns] から推定したサンプリング周波数 [Hz]（間隔の中央値から）
+    dt = np.median(np.diff(ts_ns, axis=-1), axis=-1)
+    return np.where(dt > 0, 1e9 / np.maximum(dt, 1), np.nan)
+
+
+def welch_psd(x, fs, nperseg=64):
+    # x: (..., n)  fs: スカラーまたは x の先頭次元と同じ形
+    # Hann 窓・50% 重なりの区間ごとに平均を引いて rfft し、区間平均を取る
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[-1]
+    nperseg = min(nperseg, n)
+    step = max(nperseg // 2, 1)
+    n_seg = 1 + (n - nperseg) // step
+    idx = step * np.arange(n_seg)[:, None] + np.arange(nperseg)
+    seg = x[..., idx]
+    seg = seg - seg.mean(axis=-1, keepdims=True)
+    window = np.hanning(nperseg + 1)[:-1]
+    spec = np.fft.rfft(seg * window, axis=-1)
+    psd = (spec.real ** 2 + spec.imag ** 2).mean(axis=-2)
+
+    fs = np.asarray(fs, dtype=np.float64)[..., None]
+    psd /= fs * (window ** 2).sum()
+    # 片側スペクトルにする（直流とナイキスト周波数は2倍しない）
+    psd[..., 1:] *= 2
+    if nperseg % 2 == 0:
+        psd[..., -1] /= 2
+    freqs = np.fft.rfftfreq(nperseg) * fs
+    return freqs, psd
+
+
+def band_rms(freqs, psd, lo, hi):
+    # 帯域 [lo, hi) の RMS（PSD の積分の平方根）
+    df = freqs[..., 1:2] - freqs[..., 0:1]
+    mask = (freqs >= lo) & (freqs < hi)
+    return np.sqrt(np.sum(np.where(mask, psd, 0.0), axis=-1) * df[..., 0])
+
+
+def velocity_rms(freqs, psd_g, lo, hi):
+    # 加速度 PSD [G²/Hz] を周波数領域で積分して振動速度 RMS [mm/s] を求める
+    df = freqs[..., 1:2] - freqs[..., 0:1]
+    mask = (freqs >= lo) & (freqs < hi) & (freqs > 0)
+    omega = 2 * np.pi * np.where(mask, freqs, 1.0)
+    v_psd = np.where(mask, psd_g * G ** 2 / omega ** 2, 0.0)
+    return np.sqrt(np.sum(v_psd, axis=-1) * df[..., 0]) * 1000
+
+
+def classify(values, bounds):
+    # 境界値の並びで A〜D の区分に分ける（NaN は空欄）
+    zones = ZONE_LABELS[np.searchsorted(np.asarray(bounds), values, side="right").clip(0, 3)]
+    return np.where(np.isnan(values), "", zones)
+
+
+def vibration_severity(ts_ns, values, limits, nperseg=64):
+    # センサーごとの振動評価（エリア全体を1回の FFT で処理する）
+    # ts_ns: (k, n)  values: (k, n, 3) の X/Y/Z 加速度 [G]  limits: (k, 3) の軸ごとの閾値
+    # 戻り値: 振動 RMS [G]（軸の最大）, 振動速度 RMS [mm/s]（算出できない場合 NaN）, 区分
+    fs = sample_rate(ts_ns)
+    freqs, psd = welch_psd(np.swapaxes(values, 1, 2), fs[:, None], nperseg)
+    nyquist = fs[:, None] / 2
+    acc = band_rms(freqs, psd, freqs[..., 1:2], np.inf)
+    acc_max = np.max(acc, axis=1)
+    if np.all(nyquist > ISO_BAND_HZ[0]):
+        vel = np.max(velocity_rms(freqs, psd, ISO_BAND_HZ[0], ISO_BAND_HZ[1]), axis=1)
+        zones = classify(vel, ISO_ZONES_MM_S)
+    else:
+        vel = np.full(len(fs), np.nan)
+        ratio = np.max(acc / limits, axis=1)
+        zones = classify(ratio, RATIO_ZONES)
+    return acc_max, vel, zones
@@ -0,0 +1,204 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# --- センサー状態の一括判定エンジン ---
+# 読み取り値・閾値は軸ごとの NumPy 配列（センサー番号順）で保持し、
+# 異常判定は配列演算1回で全センサー分を求める。
+
+AXES = ("x", "y", "z", "v")
+
+COLUMNS = {
+    "x": "X軸 (G)",
+    "y": "Y軸 (G)",
+    "z": "Z軸 (G)",
+    "v": "電圧 (V)",
+}
+
+# 一覧表の閾値比の列（並べ替えの基準）
+RATIO_COLUMN = "閾値比"
+
+# 異常フラグ（ビットマスク）
+FLAG_X = 1
+FLAG_Y = 2
+FLAG_Z = 4
+FLAG_V = 8
+
+FLAG_NAMES = [
+    (FLAG_X, "X軸"),
+    (FLAG_Y, "Y軸"),
+    (FLAG_Z, "Z軸"),
+    (FLAG_V, "電圧"),
+]
+
+
+def _build_status_labels():
+    labels = []
+    for flags in range(16):
+        names = [name for bit, name in FLAG_NAMES if flags & bit]
+        if names:
+            labels.append("⚠️ 異常 (" + ",".join(names) + ")")
+        else:
+            labels.append("正常")
+    return np.array(labels, dtype=object)
+
+
+# フラグ値 → 状態ラベルの対応表（16通りを事前生成）
+STATUS_LABELS = _build_status_labels()
+
+
+def compute_flags(readings, limits):
+    # X/Y/Z は閾値以上、電圧は下限値未満で異常
+    flags = (readings["x"] >= limits["x"]).astype(np.uint8) * FLAG_X
+    flags |= (readings["y"] >= limits["y"]).astype(np.uint8) * FLAG_Y
+    flags |= (readings["z"] >= limits["z"]).astype(np.uint8) * FLAG_Z
+    flags |= (readings["v"] < limits["v"]).astype(np.uint8) * FLAG_V
+    return flags
+
+
+def top_k(keys, k):
+    # keys の大きい順に上位 k 件の位置（同値は位置の順）。全体は並べ替えず、上位 k 件だけを並べる
+    k = min(k, len(keys))
+    if k < len(keys):
+        part = np.argpartition(-keys, k - 1)[:k]
+    else:
+        part = np.arange(len(keys))
+    return part[np.lexsort((part, -keys[part]))]
+
+
+# 判定結果ごとの通し番号（派生キャッシュの識別に使う）
+_versions = itertools.count(1)
+
+
+class FleetStatus:
+    # 1回分の判定結果（全センサー）。DataFrame は初回参照時に1度だけ作る
+    def __init__(self, sensor_ids, readings, limits, flags, area_slices, time_ns=None, threshold_version=None):
+        self.version = next(_versions)
+        self.sensor_ids = sensor_ids
+        self.time_ns = time_ns
+        self.threshold_version = threshold_version
+        self.readings = readings
+        self.limits = limits
+        self.flags = flags
+        self.area_slices = area_slices
+        self._frame = None
+        self._area_summary = None
+        # 一覧表の絞り込み・並べ替えに使う配列（条件ごとに初回参照時に1度だけ作る）
+        self._masks = {}
+        self._ratios = {}
+        self._area_of = None
+
+    @property
+    def status(self):
+        return STATUS_LABELS[self.flags]
+
+    def frame(self):
+        if self._frame is None:
+            data = {"センサーID": self.sensor_ids, "状態": self.status}
+            for a in AXES:
+                data[COLUMNS[a]] = self.readings[a]
+            self._frame = pd.DataFrame(data)
+        return self._frame
+
+    def area_frame(self, area_name):
+        sl = self.area_slices[area_name]
+        return self.frame().iloc[sl].reset_index(drop=True)
+
+    def area_limits(self, area_name):
+        sl = self.area_slices[area_name]
+        return {a: self.limits[a][sl] for a in AXES}
+
+    def area_summary(self):
+        # エリア別の集計（異常センサー数・X/Y/Z の最大値・電圧の最小値と、その閾値比）。
+        # エリアはセンサー番号の連続区間なので、各列 reduceat 1回で全エリア分が求まる。
+        # 欠測（NaN）のセンサーは fmax / fmin で無視する
+        if self._area_summary is None:
+            names = sorted(self.area_slices, key=lambda a: self.area_slices[a].start)
+            starts = np.array([self.area_slices[a].start for a in names])
+            ends = np.array([self.area_slices[a].stop for a in names])
+            data = {
+                "エリア": names,
+                "センサー数": ends - starts,
+                "異常数": np.add.reduceat((self.flags != 0).astype(np.int64), starts),
+            }
+            for a in ("x", "y", "z"):
+                data[a] = np.fmax.reduceat(self.readings[a], starts)
+                data[f"{a}_ratio"] = np.fmax.reduceat(self.readings[a] / self.limits[a], starts)
+            # 電圧は下限値判定なので、最小値と「下限値 / 値」（1以上で異常）を持つ
+            data["v"] = np.fmin.reduceat(self.readings["v"], starts)
+            data["v_ratio"] = np.fmax.reduceat(self.limits["v"] / self.readings["v"], starts)
+            self._area_summary = pd.DataFrame(data)
+        return self._area_summary
+
+    def mask(self, axis=None):
+        # 異常センサーの真偽配列（axis: 0〜3 を指定するとその軸の異常のみ）
+        bits = 15 if axis is None else (FLAG_X, FLAG_Y, FLAG_Z, FLAG_V)[axis]
+        m = self._masks.get(bits)
+        if m is None:
+            m = (self.flags & bits) != 0
+            self._masks[bits] = m
+        return m
+
+    def ratio(self, axis=None):
+        # 閾値比（1 以上で異常。電圧は「下限値 / 値」）。axis 省略時は4軸の最大。欠測は -inf
+        key = -1 if axis is None else axis
+        r = self._ratios.get(key)
+        if r is None:
+            if axis is None:
+                r = np.max(np.stack([self.ratio(j) for j in range(4)]), axis=0)
+            else:
+                a = AXES[axis]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    r = self.limits[a] / self.readings[a] if a == "v" else self.readings[a] / self.limits[a]
+                r = np.where(np.isnan(r), -np.inf, r)
+            self._ratios[key] = r
+        return r
+
+    def select(self, area_name=None, anomalies_only=False, axis=None, by_ratio=False, offset=0, limit=50):
+        # 一覧表の1ページ分（offset 件目から limit 件）のセンサー番号と、条件に合う件数を返す。
+        # area_name=None は全エリア。by_ratio は閾値比の高い順（上位 offset + limit 件だけを並べる）
+        sl = self.area_slices[area_name] if area_name is not None else slice(0, len(self.flags))
+        if anomalies_only:
+            idx = np.flatnonzero(self.mask(axis)[sl]) + sl.start
+        else:
+            idx = np.arange(sl.start, sl.stop)
+        total = len(idx)
+        if by_ratio:
+            idx = idx[top_k(self.ratio(axis)[idx], offset + limit)]
+        return idx[offset:offset + limit], total
+
+    def rows_frame(self, idx, axis=None, with_area=False):
+        # 指定センサーだけの表示用 DataFrame（全センサー分の DataFrame は作らない）
+        data = {"センサーID": self.sensor_ids[idx]}
+        if with_area:
+            if self._area_of is None:
+                names = sorted(self.area_slices, key=lambda a: self.area_slices[a].start)
+                starts = np.array([self.area_slices[a].start for a in names])
+                self._area_of = (np.array(names, dtype=object), starts)
+            names, starts = self._area_of
+            data["エリア"] = names[np.searchsorted(starts, idx, side="right") - 1]
+        data["状態"] = STATUS_LABELS[self.flags[idx]]
+        for a in AXES:
+            data[COLUMNS[a]] = self.readings[a][idx]
+        ratio = self.ratio(axis)[idx]
+        data[RATIO_COLUMN] = np.where(ratio == -np.inf, np.nan, ratio)
+        return pd.DataFrame(data)
+
+    def rows_limits(self, idx):
+        return {a: self.limits[a][idx] for a in AXES}
+
+    def anomaly_count(self, area_name=None):
+        flags = self.flags if area_name is None else self.flags[self.area_slices[area_name]]
+        return int(np.count_nonzero(flags))
+
+
+class FleetStatusEngine:
+    # センサー構成（ID 一覧・エリア範囲）は固定なので一度だけ組み立てる
+    def __init__(self, sensor_ids, area_slices):
+        self.sensor_ids = np.asarray(sensor_ids, dtype=object)
+        self.area_slices = dict(area_slices)
+
+    def evaluate(self, readings, limits, time_ns=None, threshold_version=None):
+        flags = compute_flags(readings, limits)
+        return FleetStatus(self.sensor_ids, readings, limits, flags, self.area_slices, time_ns, threshold_version)
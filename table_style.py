@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from status_engine import AXES, COLUMNS
+
+# --- センサー一覧表の強調表示 ---
+# 行ごとの Styler.apply ではなく、閾値配列と列ごとに1回ずつ比較して
+# CSS の2次元配列をまとめて作る。
+
+STATUS_CSS = 'color: red; font-weight: bold;'
+ALERT_CSS = 'background-color: #ffcccc; color: red; font-weight: bold;'
+
+TABLE_FORMAT = {
+    "X軸 (G)": "{:.3f}", "Y軸 (G)": "{:.3f}", "Z軸 (G)": "{:.3f}", "電圧 (V)": "{:.2f}", "閾値比": "{:.2f}"
+}
+
+# 振動評価（spectrum.vibration_severity）の列。区分 C は注意、D は警報として強調する
+SEVERITY_COLUMN = "振動区分"
+SEVERITY_CSS = {"C": 'background-color: #fff3cd; color: #8a6d3b; font-weight: bold;', "D": ALERT_CSS}
+SPECTRUM_FORMAT = {"振動RMS (G)": "{:.3f}", "振動速度 (mm/s)": "{:.2f}"}
+
+
+def highlight_cells(df, limits):
+    # limits: 軸ごとの閾値配列（df の行と同じ並び）
+    # X/Y/Z は閾値以上、電圧は下限値未満のセルを強調し、いずれかがあれば状態列も赤字にする
+    css = np.full(df.shape, '', dtype=object)
+    any_over = np.zeros(len(df), dtype=bool)
+    for a in AXES:
+        col = COLUMNS[a]
+        values = df[col].to_numpy()
+        over = values < limits[a] if a == "v" else values >= limits[a]
+        css[:, df.columns.get_loc(col)] = np.where(over, ALERT_CSS, '')
+        any_over |= over
+    css[:, df.columns.get_loc("状態")] = np.where(any_over, STATUS_CSS, '')
+    if SEVERITY_COLUMN in df.columns:
+        zones = df[SEVERITY_COLUMN].to_numpy()
+        col = df.columns.get_loc(SEVERITY_COLUMN)
+        for zone, zone_css in SEVERITY_CSS.items():
+            css[:, col] = np.where(zones == zone, zone_css, css[:, col])
+    return pd.DataFrame(css, index=df.index, columns=df.columns)
+
+
+def style_table(df, limits=None, css=None):
+    # css（highlight_cells の結果）を渡せば比較をやり直さずに Styler だけを作る。
+    # Styler は描画時に内部状態を書き換えるので、共有せずに描画ごとに作る
+    if css is None:
+        css = highlight_cells(df, limits)
+    formats = {**TABLE_FORMAT, **{c: f for c, f in SPECTRUM_FORMAT.items() if c in df.columns}}
+    return df.style.apply(lambda _: css, axis=None).format(formats, na_rep="-")
+
+
+# 複数センサー比較の集計表。同じエリアのセンサーとの差（z スコア）が大きい行を強調する
+Z_COLUMN = "zスコア"
+Z_WARN = 2.0
+Z_ALERT = 3.0
+COMPARE_FORMAT = {"平均": "{:.3f}", "RMS": "{:.3f}", "最大": "{:.3f}", "最小": "{:.3f}", Z_COLUMN: "{:+.2f}"}
+
+
+def style_compare(df):
+    z = np.abs(df[Z_COLUMN].to_numpy(dtype=np.float64))
+    css = np.full(df.shape, '', dtype=object)
+    col = df.columns.get_loc(Z_COLUMN)
+    css[:, col] = np.where(z >= Z_ALERT, ALERT_CSS, np.where(z >= Z_WARN, SEVERITY_CSS["C"], ''))
+    css = pd.DataFrame(css, index=df.index, columns=df.columns)
+    return df.style.apply(lambda _: css, axis=None).format(COMPARE_FORMAT, na_rep="-")
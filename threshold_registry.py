@@ -0,0 +1,184 @@
+import contextlib
+import csv
+import io
+import itertools
+import math
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from status_engine import AXES
+
+# --- 閾値レジストリ（プロセス全体で共有・SQLite に永続化） ---
+# 実効閾値は「全体デフォルト → エリア別デフォルト → センサー個別設定」の順に上書きして決まる。
+# 判定用にはセンサー番号で引ける軸ごとの配列（密な NumPy 配列）として持ち、
+# 変更のたびに作り直して version を進める。配列は作り直すので、参照中の側が
+# 途中で書き換わった値を見ることはない。
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sensor_thresholds (
+    sensor_id TEXT PRIMARY KEY,
+    x REAL NOT NULL, y REAL NOT NULL, z REAL NOT NULL, v REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS area_thresholds (
+    area TEXT PRIMARY KEY,
+    x REAL NOT NULL, y REAL NOT NULL, z REAL NOT NULL, v REAL NOT NULL
+);
+"""
+
+CSV_HEADER = ["sensor_id", "x", "y", "z", "v"]
+
+
+def _check_values(values, where=""):
+    # 閾値は 0 以上の有限の数だけ受け付ける（NaN は比較が常に偽になり、そのセンサーの警報が出なくなる）
+    if not all(math.isfinite(value) for value in values):
+        raise ValueError(f"{where}閾値に数値以外（NaN・無限大）は設定できません。")
+    if any(value < 0 for value in values):
+        raise ValueError(f"{where}閾値に負の数は設定できません。")
+
+
+# 設定の版番号。センサー構成の変更でレジストリを作り直しても、以前と同じ番号にはならない
+_versions = itertools.count(1)
+
+
+class ThresholdRegistry:
+    def __init__(self, db_path, sensor_ids, area_slices, defaults):
+        self.db_path = db_path
+        self.sensor_ids = list(sensor_ids)
+        self.index = {s: i for i, s in enumerate(self.sensor_ids)}
+        self.area_slices = dict(area_slices)
+        self.defaults = {a: float(defaults[a]) for a in AXES}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._reload()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # 1回の操作ごとに接続し、正常終了ならコミットして必ず閉じる
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn, conn:
+            yield conn
+
+    def _reload(self):
+        # DB の内容から配列を組み立て直す
+        with self._connect() as conn:
+            sensor_rows = conn.execute("SELECT sensor_id, x, y, z, v FROM sensor_thresholds").fetchall()
+            area_rows = conn.execute("SELECT area, x, y, z, v FROM area_thresholds").fetchall()
+
+        n = len(self.sensor_ids)
+        area_defaults = {row[0]: dict(zip(AXES, row[1:])) for row in area_rows if row[0] in self.area_slices}
+        base = {a: np.full(n, self.defaults[a]) for a in AXES}
+        for area, conf in area_defaults.items():
+            for a in AXES:
+                base[a][self.area_slices[area]] = conf[a]
+
+        limits = {a: base[a].copy() for a in AXES}
+        custom = np.zeros(n, dtype=bool)
+        for row in sensor_rows:
+            i = self.index.get(row[0])
+            if i is None:
+                continue
+            custom[i] = True
+            for a, value in zip(AXES, row[1:]):
+                limits[a][i] = value
+
+        self.base = base
+        self.limits = limits
+        self.custom = custom
+        self.area_defaults = area_defaults
+        self.version = next(_versions)
+
+    # --- 参照 ---
+    def get(self, sensor_id):
+        i = self.index[sensor_id]
+        return {a: float(self.limits[a][i]) for a in AXES}
+
+    def default_for(self, sensor_id):
+        # 個別設定がない場合に適用される値（エリア別デフォルトまたは全体デフォルト）
+        i = self.index[sensor_id]
+        return {a: float(self.base[a][i]) for a in AXES}
+
+    def is_custom(self, sensor_id):
+        return bool(self.custom[self.index[sensor_id]])
+
+    # --- 更新 ---
+    def set_many(self, configs):
+        # {センサーID: {x, y, z, v}} を1トランザクションで反映する。
+        # 適用されるデフォルトと同じ値のセンサーは個別設定を削除する
+        values_by_sensor = {}
+        for sensor_id, conf in configs.items():
+            if sensor_id not in self.index:
+                raise ValueError(f"不明なセンサーIDです: {sensor_id}")
+            values = [float(conf[a]) for a in AXES]
+            _check_values(values, f"{sensor_id}: ")
+            values_by_sensor[sensor_id] = values
+        with self.lock:
+            # デフォルトとの比較は、他の更新で base が作り直されないようロック内で行う
+            upserts, deletes = [], []
+            for sensor_id, values in values_by_sensor.items():
+                if values == [self.base[a][self.index[sensor_id]] for a in AXES]:
+                    deletes.append((sensor_id,))
+                else:
+                    upserts.append((sensor_id, *values))
+            with self._connect() as conn:
+                conn.executemany("DELETE FROM sensor_thresholds WHERE sensor_id = ?", deletes)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO sensor_thresholds (sensor_id, x, y, z, v) VALUES (?, ?, ?, ?, ?)",
+                    upserts,
+                )
+            self._reload()
+        return len(upserts), len(deletes)
+
+    def set(self, sensor_id, conf):
+        return self.set_many({sensor_id: conf})
+
+    def reset(self, sensor_id):
+        with self.lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM sensor_thresholds WHERE sensor_id = ?", (sensor_id,))
+            self._reload()
+
+    def set_area_default(self, area, conf):
+        values = [float(conf[a]) for a in AXES]
+        _check_values(values)
+        with self.lock:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO area_thresholds (area, x, y, z, v) VALUES (?, ?, ?, ?, ?)",
+                    (area, *values),
+                )
+            self._reload()
+
+    def clear_area_default(self, area):
+        with self.lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM area_thresholds WHERE area = ?", (area,))
+            self._reload()
+
+    # --- CSV 一括入出力 ---
+    def export_csv(self):
+        # 全センサーの実効閾値を出力する
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(CSV_HEADER)
+        columns = [self.limits[a] for a in AXES]
+        for i, sensor_id in enumerate(self.sensor_ids):
+            writer.writerow([sensor_id] + [f"{c[i]:g}" for c in columns])
+        return buf.getvalue()
+
+    def import_csv(self, text):
+        reader = csv.DictReader(io.StringIO(text))
+        if reader.fieldnames is None or any(c not in reader.fieldnames for c in CSV_HEADER):
+            raise ValueError("CSV の列は " + ",".join(CSV_HEADER) + " が必要です。")
+        configs = {}
+        for line_no, row in enumerate(reader, start=2):
+            try:
+                conf = {a: float(row[a]) for a in AXES}
+            except (TypeError, ValueError):
+                raise ValueError(f"{line_no}行目: 数値に変換できない値があります。")
+            _check_values(conf.values(), f"{line_no}行目: ")
+            configs[row["sensor_id"].strip()] = conf
+        return self.set_many(configs)
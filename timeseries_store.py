@@ -0,0 +1,186 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# --- センサー別リングバッファ（時系列ストア） ---
+# センサーごとに固定長のリングバッファを持つ。書き込み位置 p とその鏡像 p+capacity の
+# 2か所に同じ値を書くことで、直近 N 件が常に連続領域になり、ゼロコピーで切り出せる。
+#
+# メモリ使用量は確保時に決まり、以後増えない:
+#   センサー数 × capacity × 2(鏡像) × (時刻 8B + X/Y/Z/V 4B×4) = 48B × capacity × センサー数
+#   例）10,000センサー × 1時間(3,600点, 1Hz) ≒ 1.7GB
+
+VALUE_COLUMNS = ["X軸 (G)", "Y軸 (G)", "Z軸 (G)", "電圧 (V)"]
+
+NS_PER_SEC = 1_000_000_000
+
+
+class SampleStore:
+    def __init__(self, sensor_ids, capacity):
+        self.sensor_ids = list(sensor_ids)
+        self.index = {s: i for i, s in enumerate(self.sensor_ids)}
+        self.capacity = int(capacity)
+        n = len(self.sensor_ids)
+        # 時刻は UNIX エポックからのナノ秒（int64）
+        self.ts = np.zeros((n, 2 * self.capacity), dtype=np.int64)
+        self.values = np.zeros((n, 2 * self.capacity, 4), dtype=np.float32)
+        self.head = np.zeros(n, dtype=np.int64)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.last_ns = 0
+        self.lock = threading.Lock()
+        self.feed_lock = threading.Lock()
+        # 追加サンプルを差分で受け取る集計・永続化（rollup.Rollup, history_store.HistoryStore など）
+        self.sinks = []
+
+    @property
+    def nbytes(self):
+        return self.ts.nbytes + self.values.nbytes
+
+    def append(self, sensor_index, t_ns, x, y, z, v):
+        # 1点追加（O(1)）
+        with self.lock:
+            p = self.head[sensor_index]
+            row = (x, y, z, v)
+            self.ts[sensor_index, p] = t_ns
+            self.ts[sensor_index, p + self.capacity] = t_ns
+            self.values[sensor_index, p] = row
+            self.values[sensor_index, p + self.capacity] = row
+            self.head[sensor_index] = (p + 1) % self.capacity
+            self.count[sensor_index] = min(self.count[sensor_index] + 1, self.capacity)
+            self.last_ns = max(self.last_ns, int(t_ns))
+        for sink in self.sinks:
+            sink.add([sensor_index], [t_ns], [(x, y, z, v)])
+
+    def append_many(self, sensor_index, times_ns, values):
+        # 1センサー分の複数サンプル（時刻昇順）をまとめて追加する
+        times_ns = np.asarray(times_ns, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        k = len(times_ns)
+        if k == 0:
+            return
+        with self.lock:
+            tail = min(k, self.capacity)
+            pos = (self.head[sensor_index] + np.arange(k - tail, k)) % self.capacity
+            for offset in (0, self.capacity):
+                self.ts[sensor_index, pos + offset] = times_ns[-tail:]
+                self.values[sensor_index, pos + offset] = values[-tail:]
+            self.head[sensor_index] = (self.head[sensor_index] + k) % self.capacity
+            self.count[sensor_index] = min(self.count[sensor_index] + k, self.capacity)
+            self.last_ns = max(self.last_ns, int(times_ns[-1]))
+        for sink in self.sinks:
+            sink.add(np.full(k, sensor_index), times_ns, values)
+
+    def append_batch(self, sensor_idx, times_ns, values):
+        # センサーが混在したサンプル列をまとめて追加する（受信データ用）
+        # sensor_idx: (m,)  times_ns: (m,)  values: (m, 4)
+        sensor_idx = np.asarray(sensor_idx, dtype=np.int64)
+        times_ns = np.asarray(times_ns, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        m = len(sensor_idx)
+        if m == 0:
+            return
+        # センサー・時刻順に並べ、センサー内での順位から書き込み位置を決める
+        order = np.lexsort((times_ns, sensor_idx))
+        s_idx, t, vals = sensor_idx[order], times_ns[order], values[order]
+        counts = np.bincount(s_idx, minlength=len(self.sensor_ids))
+        group_start = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        rank = np.arange(m) - group_start[s_idx]
+        # 1バッチで容量を超えるセンサーは新しい方だけを残す
+        keep = rank >= counts[s_idx] - self.capacity
+        s_idx, t, vals, rank = s_idx[keep], t[keep], vals[keep], rank[keep]
+        with self.lock:
+            pos = (self.head[s_idx] + rank) % self.capacity
+            for offset in (0, self.capacity):
+                self.ts[s_idx, pos + offset] = t
+                self.values[s_idx, pos + offset] = vals
+            self.head = (self.head + counts) % self.capacity
+            self.count = np.minimum(self.count + counts, self.capacity)
+            self.last_ns = max(self.last_ns, int(t.max()))
+        for sink in self.sinks:
+            sink.add(sensor_idx, times_ns, values)
+
+    def append_ticks(self, times_ns, values):
+        # 全センサー同時刻のサンプルを k 件まとめて追加する
+        # times_ns: (k,)  values: (k, センサー数, 4)
+        times_ns = np.asarray(times_ns, dtype=np.int64)
+        k = len(times_ns)
+        if k == 0:
+            return
+        if k > self.capacity:
+            times_ns = times_ns[-self.capacity:]
+            values = values[-self.capacity:]
+            k = self.capacity
+        with self.lock:
+            rows = np.arange(len(self.sensor_ids))[:, None]
+            pos = (self.head[:, None] + np.arange(k)) % self.capacity
+            block = np.swapaxes(values, 0, 1)
+            for offset in (0, self.capacity):
+                self.ts[rows, pos + offset] = times_ns
+                self.values[rows, pos + offset] = block
+            self.head = (self.head + k) % self.capacity
+            self.count = np.minimum(self.count + k, self.capacity)
+            self.last_ns = max(self.last_ns, int(times_ns[-1]))
+        for sink in self.sinks:
+            sink.add_ticks(times_ns, values)
+
+    def extend_to(self, now_ns, period_ns, source):
+        # 最終時刻から now_ns まで period_ns 間隔で欠けている時刻を source(times) の値で補う
+        # source(times) は時刻 (k,) に対する (k, センサー数, 4) の配列を返す（デモ用の模擬データ供給）
+        with self.feed_lock:
+            now_tick = now_ns // period_ns
+            if self.last_ns:
+                first_tick = self.last_ns // period_ns + 1
+            else:
+                first_tick = now_tick - self.capacity + 1
+            first_tick = max(first_tick, now_tick - self.capacity + 1)
+            k = int(now_tick - first_tick + 1)
+            if k <= 0:
+                return 0
+            times = np.arange(first_tick, now_tick + 1, dtype=np.int64) * period_ns
+            self.append_ticks(times, source(times))
+            return k
+
+    def _valid(self, sensor_index):
+        # 有効な全サンプルの連続ビュー（古い順）
+        end = self.head[sensor_index] + self.capacity
+        start = end - self.count[sensor_index]
+        return self.ts[sensor_index, start:end], self.values[sensor_index, start:end]
+
+    def window(self, sensor_index, seconds, end_ns=None):
+        # 直近 seconds 秒間（end_ns 指定時はその時刻まで）のコピーを返す。
+        # リングが一杯になると追加で古い位置から上書きされるため、範囲の検索と複製はロック内で行う
+        # （連続領域なので、複製は切り出した範囲の1回のコピーで済む）
+        with self.lock:
+            ts, vals = self._valid(sensor_index)
+            if end_ns is None:
+                end_ns = self.last_ns
+            lo = np.searchsorted(ts, end_ns - int(seconds * NS_PER_SEC), side="right")
+            hi = np.searchsorted(ts, end_ns, side="right")
+            return ts[lo:hi].copy(), vals[lo:hi].copy()
+
+    def recent(self, sensor_index, m):
+        # 指定センサー（slice または番号の配列）それぞれの直近 m 件（古い順、m <= capacity）のコピー。
+        # (k, m) の時刻・(k, m, 4) の値と、m 件そろっているかどうかを返す
+        idx = np.arange(len(self.sensor_ids))[sensor_index]
+        with self.lock:
+            cols = (self.head[idx] + self.capacity - m)[:, None] + np.arange(m)
+            ts = self.ts[idx[:, None], cols]
+            vals = self.values[idx[:, None], cols]
+            full = self.count[idx] >= m
+        return ts, vals, full
+
+    def latest(self):
+        # 各センサーの最新値（軸ごとの配列）
+        with self.lock:
+            p = self.head + self.capacity - 1
+            rows = np.arange(len(self.sensor_ids))
+            last = self.values[rows, p].astype(np.float64)
+            # まだ1点も届いていないセンサーは欠測（NaN）とする
+            last[self.count == 0] = np.nan
+        return {"x": last[:, 0], "y": last[:, 1], "z": last[:, 2], "v": last[:, 3]}
+
+
+def to_frame(ts, vals, tz):
+    index = pd.DatetimeIndex(ts.view("datetime64[ns]"), name="timestamp").tz_localize("UTC").tz_convert(tz)
+    return pd.DataFrame(vals, index=index, columns=VALUE_COLUMNS)
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# --- センサー構成（トポロジー）レジストリ ---
+# 構成ファイル（CSV: sensor_id,area[,number]）からセンサーとエリアの対応を読み込む。
+#   sensor_id: センサーID（一意）
+#   area:      設置エリア名。エリアの並び順はファイル内での初出順
+#   number:    受信パケット上のセンサー番号（省略時は行番号 1, 2, ...）
+# センサーはエリアごとにまとめて並べ替え、各エリアが連続した番号区間になるようにする。
+# 配列で持つデータ（読み取り値・閾値・ロールアップなど）は、エリアを slice 1つで切り出せる。
+# ID ↔ 番号、エリア → 区間の対応は読み込み時に1度だけ作り、以後は書き換えない。
+
+REQUIRED_COLUMNS = ["sensor_id", "area"]
+
+
+class Topology:
+    def __init__(self, sensor_ids, sensor_areas, numbers=None, version=0):
+        sensor_ids = np.asarray(sensor_ids, dtype=object)
+        sensor_areas = np.asarray(sensor_areas, dtype=object)
+        if numbers is None:
+            numbers = np.arange(1, len(sensor_ids) + 1)
+        numbers = np.asarray(numbers, dtype=np.int64)
+        if len(sensor_ids) == 0:
+            raise ValueError("センサーが1件も定義されていません。")
+        if len(pd.unique(sensor_ids)) != len(sensor_ids):
+            raise ValueError("センサーIDが重複しています。")
+        if len(np.unique(numbers)) != len(numbers) or numbers.min() < 0:
+            raise ValueError("センサー番号が重複しているか、負の数です。")
+
+        # エリアの初出順にまとめる（エリア内は元の順序を保つ）
+        codes, area_names = pd.factorize(sensor_areas)
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(area_names))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        self.version = version
+        self.sensor_ids = sensor_ids[order].tolist()
+        self.numbers = numbers[order]
+        self.area_names = [str(a) for a in area_names]
+        self.sensor_area = codes[order].astype(np.int64)
+        self.index = {s: i for i, s in enumerate(self.sensor_ids)}
+        self.area_index = {a: i for i, a in enumerate(self.area_names)}
+        self.area_slices = {
+            a: slice(int(start), int(start + count))
+            for a, start, count in zip(self.area_names, starts, counts)
+        }
+
+    def __len__(self):
+        return len(self.sensor_ids)
+
+    def sensors_in(self, area_name):
+        return self.sensor_ids[self.area_slices[area_name]]
+
+
+def even_topology(area_names, total_sensors, version=0):
+    # 構成ファイルがない場合の既定構成（センサーを各エリアに均等に割り当てる）
+    avg = total_sensors // len(area_names)
+    areas = [area_names[min(i // avg, len(area_names) - 1)] for i in range(total_sensors)]
+    sensor_ids = [f"Sensor-{str(i).zfill(3)}" for i in range(1, total_sensors + 1)]
+    return Topology(sensor_ids, areas, version=version)
+
+
+def load_topology(path, version=0):
+    df = pd.read_csv(path, dtype=str, skipinitialspace=True).dropna(how="all")
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"構成ファイルに列 {', '.join(missing)} がありません。")
+    if df[REQUIRED_COLUMNS].isna().any().any():
+        raise ValueError("sensor_id または area が空の行があります。")
+    numbers = None
+    if "number" in df.columns:
+        try:
+            numbers = df["number"].astype(np.int64).to_numpy()
+        except ValueError:
+            raise ValueError("number 列に整数でない値があります。") from None
+    return Topology(df["sensor_id"].str.strip().to_numpy(), df["area"].str.strip().to_numpy(), numbers, version)
+
+
+class TopologyRegistry:
+    # 構成ファイルの更新（更新時刻・サイズの変化）を check_interval 秒ごとに確認し、
+    # 変わっていれば読み直して version を進める。読み込みに失敗した場合は直前の構成を使い続ける
+    def __init__(self, path, fallback, check_interval=2.0):
+        self.path = path
+        self.fallback = fallback
+        self.check_interval = check_interval
+        self.error = None
+        self._stamp = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._version = 0
+        self._topology = None
+        self._refresh()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        self._checked = time.monotonic()
+        if stamp == self._stamp and self._topology is not None:
+            return
+        self._version += 1
+        try:
+            if stamp is None:
+                topology = self.fallback(self._version)
+            else:
+                topology = load_topology(self.path, self._version)
+        except (OSError, ValueError, pd.errors.ParserError) as e:
+            self.error = f"{self.path}: {e}"
+            if self._topology is None:
+                raise
+        else:
+            self._topology = topology
+            self.error = None
+        self._stamp = stamp
+
+    @property
+    def current(self):
+        if time.monotonic() - self._checked >= self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked >= self.check_interval:
+                    self._refresh()
+        return self._topology